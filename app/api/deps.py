@@ -0,0 +1,294 @@
+"""
+API 依赖注入
+
+应用内共享的服务实例（复用 HttpClientRegistry 中的连接池），
+在 lifespan 关闭时通过 reset_dependencies 释放。
+"""
+
+import secrets
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from fastapi import Header, HTTPException
+from app.config import get_settings
+from app.core.http_client import http_clients
+from app.core.loop_monitor import loop_monitor
+from app.core.redis import redis_service
+from app.dify.dify_client import DifyHttpClient
+from app.dify.concurrency import AdaptiveConcurrencyLimiter
+from app.dify.hedging import HedgePolicy
+from app.dify.key_pool import DifyApiKeyPool
+from app.dify.dify_cache import DifyResponseCache
+from app.dify.dify_knowledge_base import DifyKnowledgeBase
+from app.services.database_service import DatabaseService
+from app.services.external_api_client import ExternalAPIClient
+from app.services.pdf_extractor import PdfTextExtractor
+from app.services.near_duplicate import NearDuplicateDetector
+from app.services.pdf_splitter import PdfSplitter
+from app.services.dify_kb_service import DifyKnowledgeBaseService
+from app.services.indexing_backpressure import IndexingBackpressure
+from app.services.build_tasks import BuildTaskRegistry
+from app.services.build_admission import BuildAdmissionController
+from app.services.file_cache import LocalFileCache
+from app.services.webhooks import WebhookOutbox
+from app.services.http_cache import DiskCacheBackend, HttpResponseCache, RedisCacheBackend
+from app.services.knowledge_builder import KnowledgeBuilder
+
+
+@lru_cache(maxsize=1)
+def get_dify_client() -> DifyHttpClient:
+    """共享的 Dify HTTP 客户端"""
+    settings = get_settings()
+    upload_limiter = None
+    if settings.dify_adaptive_concurrency:
+        upload_limiter = AdaptiveConcurrencyLimiter(
+            initial=settings.dify_upload_concurrency_initial,
+            min_limit=settings.dify_upload_concurrency_min,
+            max_limit=settings.dify_upload_concurrency_max,
+        )
+    hedge_policy = None
+    if settings.dify_hedge_enabled:
+        hedge_policy = HedgePolicy(
+            percentile=settings.dify_hedge_percentile,
+            budget_ratio=settings.dify_hedge_budget,
+        )
+    return DifyHttpClient(
+        base_url=settings.dify_base_url,
+        api_key=DifyApiKeyPool(
+            settings.dify_api_keys,
+            rate_limit_cooldown=settings.dify_key_rate_limit_cooldown,
+            auth_cooldown=settings.dify_key_auth_cooldown,
+            max_wait=settings.dify_key_max_wait,
+        ),
+        timeout=settings.http_timeout,
+        client=http_clients.dify_read(),
+        upload_client=http_clients.dify_upload(),
+        single_flight=settings.dify_single_flight,
+        upload_limiter=upload_limiter,
+        hedge_policy=hedge_policy,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_dify_knowledge_base() -> DifyKnowledgeBase:
+    """共享的 Dify 知识库接口封装（按配置启用读缓存）"""
+    settings = get_settings()
+    cache = None
+    if settings.dify_cache_enabled:
+        cache = DifyResponseCache(
+            redis=redis_service,
+            ttls=settings.dify_cache_ttls,
+            local_max_entries=settings.dify_cache_local_max_entries,
+            local_ttl=settings.dify_cache_local_ttl,
+        )
+    return DifyKnowledgeBase(get_dify_client(), cache=cache)
+
+
+@lru_cache(maxsize=1)
+def get_external_api_client() -> ExternalAPIClient:
+    """共享的外部API客户端（按配置启用响应缓存）"""
+    settings = get_settings()
+    cache = None
+    if settings.external_cache_backend == "disk":
+        backend = DiskCacheBackend(settings.external_cache_dir, settings.external_cache_max_bytes)
+        cache = HttpResponseCache(backend, default_ttl=settings.external_cache_default_ttl)
+    elif settings.external_cache_backend == "redis":
+        cache = HttpResponseCache(RedisCacheBackend(redis_service), default_ttl=settings.external_cache_default_ttl)
+    return ExternalAPIClient(
+        client=http_clients.external(),
+        cache=cache,
+        redis=redis_service,
+        preflight_timeout=settings.url_preflight_timeout,
+        preflight_connect_timeout=settings.url_preflight_connect_timeout,
+        preflight_ttl=settings.url_preflight_ttl,
+        preflight_negative_ttl=settings.url_preflight_negative_ttl,
+        preflight_transient_ttl=settings.url_preflight_transient_ttl,
+        preflight_concurrency=settings.url_preflight_concurrency,
+        max_download_bytes=settings.download_max_bytes,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_pdf_extractor() -> PdfTextExtractor:
+    """共享的 PDF 文本提取器（进程池在首次提取时创建）"""
+    settings = get_settings()
+    return PdfTextExtractor(
+        max_workers=settings.pdf_extract_workers or None,
+        pages_per_task=settings.pdf_extract_pages_per_task,
+        cache_dir=settings.pdf_extract_cache_dir,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_near_duplicate_detector() -> NearDuplicateDetector:
+    """共享的近重复检测器"""
+    settings = get_settings()
+    return NearDuplicateDetector(
+        threshold=settings.dedup_threshold,
+        num_perm=settings.dedup_num_perm,
+        bands=settings.dedup_bands,
+        store_dir=settings.dedup_store_dir,
+        max_shingles=settings.dedup_max_shingles,
+        executor=get_pdf_extractor().get_executor(),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_indexing_backpressure() -> IndexingBackpressure:
+    """共享的索引队列背压控制器（同一进程内的所有上传共用水位统计）"""
+    settings = get_settings()
+    return IndexingBackpressure(
+        get_dify_knowledge_base(),
+        high_water=settings.indexing_high_water,
+        low_water=settings.indexing_low_water,
+        poll_interval=settings.indexing_poll_interval,
+        poll_concurrency=settings.indexing_poll_concurrency,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_dify_kb_service() -> DifyKnowledgeBaseService:
+    """共享的 Dify 知识库业务服务（按配置启用本地文本提取、近重复检测与大文件拆分）"""
+    settings = get_settings()
+    # 近重复检测同样需要从 PDF 中提取文本
+    use_extractor = settings.pdf_local_extract_enabled or settings.dedup_enabled
+    return DifyKnowledgeBaseService(
+        get_dify_knowledge_base(),
+        pdf_extractor=get_pdf_extractor() if use_extractor else None,
+        dedup=get_near_duplicate_detector() if settings.dedup_enabled else None,
+        splitter=PdfSplitter(
+            max_bytes=settings.pdf_split_max_bytes,
+            max_pages=settings.pdf_split_max_pages,
+            output_dir=settings.pdf_split_dir,
+        ),
+        split_upload_concurrency=settings.pdf_split_upload_concurrency,
+        backpressure=get_indexing_backpressure() if settings.indexing_backpressure_enabled else None,
+        redis=redis_service,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_database_service() -> DatabaseService:
+    """共享的数据库服务"""
+    return DatabaseService()
+
+
+@lru_cache(maxsize=1)
+def get_download_cache() -> LocalFileCache:
+    """共享的 PDF 下载缓存（容量受限，按 LRU / 保留时间淘汰）"""
+    settings = get_settings()
+    return LocalFileCache(
+        settings.download_cache_dir,
+        max_bytes=settings.download_cache_max_bytes,
+        max_age=settings.download_cache_max_age,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_knowledge_builder() -> KnowledgeBuilder:
+    """共享的知识库构建器"""
+    settings = get_settings()
+    return KnowledgeBuilder(
+        get_dify_knowledge_base(),
+        get_external_api_client(),
+        get_database_service(),
+        kb_service=get_dify_kb_service(),
+        redis=redis_service,
+        lock_ttl=settings.build_lock_ttl,
+        lock_wait_timeout=settings.build_lock_wait_timeout,
+        download_dir=settings.download_cache_dir,
+        passthrough=settings.download_passthrough,
+        file_cache=get_download_cache(),
+        pdf_local_extract=settings.pdf_local_extract_enabled,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_build_task_registry() -> BuildTaskRegistry:
+    """共享的构建任务幂等登记"""
+    return BuildTaskRegistry(redis_service, completed_ttl=get_settings().build_idempotency_ttl)
+
+
+@lru_cache(maxsize=1)
+def get_build_admission() -> BuildAdmissionController:
+    """共享的构建准入控制器"""
+    settings = get_settings()
+    return BuildAdmissionController(
+        max_concurrent=settings.build_max_concurrent,
+        max_pending=settings.build_max_pending,
+        default_build_seconds=settings.build_default_seconds,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_webhook_outbox() -> WebhookOutbox:
+    """共享的构建回调发件箱"""
+    settings = get_settings()
+    return WebhookOutbox(
+        redis_service,
+        http_clients.get("webhook", timeout=settings.webhook_timeout),
+        secret=settings.webhook_secret,
+        max_attempts=settings.webhook_max_attempts,
+        retry_base=settings.webhook_retry_base,
+        retry_max=settings.webhook_retry_max,
+        poll_interval=settings.webhook_poll_interval,
+        lease=settings.webhook_timeout * 3,
+        allow_private_hosts=settings.webhook_allow_private_hosts,
+    )
+
+
+def collect_metrics() -> Dict[str, Any]:
+    """汇总运行指标（只读取已创建的共享实例，不会因此创建新实例）"""
+    metrics: Dict[str, Any] = {"event_loop": loop_monitor.snapshot()}
+    if get_build_admission.cache_info().currsize:
+        metrics["builds"] = get_build_admission().snapshot()
+    if get_dify_client.cache_info().currsize:
+        client = get_dify_client()
+        metrics["dify_api_keys"] = client.key_pool.snapshot()
+        if client.upload_limiter is not None:
+            metrics["dify_upload_concurrency"] = client.upload_limiter.snapshot()
+        if client.hedge_policy is not None:
+            metrics["dify_hedging"] = client.hedge_policy.snapshot()
+    if get_external_api_client.cache_info().currsize and get_external_api_client().cache is not None:
+        metrics["external_cache"] = get_external_api_client().cache.get_stats()
+    if get_download_cache.cache_info().currsize:
+        metrics["download_cache"] = get_download_cache().get_stats()
+    if get_webhook_outbox.cache_info().currsize:
+        metrics["webhooks"] = dict(get_webhook_outbox().stats)
+    return metrics
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """管理接口鉴权：校验 X-Admin-Token 请求头"""
+    admin_token = get_settings().admin_token
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="管理接口未启用")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=401, detail="管理令牌无效")
+
+
+async def reset_dependencies() -> None:
+    """清空共享实例（应用关闭时调用，配合 http_clients.aclose 使用）"""
+    if get_indexing_backpressure.cache_info().currsize:
+        await get_indexing_backpressure().close()
+    if get_pdf_extractor.cache_info().currsize:
+        get_pdf_extractor().shutdown()
+    if get_download_cache.cache_info().currsize:
+        await get_download_cache().flush()
+    if get_webhook_outbox.cache_info().currsize:
+        await get_webhook_outbox().stop()
+    for factory in (
+        get_build_admission,
+        get_webhook_outbox,
+        get_build_task_registry,
+        get_knowledge_builder,
+        get_download_cache,
+        get_database_service,
+        get_dify_kb_service,
+        get_indexing_backpressure,
+        get_pdf_extractor,
+        get_near_duplicate_detector,
+        get_external_api_client,
+        get_dify_knowledge_base,
+        get_dify_client,
+    ):
+        factory.cache_clear()
@@ -1,7 +1,21 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from typing import Dict, Any, Optional, List
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import AsyncIterator, Dict, Any, Literal, Optional, List
+import json
+import time
+from pydantic import BaseModel, HttpUrl, field_validator
 from app.services.knowledge_builder import KnowledgeBuilder
+from app.services.build_tasks import BuildTaskRegistry
+from app.services.webhooks import WebhookOutbox, is_private_host
+from app.services.build_admission import BuildAdmissionController, BuildQueueFullError, BuildTicket
+from app.api.deps import (
+    get_knowledge_builder, get_build_task_registry, get_webhook_outbox, get_build_admission,
+    require_admin, collect_metrics
+)
+from app.config import get_settings
+from app.core.profiler import profiler
+from app.core.tracing import trace_store
 from loguru import logger
 
 router = APIRouter()
@@ -16,6 +30,19 @@ class KnowledgeBuildRequest(BaseModel):
     description: Optional[str] = ""  # 知识库描述
     include_pdfs: bool = True  # 是否包含PDF文件
     batch_size: int = 50  # 批处理大小
+    idempotency_key: Optional[str] = None  # 幂等键，未提供时按请求内容生成
+    callback_url: Optional[HttpUrl] = None  # 任务结束时回调的URL（仅 /build，http/https）
+    callback_events: List[Literal["completed", "failed", "progress"]] = ["completed", "failed"]  # 回调事件
+    callback_progress_step: int = 25  # progress 事件的进度间隔（百分比）
+    priority: Literal["high", "normal", "low"] = "normal"  # 排队时的优先级
+
+    @field_validator("callback_url")
+    @classmethod
+    def _check_callback_url(cls, url: Optional[HttpUrl]) -> Optional[HttpUrl]:
+        """拒绝指向内网/回环地址的回调（解析到内网的域名在投递时拦截）"""
+        if url is not None and not get_settings().webhook_allow_private_hosts and is_private_host(url.host or ""):
+            raise ValueError("callback_url 不能指向内网或回环地址")
+        return url
 
 
 class KnowledgeBuildResponse(BaseModel):
@@ -27,6 +54,7 @@ class KnowledgeBuildResponse(BaseModel):
     processed_items: int = 0
     failed_items: int = 0
     task_id: Optional[str] = None
+    queue_position: Optional[int] = None  # 排队中的位置（已开始执行时为空）
 
 
 @router.get("/")
@@ -41,10 +69,92 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@router.get("/metrics")
+async def metrics():
+    """运行指标：事件循环延迟与阻塞、Dify 上传并发与 Key 池、缓存命中率等"""
+    return collect_metrics()
+
+
+def _webhook_payload(request: KnowledgeBuildRequest, task_id: str, **fields: Any) -> Dict[str, Any]:
+    return {"task_id": task_id, "dataset_name": request.dataset_name, "timestamp": time.time(), **fields}
+
+
+def _progress_notifier(outbox: WebhookOutbox, request: KnowledgeBuildRequest, task_id: str):
+    """按 callback_progress_step 的整数倍发送 progress 回调（未订阅时返回 None）"""
+    if not request.callback_url or "progress" not in request.callback_events:
+        return None
+    step = max(1, min(request.callback_progress_step, 100))
+    last_milestone = 0
+
+    async def notify(done: int, total: int):
+        nonlocal last_milestone
+        milestone = (done * 100 // total) // step * step if total else 0
+        if milestone <= last_milestone or milestone >= 100:
+            return
+        last_milestone = milestone
+        await outbox.enqueue(str(request.callback_url), "progress", _webhook_payload(
+            request, task_id, progress={"percent": milestone, "done": done, "total": total}
+        ))
+
+    return notify
+
+
+def _reserve_build(admission: BuildAdmissionController, request: KnowledgeBuildRequest) -> BuildTicket:
+    """申请构建名额，队列已满时返回 429 与 Retry-After"""
+    try:
+        return admission.reserve(request.priority)
+    except BuildQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def _run_build_task(builder: KnowledgeBuilder, registry: BuildTaskRegistry, outbox: WebhookOutbox,
+                          ticket: BuildTicket, idempotency_key: Optional[str],
+                          request: KnowledgeBuildRequest, task_id: str):
+    """后台执行构建任务（排队等待执行名额），结束后发送回调并更新幂等登记"""
+    try:
+        async with ticket:
+            result = await builder.build_knowledge_base_async(
+                request.report_id,
+                request.query_conditions,
+                request.dataset_name,
+                request.description,
+                request.include_pdfs,
+                request.batch_size,
+                task_id,
+                on_progress=_progress_notifier(outbox, request, task_id)
+            )
+    except Exception as e:
+        # 异常同样按失败处理：发送失败回调并删除幂等登记，避免同一请求在登记过期前无法重试
+        logger.error(f"构建任务异常: {task_id}: {e}")
+        result = None
+    event = "completed" if result is not None else "failed"
+    if request.callback_url and event in request.callback_events:
+        if result is not None:
+            payload = _webhook_payload(request, task_id, result=result)
+        else:
+            payload = _webhook_payload(request, task_id, error="知识库构建任务失败")
+        await outbox.enqueue(str(request.callback_url), event, payload)
+    if idempotency_key is None:
+        return
+    try:
+        # 成功后的保留窗口只用于客户端显式提供的幂等键；按内容生成的指纹在结束后删除，
+        # 否则一段时间内对同一知识库的正常重建会直接拿到旧的 task_id
+        if result and result.get("success") and request.idempotency_key:
+            await registry.complete(idempotency_key)
+        else:
+            await registry.forget(idempotency_key)
+    except Exception as e:
+        logger.warning(f"更新构建任务幂等登记失败: {task_id}: {e}")
+
+
 @router.post("/build", response_model=KnowledgeBuildResponse)
 async def build_knowledge_base(
     request: KnowledgeBuildRequest,
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    builder: KnowledgeBuilder = Depends(get_knowledge_builder),
+    registry: BuildTaskRegistry = Depends(get_build_task_registry),
+    outbox: WebhookOutbox = Depends(get_webhook_outbox),
+    admission: BuildAdmissionController = Depends(get_build_admission)
 ):
     """
     构建知识库 - 主要API接口
@@ -54,62 +164,120 @@ async def build_knowledge_base(
     2. 从API获取补充数据
     3. 下载相关PDF文件
     4. 调用Dify API构建知识库
+    
+    相同的请求（相同 idempotency_key，或未提供时内容相同）在任务运行期间重复提交，
+    会直接返回已有的 task_id；显式提供 idempotency_key 时，成功后的一段时间内同样如此。
+    Redis 不可用时跳过重复检查，同一知识库的构建退化为进程内串行。
+    提供 callback_url 时，任务结束（completed / failed）及可选的进度节点（progress）
+    会异步 POST 到该地址，无需轮询 /status/{task_id}。
+    同时运行的构建数达到上限时任务按 priority 排队，队列已满时返回 429（带 Retry-After）
     """
     try:
-        builder = KnowledgeBuilder()
-        
         # 生成任务ID
         import uuid
         task_id = str(uuid.uuid4())
         
-        # 异步执行知识库构建任务
-        background_tasks.add_task(
-            builder.build_knowledge_base_async,
-            request.report_id,
-            request.query_conditions,
-            request.dataset_name,
-            request.description,
-            request.include_pdfs,
-            request.batch_size,
-            task_id
+        # 幂等检查：已有相同任务时直接返回其 task_id
+        idempotency_key = request.idempotency_key or BuildTaskRegistry.fingerprint(
+            request.model_dump(exclude={"idempotency_key", "priority"})
         )
+        try:
+            existing_task_id = await registry.claim(idempotency_key, task_id)
+        except Exception as e:
+            logger.warning(f"幂等登记不可用，跳过重复任务检查: {e}")
+            idempotency_key = existing_task_id = None
+        if existing_task_id:
+            return KnowledgeBuildResponse(
+                success=True,
+                message="相同的知识库构建任务已存在",
+                task_id=existing_task_id
+            )
+        
+        # 准入控制：队列已满时撤销幂等登记并返回 429
+        try:
+            ticket = _reserve_build(admission, request)
+        except HTTPException:
+            if idempotency_key is not None:
+                await registry.forget(idempotency_key)
+            raise
         
+        # 异步执行知识库构建任务
+        background_tasks.add_task(_run_build_task, builder, registry, outbox, ticket, idempotency_key, request, task_id)
+        
+        position = ticket.position
         return KnowledgeBuildResponse(
             success=True,
-            message="知识库构建任务已启动",
-            task_id=task_id
+            message="知识库构建任务已启动" if position == 0 else f"知识库构建任务已排队，前方还有 {position - 1} 个任务",
+            task_id=task_id,
+            queue_position=position or None
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"启动知识库构建任务失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/build/sync", response_model=KnowledgeBuildResponse)
-async def build_knowledge_base_sync(request: KnowledgeBuildRequest):
+async def build_knowledge_base_sync(
+    request: KnowledgeBuildRequest,
+    stream: bool = False,
+    builder: KnowledgeBuilder = Depends(get_knowledge_builder),
+    admission: BuildAdmissionController = Depends(get_build_admission)
+):
     """
     构建知识库 - 同步版本
     
-    同步执行知识库构建，返回完整结果
+    同步执行知识库构建，返回完整结果（task_id 可用于查询本次构建的链路追踪）。
+    stream=true 时以 NDJSON 流式返回：每处理完一条引用资料输出一行记录，
+    首行为 {"type": "start", "total_items", ...}，最后一行为 {"type": "summary", ...}；
+    构建中途出错时最后一行为 {"type": "error", ...}。
+    与 /build 共用并发上限与等待队列，队列已满时返回 429（带 Retry-After）
     """
+    import uuid
+    task_id = str(uuid.uuid4())
+    build_kwargs = dict(
+        report_id=request.report_id,
+        query_conditions=request.query_conditions,
+        dataset_name=request.dataset_name,
+        description=request.description,
+        include_pdfs=request.include_pdfs,
+        batch_size=request.batch_size,
+        task_id=task_id
+    )
+    ticket = _reserve_build(admission, request)
+    if stream:
+        # 客户端在流开始前断开时生成器不会执行，由后台任务兜底归还名额
+        return StreamingResponse(_ndjson_build_records(builder, ticket, build_kwargs, task_id),
+                                 media_type="application/x-ndjson",
+                                 background=BackgroundTask(ticket.cancel))
+
     try:
-        builder = KnowledgeBuilder()
-        result = await builder.build_knowledge_base_sync(
-            report_id=request.report_id,
-            query_conditions=request.query_conditions,
-            dataset_name=request.dataset_name,
-            description=request.description,
-            include_pdfs=request.include_pdfs,
-            batch_size=request.batch_size
-        )
+        async with ticket:
+            result = await builder.build_knowledge_base_sync(**build_kwargs)
         
-        return KnowledgeBuildResponse(**result)
+        return KnowledgeBuildResponse(**result, task_id=task_id)
         
     except Exception as e:
         logger.error(f"知识库构建失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _ndjson_build_records(builder: KnowledgeBuilder, ticket: BuildTicket, build_kwargs: Dict[str, Any],
+                                task_id: str) -> AsyncIterator[bytes]:
+    """等待执行名额后，将构建记录逐行编码为 NDJSON"""
+    try:
+        async with ticket:
+            async for record in builder.iter_build_records(**build_kwargs):
+                if record["type"] == "summary":
+                    record["task_id"] = task_id
+                yield (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    except Exception as e:
+        logger.error(f"知识库构建失败: {e}")
+        yield (json.dumps({"type": "error", "task_id": task_id, "error": str(e)}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
 @router.get("/status/{task_id}")
 async def get_task_status(task_id: str):
     """获取任务状态"""
@@ -125,3 +293,53 @@ async def get_task_status(task_id: str):
     except Exception as e:
         logger.error(f"获取任务状态失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/status/{task_id}/trace")
+async def get_task_trace(task_id: str, format: str = "otlp"):
+    """
+    获取任务的链路追踪
+
+    format=otlp 返回 OpenTelemetry OTLP/JSON（可直接导入 Jaeger / Tempo 等），
+    format=summary 返回各阶段耗时汇总与关键路径
+    """
+    trace = trace_store.get(task_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 的追踪记录不存在或已过期")
+    if format == "summary":
+        return trace.summary()
+    if format != "otlp":
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    return trace.to_otlp()
+
+
+@router.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_service(seconds: float = 10.0, interval_ms: float = 5.0, format: str = "json"):
+    """
+    对运行中的服务采样分析（需要 X-Admin-Token）
+
+    采样期间抓取事件循环与工作线程的调用栈，并测量事件循环延迟。
+    format=collapsed 返回折叠栈文件（可直接用 flamegraph.pl / speedscope 生成火焰图），
+    延迟统计放在 X-Event-Loop-Lag-* 响应头中；format=json 返回完整统计
+    """
+    if format not in ("json", "collapsed"):
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    max_seconds = get_settings().profiler_max_seconds
+    if not 0 < seconds <= max_seconds:
+        raise HTTPException(status_code=400, detail=f"采样时长需在 (0, {max_seconds}] 秒之间")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="已有采样正在进行")
+
+    result = await profiler.profile(seconds, interval=max(interval_ms, 1.0) / 1000)
+    logger.info(f"采样分析完成: {result.samples} 次采样, 事件循环延迟 {result.lag_summary()}")
+    if format == "json":
+        return result.to_dict()
+    lag = result.lag_summary()
+    return PlainTextResponse(
+        result.collapsed(),
+        headers={
+            "Content-Disposition": 'attachment; filename="profile.collapsed"',
+            "X-Event-Loop-Lag-Max-Ms": str(lag["max_ms"]),
+            "X-Event-Loop-Lag-P99-Ms": str(lag["p99_ms"]),
+        },
+    )
@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from pydantic import ValidationError
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, List, Optional
 import os
 
 
@@ -26,20 +27,137 @@ class Settings(BaseSettings):
     # API配置 - 非敏感信息使用默认值
     api_host: str = "0.0.0.0"
     api_port: int = 8000
+    admin_token: Optional[str] = None  # 管理接口令牌（X-Admin-Token），未配置时管理接口不可用
+    profiler_max_seconds: float = 60.0  # 单次采样分析的最长时长
     
     # Dify配置 - 敏感信息
     dify_api_key: str
+    dify_extra_api_keys: List[str] = []  # 额外的 API Key，与 dify_api_key 组成 Key 池
+    dify_key_rate_limit_cooldown: float = 60.0  # Key 被限流且无 Retry-After 时的摘除时长（秒）
+    dify_key_auth_cooldown: float = 300.0  # Key 认证失败（401）时的摘除时长（秒）
+    dify_key_max_wait: float = 60.0  # 所有 Key 均被限流时请求等待恢复的最长时间（秒）
     dify_base_url: str = "https://api.dify.ai/v1"
+    dify_single_flight: bool = False  # 合并并发的相同 GET 请求
+    dify_adaptive_concurrency: bool = True  # 上传并发数按延迟与 429/5xx 自适应调整（AIMD）
+    dify_upload_concurrency_initial: int = 4
+    dify_upload_concurrency_min: int = 1
+    dify_upload_concurrency_max: int = 32
+    dify_hedge_enabled: bool = False  # GET 请求超过延迟分位数未返回时发送对冲请求
+    dify_hedge_percentile: float = 0.95
+    dify_hedge_budget: float = 0.05  # 对冲请求占比上限
+    
+    # HTTP客户端配置 - 按上游共享连接池
+    http2_enabled: bool = False  # 启用 HTTP/2 多路复用（需安装 h2）
+    http_timeout: float = 30.0
+    dify_read_max_connections: int = 50
+    dify_read_max_keepalive: int = 20
+    dify_upload_max_connections: int = 10
+    dify_upload_max_keepalive: int = 5
+    dify_upload_timeout: float = 300.0  # 大文件上传的超时时间（秒）
+    external_max_connections: int = 100
+    external_max_keepalive: int = 20
+    
+    # Dify 读缓存配置
+    dify_cache_enabled: bool = False
+    dify_cache_ttls: Dict[str, int] = {}  # 覆盖各接口默认TTL（秒），如 {"get_dataset": 600}
+    dify_cache_local_max_entries: int = 1024
+    dify_cache_local_ttl: int = 10  # 进程内缓存最长时间（秒）
+    
+    # 外部API响应缓存配置
+    external_cache_backend: str = "none"  # none | disk | redis
+    external_cache_dir: str = "data/http_cache"
+    external_cache_max_bytes: int = 256 * 1024 * 1024
+    external_cache_default_ttl: int = 0  # 响应未声明 max-age 时的新鲜期（秒）
+    
+    # URL 预检配置
+    url_preflight_timeout: float = 10.0
+    url_preflight_connect_timeout: float = 3.0
+    url_preflight_ttl: int = 3600  # 可访问 URL 的缓存时间（秒）
+    url_preflight_negative_ttl: int = 1800  # 不存在（404/410）的 URL 的负缓存时间（秒）
+    url_preflight_transient_ttl: int = 60  # 超时、5xx、429 等暂时性失败的缓存时间（秒），0 表示不缓存
+    url_preflight_concurrency: int = 20
+    
+    # 下载配置
+    download_max_bytes: int = 100 * 1024 * 1024  # PDF 下载大小上限（字节）
+    download_passthrough: bool = False  # 远程 PDF 直通上传 Dify，不写入 downloads/pdfs
+    download_cache_dir: str = "downloads/pdfs"
+    download_cache_max_bytes: int = 5 * 1024 * 1024 * 1024  # 下载缓存总容量上限，0 表示不限制
+    download_cache_max_age: int = 7 * 24 * 3600  # 文件自最近访问起的保留时间（秒），0 表示不按时间淘汰
+    
+    # PDF 本地文本提取配置
+    pdf_local_extract_enabled: bool = False  # 本地 PDF 先提取文本再通过 create-by-text 上传（直通上传的 PDF 不适用）
+    pdf_extract_workers: int = 0  # 进程池大小，0 表示使用 CPU 核数
+    pdf_extract_pages_per_task: int = 16
+    pdf_extract_cache_dir: str = "data/extract_cache"
+    
+    # 近重复检测配置（MinHash/LSH）
+    dedup_enabled: bool = False
+    dedup_threshold: float = 0.85  # 估计 Jaccard 相似度达到该值视为近重复
+    dedup_num_perm: int = 128
+    dedup_bands: int = 32
+    dedup_max_shingles: int = 2048  # 参与签名的 shingle 上限（bottom-k 采样）
+    dedup_store_dir: str = "data/minhash"
+    
+    # 大 PDF 拆分配置
+    pdf_split_max_bytes: int = 15 * 1024 * 1024  # 超过该大小拆分（Dify 默认上传上限 15MB）
+    pdf_split_max_pages: int = 300  # 超过该页数拆分
+    pdf_split_upload_concurrency: int = 4
+    pdf_split_dir: str = "downloads/pdf_parts"
+    
+    # 索引队列背压配置
+    indexing_backpressure_enabled: bool = True
+    indexing_high_water: int = 200  # 单个知识库未完成索引的文档数达到该值时暂停上传
+    indexing_low_water: int = 100  # 回落到该值以下时恢复上传
+    indexing_poll_interval: float = 5.0
+    indexing_poll_concurrency: int = 8  # 每轮并发查询索引状态的批次数
+    
+    # 事件循环监控配置
+    loop_monitor_enabled: bool = False  # 监控事件循环延迟，记录阻塞调用的调用栈
+    loop_monitor_interval: float = 0.1  # 心跳间隔（秒）
+    loop_monitor_block_threshold: float = 0.2  # 心跳超时多久视为阻塞（秒）
+    
+    # 链路追踪配置
+    tracing_enabled: bool = True
+    tracing_max_traces: int = 200  # 内存中保留的最近任务 trace 数
+    tracing_max_spans_per_trace: int = 5000
+    
+    # 构建回调配置
+    webhook_enabled: bool = True  # 启动回调分发器（发件箱存于 Redis）
+    webhook_secret: Optional[str] = None  # 回调签名密钥（X-Webhook-Signature: sha256=HMAC）
+    webhook_timeout: float = 10.0
+    webhook_max_attempts: int = 8
+    webhook_retry_base: float = 5.0  # 重试退避基数（秒），指数增长
+    webhook_retry_max: float = 600.0
+    webhook_poll_interval: float = 1.0
+    webhook_allow_private_hosts: bool = False  # 允许回调内网/回环地址（默认拒绝，防止 SSRF）
+    
+    # 构建准入控制配置
+    build_max_concurrent: int = 2  # 同时运行的构建数上限（进程内）
+    build_max_pending: int = 10  # 等待队列长度上限，超出返回 429
+    build_default_seconds: float = 60.0  # 无历史数据时估算 Retry-After 的构建耗时
+    
+    # 构建任务配置
+    build_lock_ttl: float = 60.0  # 知识库构建锁的过期时间（秒），持有期间自动续期
+    build_lock_wait_timeout: float = 600.0  # 等待同一知识库其他构建完成的最长时间（秒）
+    build_idempotency_ttl: int = 3600  # 构建成功后相同请求返回已有 task_id 的时间窗口（秒）
     
     # 日志配置 - 非敏感信息使用默认值
     log_level: str = "INFO"
     log_file: str = "logs/app.log"
+    log_enqueue: bool = True  # 日志经后台队列写入，避免阻塞调用方
+    log_json_file: Optional[str] = None  # 结构化 JSON 日志文件路径，为空则不启用
+    log_debug_sample_rate: float = 1.0  # 高频 DEBUG 日志采样率 (0~1)
     
     @property
     def database_url(self) -> str:
         """构建数据库连接URL"""
         return f"mysql+pymysql://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
     
+    @property
+    def dify_api_keys(self) -> List[str]:
+        """Key 池中的全部 API Key"""
+        return [self.dify_api_key, *self.dify_extra_api_keys]
+    
     @property
     def redis_url(self) -> str:
         """构建Redis连接URL"""
@@ -83,10 +201,19 @@ def load_settings() -> Settings:
         raise e
 
 
-# 全局配置实例
-try:
-    settings = load_settings()
-except ValidationError:
-    # 如果配置加载失败，程序应该退出
-    import sys
-    sys.exit(1)
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    获取全局配置实例（首次调用时才加载）
+
+    导入本模块不会读取环境变量或 .env 文件，也不会因缺少配置而退出进程，
+    只有真正需要配置的子系统才会触发加载。
+    """
+    return load_settings()
+
+
+def __getattr__(name: str):
+    """兼容旧写法 `from app.config import settings`，访问时才加载配置"""
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
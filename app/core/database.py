@@ -1,20 +1,14 @@
 from sqlalchemy import create_engine, MetaData
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
-from typing import Generator
-from app.config import settings
+from typing import Generator, Optional
+from app.config import get_settings
 
-# 创建数据库引擎
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=settings.environment == "development"
-)
-
-# 创建会话工厂
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 数据库引擎与会话工厂在首次使用时创建，导入本模块不会触发配置加载或建立连接池
+_engine: Optional[Engine] = None
+_session_factory: Optional[sessionmaker] = None
 
 # 创建基础模型类
 Base = declarative_base()
@@ -23,9 +17,31 @@ Base = declarative_base()
 metadata = MetaData()
 
 
+def get_engine() -> Engine:
+    """获取数据库引擎（惰性创建）"""
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        _engine = create_engine(
+            settings.database_url,
+            pool_pre_ping=True,
+            pool_recycle=300,
+            echo=settings.environment == "development"
+        )
+    return _engine
+
+
+def get_session_factory() -> sessionmaker:
+    """获取会话工厂（惰性创建）"""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    return _session_factory
+
+
 def get_db() -> Generator[Session, None, None]:
     """获取数据库会话"""
-    db = SessionLocal()
+    db = get_session_factory()()
     try:
         yield db
     finally:
@@ -35,7 +51,7 @@ def get_db() -> Generator[Session, None, None]:
 @contextmanager
 def get_db_session() -> Generator[Session, None, None]:
     """获取数据库会话上下文管理器"""
-    db = SessionLocal()
+    db = get_session_factory()()
     try:
         yield db
         db.commit()
@@ -48,4 +64,13 @@ def get_db_session() -> Generator[Session, None, None]:
 
 def init_db():
     """初始化数据库"""
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
+
+
+def dispose_engine():
+    """释放数据库连接池"""
+    global _engine, _session_factory
+    if _engine is not None:
+        _engine.dispose()
+    _engine = None
+    _session_factory = None
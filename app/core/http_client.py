@@ -0,0 +1,111 @@
+"""
+应用级共享 HTTP 客户端
+
+按上游（Dify 读请求、Dify 上传、外部API）维护共享的 httpx.AsyncClient，
+复用连接池与 TLS 会话，生命周期由 FastAPI lifespan 管理。
+"""
+
+from __future__ import annotations
+import importlib.util
+from typing import Dict, Optional
+import httpx
+from loguru import logger
+from app.config import get_settings
+
+DIFY_READ = "dify.read"
+DIFY_UPLOAD = "dify.upload"
+EXTERNAL = "external"
+
+
+def _http2_available() -> bool:
+    """HTTP/2 依赖 h2 包，未安装时回退到 HTTP/1.1"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class HttpClientRegistry:
+    """共享 HTTP 客户端注册表 - 每个上游一个连接池"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get(self, name: str, *, timeout: float = 30.0,
+            limits: Optional[httpx.Limits] = None, http2: bool = False) -> httpx.AsyncClient:
+        """
+        获取（或首次创建）指定名称的共享客户端
+
+        Args:
+            name: 客户端名称（按上游/流量类型区分）
+            timeout: 请求超时时间（秒）
+            limits: 连接池限制
+            http2: 是否启用 HTTP/2
+
+        Returns:
+            共享的 httpx.AsyncClient
+        """
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            if http2 and not _http2_available():
+                logger.warning(f"未安装 h2，客户端 {name} 回退到 HTTP/1.1")
+                http2 = False
+            client = httpx.AsyncClient(
+                timeout=timeout,
+                limits=limits or httpx.Limits(max_keepalive_connections=20, max_connections=100),
+                http2=http2,
+            )
+            self._clients[name] = client
+            logger.info(f"共享HTTP客户端已创建: {name} (http2={http2})")
+        return client
+
+    def dify_read(self) -> httpx.AsyncClient:
+        """Dify 普通请求（查询、元数据等）使用的客户端"""
+        settings = get_settings()
+        return self.get(
+            DIFY_READ,
+            timeout=settings.http_timeout,
+            limits=httpx.Limits(
+                max_keepalive_connections=settings.dify_read_max_keepalive,
+                max_connections=settings.dify_read_max_connections,
+            ),
+            http2=settings.http2_enabled,
+        )
+
+    def dify_upload(self) -> httpx.AsyncClient:
+        """Dify 文件上传使用的客户端，与读请求隔离连接池，避免大文件占满连接"""
+        settings = get_settings()
+        return self.get(
+            DIFY_UPLOAD,
+            timeout=settings.dify_upload_timeout,
+            limits=httpx.Limits(
+                max_keepalive_connections=settings.dify_upload_max_keepalive,
+                max_connections=settings.dify_upload_max_connections,
+            ),
+            http2=settings.http2_enabled,
+        )
+
+    def external(self) -> httpx.AsyncClient:
+        """外部API及文件下载使用的客户端"""
+        settings = get_settings()
+        return self.get(
+            EXTERNAL,
+            timeout=settings.http_timeout,
+            limits=httpx.Limits(
+                max_keepalive_connections=settings.external_max_keepalive,
+                max_connections=settings.external_max_connections,
+            ),
+            http2=settings.http2_enabled,
+        )
+
+    async def aclose(self) -> None:
+        """关闭所有共享客户端"""
+        clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"关闭HTTP客户端 {name} 失败: {e}")
+        if clients:
+            logger.info("共享HTTP客户端已全部关闭")
+
+
+# 全局实例
+http_clients = HttpClientRegistry()
@@ -1,24 +1,52 @@
 import os
+import random
+import sys
 from loguru import logger
-from app.config import settings
+from app.config import get_settings
 
+_DEBUG_LEVEL_NO = logger.level("DEBUG").no
+_debug_sample_rate = 1.0
 
-def setup_logger():
-    """设置日志配置"""
-    # 创建日志目录
-    log_dir = os.path.dirname(settings.log_file)
+
+def _sampling_patcher(record):
+    """对 logger.bind(sampled=True) 标记的 DEBUG 日志做一次采样决策（所有处理器共享同一结果）"""
+    extra = record["extra"]
+    if extra.get("sampled") and record["level"].no <= _DEBUG_LEVEL_NO:
+        extra["dropped"] = random.random() >= _debug_sample_rate
+
+
+def _sampling_filter(record) -> bool:
+    """丢弃未被采样命中的日志"""
+    return not record["extra"].get("dropped", False)
+
+
+def _ensure_dir(file_path: str):
+    log_dir = os.path.dirname(file_path)
     if log_dir and not os.path.exists(log_dir):
         os.makedirs(log_dir)
+
+
+def setup_logger():
+    """设置日志配置（由应用入口显式调用，导入本模块不会创建目录或处理器）"""
+    global _debug_sample_rate
+    settings = get_settings()
+    _debug_sample_rate = settings.log_debug_sample_rate
+
+    # 创建日志目录
+    _ensure_dir(settings.log_file)
     
     # 移除默认处理器
     logger.remove()
+    logger.configure(patcher=_sampling_patcher)
     
-    # 添加控制台输出
+    # 添加控制台输出（enqueue 时由后台线程写出，调用方只负责入队）
     logger.add(
-        sink=lambda msg: print(msg, end=""),
+        sink=sys.stdout,
         level=settings.log_level,
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        colorize=True
+        colorize=True,
+        enqueue=settings.log_enqueue,
+        filter=_sampling_filter
     )
     
     # 添加文件输出
@@ -28,9 +56,21 @@ def setup_logger():
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
         rotation="1 day",
         retention="30 days",
-        compression="zip"
+        compression="zip",
+        enqueue=settings.log_enqueue,
+        filter=_sampling_filter
     )
 
-
-# 初始化日志
-setup_logger()
+    # 添加结构化 JSON 输出（可选）
+    if settings.log_json_file:
+        _ensure_dir(settings.log_json_file)
+        logger.add(
+            sink=settings.log_json_file,
+            level=settings.log_level,
+            serialize=True,
+            rotation="1 day",
+            retention="30 days",
+            compression="zip",
+            enqueue=settings.log_enqueue,
+            filter=_sampling_filter
+        )
@@ -0,0 +1,130 @@
+"""
+事件循环延迟与阻塞调用监控
+
+事件循环上的心跳协程按固定间隔唤醒，测量唤醒延迟；
+独立的看门狗线程发现心跳超过阈值未更新时，抓取事件循环线程当前的调用栈，
+记录并告警阻塞调用（同步 SQL、同步文件读写等）。统计结果通过 /metrics 暴露。
+"""
+
+from __future__ import annotations
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+
+class EventLoopMonitor:
+    """事件循环监控器"""
+
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.2,
+                 max_events: int = 50, window: int = 600):
+        """
+        Args:
+            interval: 心跳间隔（秒）
+            block_threshold: 心跳超时多久视为阻塞（秒）
+            max_events: 保留的最近阻塞事件数
+            window: 计算延迟分位数的最近心跳数
+        """
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.max_events = max_events
+        self._lags: deque = deque(maxlen=window)
+        self._events: deque = deque(maxlen=max_events)
+        self._beat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._current_block: Optional[Dict[str, Any]] = None
+        self.max_lag_ms = 0.0
+        self.blocked_count = 0
+        self.blocked_total_ms = 0.0
+        self.logger = logger
+
+    def configure(self, interval: float, block_threshold: float) -> None:
+        self.interval = interval
+        self.block_threshold = block_threshold
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat is not None and not self._heartbeat.done()
+
+    def start(self) -> None:
+        """在当前事件循环上启动监控"""
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._heartbeat = asyncio.get_running_loop().create_task(self._run_heartbeat())
+        self._watchdog = threading.Thread(target=self._run_watchdog, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        self.logger.info(f"事件循环监控已启动: 阻塞阈值 {self.block_threshold * 1000:.0f}ms")
+
+    async def stop(self) -> None:
+        if self._heartbeat is None:
+            return
+        self._stop.set()
+        self._heartbeat.cancel()
+        try:
+            await self._heartbeat
+        except asyncio.CancelledError:
+            pass
+        await asyncio.to_thread(self._watchdog.join)
+        self._heartbeat = self._watchdog = None
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag_ms = max(0.0, now - self._beat - self.interval) * 1000
+            self._beat = now
+            self._lags.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            block = self._current_block
+            if block is not None:
+                # 阻塞结束：补记实际阻塞时长
+                self._current_block = None
+                block["duration_ms"] = round(lag_ms, 3)
+                self.blocked_total_ms += lag_ms
+                self.logger.warning(
+                    f"事件循环阻塞 {lag_ms:.0f}ms，阻塞时调用栈:\n{block['stack']}"
+                )
+
+    def _run_watchdog(self) -> None:
+        check_interval = max(self.block_threshold / 2, 0.01)
+        while not self._stop.wait(check_interval):
+            stalled = time.perf_counter() - self._beat - self.interval
+            if stalled < self.block_threshold or self._current_block is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)[-12:]) if frame is not None else ""
+            block = {"at": time.time(), "duration_ms": round(stalled * 1000, 3), "stack": stack}
+            self._current_block = block
+            self._events.append(block)
+            self.blocked_count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        lags: List[float] = sorted(self._lags)
+        return {
+            "enabled": self.running,
+            "interval_ms": self.interval * 1000,
+            "block_threshold_ms": self.block_threshold * 1000,
+            "lag_ms": {
+                "last": round(self._lags[-1], 3) if self._lags else 0.0,
+                "avg": round(sum(lags) / len(lags), 3) if lags else 0.0,
+                "p99": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))], 3) if lags else 0.0,
+                "max": round(self.max_lag_ms, 3),
+            },
+            "blocked_count": self.blocked_count,
+            "blocked_total_ms": round(self.blocked_total_ms, 3),
+            "recent_blocks": list(self._events),
+        }
+
+
+# 全局事件循环监控器
+loop_monitor = EventLoopMonitor()
@@ -0,0 +1,149 @@
+"""
+按需采样分析器
+
+运行期间由后台线程定时抓取所有线程的调用栈（sys._current_frames），
+输出 flamegraph.pl / speedscope 可直接读取的折叠栈格式；同时在事件循环上
+运行探针测量循环延迟，并统计事件循环线程忙碌时的热点栈（阻塞调用）。
+未运行时不启动任何线程或任务，没有额外开销。
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import Dict, List, Optional
+
+# 事件循环空闲时停留的函数（栈顶为这些函数时视为空闲）
+_IDLE_FUNCTIONS = {"select", "poll", "epoll", "kqueue", "control", "_run_once"}
+
+
+@dataclass
+class ProfileResult:
+    """一次采样的结果"""
+    duration: float
+    interval: float
+    samples: int
+    stacks: Counter = field(default_factory=Counter)
+    loop_busy_stacks: Counter = field(default_factory=Counter)
+    loop_samples: int = 0
+    loop_busy_samples: int = 0
+    lag_ms: List[float] = field(default_factory=list)
+
+    def collapsed(self) -> str:
+        """折叠栈文本：每行 "线程;帧;帧;... 次数" """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def lag_summary(self) -> Dict[str, float]:
+        """事件循环延迟统计（毫秒）"""
+        if not self.lag_ms:
+            return {"probes": 0, "avg_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self.lag_ms)
+        return {
+            "probes": len(ordered),
+            "avg_ms": round(sum(ordered) / len(ordered), 3),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 3),
+            "max_ms": round(ordered[-1], 3),
+        }
+
+    def to_dict(self, top: int = 20) -> Dict:
+        busy_ratio = self.loop_busy_samples / self.loop_samples if self.loop_samples else 0.0
+        return {
+            "duration": self.duration,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "event_loop_lag": self.lag_summary(),
+            "event_loop_busy_ratio": round(busy_ratio, 4),
+            "event_loop_hot_stacks": [
+                {"stack": stack, "samples": count} for stack, count in self.loop_busy_stacks.most_common(top)
+            ],
+            "collapsed": self.collapsed(),
+        }
+
+
+def _frame_label(frame: FrameType) -> str:
+    """帧标签 module:function；不含行号，同一函数的不同执行位置合并为同一个栈"""
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+def _collapse(frame: Optional[FrameType]) -> List[str]:
+    """由栈顶帧得到从栈底到栈顶的帧标签"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    """采样分析器（同一时间只运行一次采样）"""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, duration: float, interval: float = 0.005,
+                      lag_probe_interval: float = 0.05) -> ProfileResult:
+        """
+        对当前进程采样 duration 秒
+
+        Args:
+            duration: 采样时长（秒）
+            interval: 栈采样间隔（秒）
+            lag_probe_interval: 事件循环延迟探针间隔（秒）
+        """
+        async with self._lock:
+            result = ProfileResult(duration=duration, interval=interval, samples=0)
+            loop_thread_id = threading.get_ident()
+            stop = threading.Event()
+            sampler = threading.Thread(
+                target=self._sample, args=(result, loop_thread_id, interval, stop),
+                name="sampling-profiler", daemon=True
+            )
+            sampler.start()
+            try:
+                deadline = time.perf_counter() + duration
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    await asyncio.sleep(lag_probe_interval)
+                    lag = time.perf_counter() - start - lag_probe_interval
+                    result.lag_ms.append(max(0.0, lag) * 1000)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            return result
+
+    @staticmethod
+    def _sample(result: ProfileResult, loop_thread_id: int, interval: float, stop: threading.Event) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not stop.wait(interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = _collapse(frame)
+                if not labels:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                result.stacks[";".join([thread_name, *labels])] += 1
+                if thread_id == loop_thread_id:
+                    result.loop_samples += 1
+                    if frame.f_code.co_name not in _IDLE_FUNCTIONS:
+                        result.loop_busy_samples += 1
+                        result.loop_busy_stacks[";".join(labels[-8:])] += 1
+            result.samples += 1
+
+
+# 全局采样分析器
+profiler = SamplingProfiler()
@@ -1,9 +1,12 @@
 from __future__ import annotations
 import asyncio
 import os
+import time
+import uuid
 from typing import AsyncGenerator, Optional
+from loguru import logger
 from redis.asyncio import Redis
-from app.config import settings
+from app.config import get_settings
 
 
 class RedisService:
@@ -29,6 +32,7 @@ class RedisService:
         if self._redis is not None:
             await self._disconnect()
         
+        settings = get_settings()
         self._redis = Redis.from_url(
             settings.redis_url,
             db=settings.redis_db,
@@ -80,3 +84,104 @@ async def get_redis() -> AsyncGenerator[Redis, None]:
         yield client
     finally:
         pass
+
+
+class RedisLockError(Exception):
+    """分布式锁获取失败"""
+    pass
+
+
+# 仅当锁仍由自己持有时才释放/续期
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+_EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """基于 Redis 的分布式锁 - 自动过期，持有期间由心跳续期"""
+
+    def __init__(self, name: str, ttl: float = 60.0, redis: Optional[RedisService] = None):
+        """
+        Args:
+            name: 锁的键名
+            ttl: 锁的过期时间（秒），持有者崩溃后最多经过该时间自动释放
+            redis: Redis服务（默认使用全局实例）
+        """
+        self.name = name
+        self.ttl = ttl
+        self.redis = redis or redis_service
+        self.token = uuid.uuid4().hex
+        self.lost = False
+        self._renewed_at = 0.0
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    async def acquire(self, blocking: bool = True, timeout: Optional[float] = None,
+                      poll_interval: float = 0.5) -> bool:
+        """
+        获取锁
+
+        Args:
+            blocking: 锁被占用时是否等待
+            timeout: 最长等待时间（秒），为空时一直等待
+
+        Returns:
+            是否获取成功
+        """
+        client = await self.redis.get_client()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if await client.set(self.name, self.token, nx=True, px=int(self.ttl * 1000)):
+                self.lost = False
+                self._renewed_at = time.monotonic()
+                self._heartbeat = asyncio.create_task(self._renew())
+                return True
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            await asyncio.sleep(poll_interval)
+
+    async def _renew(self) -> None:
+        """每 ttl/3 续期一次；续期被拒绝或持续失败超过 ttl 说明锁已过期，可能已被他人获取"""
+        client = await self.redis.get_client()
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                extended = await client.eval(_EXTEND_SCRIPT, 1, self.name, self.token, int(self.ttl * 1000))
+            except Exception as e:
+                logger.warning(f"分布式锁续期失败: {self.name}: {e}")
+                if time.monotonic() - self._renewed_at < self.ttl:
+                    continue
+                extended = False
+            if not extended:
+                self.lost = True
+                logger.error(f"分布式锁已丢失: {self.name}")
+                return
+            self._renewed_at = time.monotonic()
+
+    async def release(self) -> None:
+        """释放锁（只释放自己持有的锁）"""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        try:
+            client = await self.redis.get_client()
+            await client.eval(_RELEASE_SCRIPT, 1, self.name, self.token)
+        except Exception as e:
+            logger.warning(f"分布式锁释放失败，将在过期后自动释放: {self.name}: {e}")
+
+    async def __aenter__(self) -> RedisLock:
+        if not await self.acquire():
+            raise RedisLockError(f"获取分布式锁失败: {self.name}")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.release()
@@ -0,0 +1,217 @@
+"""
+任务级链路追踪
+
+按 task_id 收集构建过程中各阶段（SQL、外部下载、Dify 请求、索引等待等）的 span，
+可导出为 OpenTelemetry（OTLP/JSON）格式，并给出耗时汇总与关键路径。
+当前上下文没有 trace 时 span() 直接返回，不产生额外开销。
+"""
+
+from __future__ import annotations
+import contextlib
+import contextvars
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+# OTLP 状态码
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+@dataclass
+class Span:
+    """一个计时区间"""
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class Trace:
+    """单个任务的 span 集合"""
+
+    def __init__(self, task_id: str, max_spans: int = 5000):
+        self.task_id = task_id
+        self.trace_id = os.urandom(16).hex()
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    def start_span(self, name: str, parent: Optional[Span], attributes: Dict[str, Any]) -> Optional[Span]:
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return None
+        span = Span(name, os.urandom(8).hex(), parent.span_id if parent else None, time.time_ns(), attributes=attributes)
+        self.spans.append(span)
+        return span
+
+    def to_otlp(self, service_name: str = "knowledge-builder") -> Dict[str, Any]:
+        """导出为 OTLP/JSON（可直接 POST 到 OTel Collector 的 /v1/traces）"""
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    _otlp_attr("service.name", service_name),
+                    _otlp_attr("task.id", self.task_id),
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [self._otlp_span(span) for span in self.spans],
+                }],
+            }]
+        }
+
+    def _otlp_span(self, span: Span) -> Dict[str, Any]:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+            "attributes": [_otlp_attr(k, v) for k, v in span.attributes.items()],
+            "status": {"code": _STATUS_ERROR, "message": span.error} if span.error else {"code": _STATUS_OK},
+        }
+        if span.parent_id:
+            data["parentSpanId"] = span.parent_id
+        return data
+
+    def summary(self) -> Dict[str, Any]:
+        """按 span 名称汇总耗时，并给出关键路径（从根 span 起每层取最晚结束的子 span）"""
+        stages: Dict[str, Dict[str, float]] = {}
+        children: Dict[Optional[str], List[Span]] = {}
+        for span in self.spans:
+            stage = stages.setdefault(span.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "errors": 0})
+            stage["count"] += 1
+            stage["total_ms"] += span.duration_ms
+            stage["max_ms"] = max(stage["max_ms"], span.duration_ms)
+            stage["errors"] += span.error is not None
+            children.setdefault(span.parent_id, []).append(span)
+
+        critical_path = []
+        level = children.get(None, [])
+        while level:
+            span = max(level, key=lambda s: s.end_ns or time.time_ns())
+            critical_path.append({"name": span.name, "duration_ms": round(span.duration_ms, 3), **span.attributes})
+            level = children.get(span.span_id, [])
+
+        return {
+            "task_id": self.task_id,
+            "trace_id": self.trace_id,
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped,
+            "stages": {
+                name: {**stat, "total_ms": round(stat["total_ms"], 3), "max_ms": round(stat["max_ms"], 3)}
+                for name, stat in sorted(stages.items(), key=lambda kv: -kv[1]["total_ms"])
+            },
+            "critical_path": critical_path,
+        }
+
+
+def _otlp_attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class TraceStore:
+    """最近任务的 trace（内存，超出数量时淘汰最早的）"""
+
+    def __init__(self, max_traces: int = 200, max_spans_per_trace: int = 5000, enabled: bool = True):
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self.enabled = enabled
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+
+    def configure(self, max_traces: int, max_spans_per_trace: int, enabled: bool) -> None:
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self.enabled = enabled
+
+    def get(self, task_id: str) -> Optional[Trace]:
+        return self._traces.get(task_id)
+
+    @contextlib.contextmanager
+    def start_trace(self, task_id: str, name: str = "build", **attributes: Any) -> Iterator[Optional[Trace]]:
+        """
+        在当前上下文开启 task_id 的 trace，并以 name 作为根 span
+
+        其中创建的 asyncio 任务、to_thread 线程会继承上下文，span 自动归属到该 trace
+        """
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(task_id, self.max_spans_per_trace)
+        self._traces[task_id] = trace
+        self._traces.move_to_end(task_id)
+        while len(self._traces) > self.max_traces:
+            self._traces.popitem(last=False)
+
+        token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        try:
+            with span(name, task_id=task_id, **attributes):
+                yield trace
+        finally:
+            with contextlib.suppress(ValueError):
+                _current_span.reset(span_token)
+            with contextlib.suppress(ValueError):
+                _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    记录一个 span（当前上下文没有 trace 时不记录）
+
+    用法:
+        with span("dify.request", method="GET", endpoint=endpoint):
+            ...
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, _current_span.get(), attributes)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        # 异步生成器被回收时可能在其他上下文中结束，此时无需还原
+        with contextlib.suppress(ValueError):
+            _current_span.reset(token)
+
+
+def current_task_id() -> Optional[str]:
+    """当前上下文所属任务的 task_id"""
+    trace = _current_trace.get()
+    return trace.task_id if trace else None
+
+
+# 全局 trace 存储
+trace_store = TraceStore()
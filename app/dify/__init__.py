@@ -14,6 +14,8 @@ from .dify_client import (
 )
 
 from .dify_knowledge_base import DifyKnowledgeBase
+from .dify_cache import DifyResponseCache
+from .key_pool import DifyApiKeyPool
 
 __all__ = [
     "DifyHttpClient",
@@ -23,5 +25,7 @@ __all__ = [
     "DifyServerError",
     "DifyNetworkError",
     "DifyTimeoutError",
-    "DifyKnowledgeBase"
+    "DifyKnowledgeBase",
+    "DifyResponseCache",
+    "DifyApiKeyPool"
 ]
@@ -0,0 +1,129 @@
+"""
+自适应并发控制（AIMD）
+
+根据观测到的延迟与 429/5xx 动态调整允许的在途请求数：
+延迟平稳时线性增长，出现限流、服务端错误或延迟突增时成倍收缩，
+使上传吞吐跟随 Dify 实际可承受的能力变化。
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from loguru import logger
+
+
+class ConcurrencySlot:
+    """单个请求占用的并发名额，用于回报请求结果"""
+
+    __slots__ = ("overloaded", "sampled")
+
+    def __init__(self):
+        self.overloaded = False
+        self.sampled = True
+
+    def mark_overloaded(self) -> None:
+        """请求遇到限流/服务端错误/超时"""
+        self.overloaded = True
+
+    def skip_sample(self) -> None:
+        """结果与负载无关（如 4xx 参数错误），不参与调整"""
+        self.sampled = False
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD 并发限制器"""
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 backoff: float = 0.5, latency_tolerance: float = 2.0,
+                 baseline_window: int = 200):
+        """
+        Args:
+            initial: 初始并发数
+            min_limit: 并发下限
+            max_limit: 并发上限
+            backoff: 过载时的收缩系数
+            latency_tolerance: 延迟超过基线的倍数即视为延迟突增
+            baseline_window: 每隔多少个样本重新评估基线延迟（适应上游的长期变化）
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.baseline_window = baseline_window
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._baseline: Optional[float] = None
+        self._window_min: Optional[float] = None
+        self._window_count = 0
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        """当前允许的在途请求数"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "baseline_latency": round(self._baseline or 0.0, 4),
+        }
+
+    def _update_baseline(self, latency: float) -> None:
+        self._window_min = latency if self._window_min is None else min(self._window_min, latency)
+        self._window_count += 1
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        if self._window_count >= self.baseline_window:
+            self._baseline = self._window_min
+            self._window_min = None
+            self._window_count = 0
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        # 同一批在途请求的连续失败只收缩一次，避免并发数瞬间跌到底
+        if now - self._last_decrease < (self._baseline or 1.0):
+            return
+        self._last_decrease = now
+        old = self.limit
+        self._limit = max(float(self.min_limit), self._limit * self.backoff)
+        logger.warning(f"Dify并发上限收缩: {old} -> {self.limit} ({reason})")
+
+    def _on_complete(self, latency: float, slot: ConcurrencySlot) -> None:
+        if slot.overloaded:
+            self._decrease("限流/服务端错误")
+            return
+        if not slot.sampled:
+            return
+        self._update_baseline(latency)
+        if latency > self._baseline * self.latency_tolerance:
+            self._decrease(f"延迟 {latency:.2f}s 超过基线 {self._baseline:.2f}s")
+        elif self._in_flight + 1 >= self.limit:
+            # 只有名额用满时才增长，否则提高上限没有意义
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[ConcurrencySlot]:
+        """占用一个并发名额，结束后根据结果调整上限"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        slot = ConcurrencySlot()
+        started = time.monotonic()
+        try:
+            yield slot
+        except asyncio.CancelledError:
+            slot.skip_sample()
+            raise
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                self._on_complete(time.monotonic() - started, slot)
+                self._condition.notify_all()
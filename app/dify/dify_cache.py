@@ -0,0 +1,141 @@
+"""
+Dify GET 响应缓存
+
+两级读穿透缓存：进程内 LRU 在前，Redis 在后。各接口独立配置 TTL，
+写接口调用后由 DifyKnowledgeBase 主动失效对应的缓存键。
+"""
+
+from __future__ import annotations
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from loguru import logger
+from app.core.redis import RedisService
+
+DEFAULT_TTLS: Dict[str, int] = {
+    "list_datasets": 60,
+    "get_dataset": 300,
+    "list_dataset_metadata": 300,
+    "get_document_by_id": 60,
+}
+
+
+class DifyResponseCache:
+    """Dify 读接口缓存 - 进程内 LRU + Redis"""
+
+    def __init__(self, redis: Optional[RedisService] = None,
+                 ttls: Optional[Dict[str, int]] = None,
+                 local_max_entries: int = 1024,
+                 local_ttl: int = 10,
+                 prefix: str = "dify:cache:"):
+        """
+        初始化缓存
+
+        Args:
+            redis: Redis服务（为空时只使用进程内缓存）
+            ttls: 各接口的缓存时间（秒），未配置的接口不缓存
+            local_max_entries: 进程内 LRU 最大条目数
+            local_ttl: 进程内缓存的最长时间（秒）；其他进程的写操作只能失效 Redis，
+                       因此本地缓存保持较短的时间以限制不一致窗口
+            prefix: Redis 键前缀
+        """
+        self.redis = redis
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.local_max_entries = local_max_entries
+        self.local_ttl = local_ttl
+        self.prefix = prefix
+        self._local: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def _key(self, endpoint: str, key: str) -> str:
+        return f"{self.prefix}{endpoint}:{key}"
+
+    def _local_get(self, cache_key: str) -> Optional[str]:
+        entry = self._local.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, raw = entry
+        if expires_at < time.monotonic():
+            del self._local[cache_key]
+            return None
+        self._local.move_to_end(cache_key)
+        return raw
+
+    def _local_set(self, cache_key: str, raw: str, ttl: int) -> None:
+        self._local[cache_key] = (time.monotonic() + min(ttl, self.local_ttl), raw)
+        self._local.move_to_end(cache_key)
+        while len(self._local) > self.local_max_entries:
+            self._local.popitem(last=False)
+
+    async def get_or_load(self, endpoint: str, key: str,
+                          loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        读穿透：依次查询本地缓存、Redis，均未命中时调用 loader 并回填
+
+        Args:
+            endpoint: 接口名称（决定 TTL）
+            key: 接口内的缓存键（如 dataset_id）
+            loader: 实际请求 Dify 的协程函数
+
+        Returns:
+            接口响应数据（每次返回独立的副本）
+        """
+        ttl = self.ttls.get(endpoint, 0)
+        if ttl <= 0:
+            return await loader()
+
+        cache_key = self._key(endpoint, key)
+        raw = self._local_get(cache_key)
+        if raw is not None:
+            self.stats["local_hits"] += 1
+            return json.loads(raw)
+
+        if self.redis is not None:
+            try:
+                client = await self.redis.get_client()
+                raw = await client.get(cache_key)
+            except Exception as e:
+                logger.warning(f"读取Dify缓存失败，直接请求Dify: {e}")
+                raw = None
+            if raw is not None:
+                self.stats["redis_hits"] += 1
+                self._local_set(cache_key, raw, ttl)
+                return json.loads(raw)
+
+        self.stats["misses"] += 1
+        data = await loader()
+        raw = json.dumps(data, ensure_ascii=False)
+        self._local_set(cache_key, raw, ttl)
+        if self.redis is not None:
+            try:
+                client = await self.redis.get_client()
+                await client.set(cache_key, raw, ex=ttl)
+            except Exception as e:
+                logger.warning(f"写入Dify缓存失败: {e}")
+        return json.loads(raw)
+
+    async def invalidate(self, endpoint: str, key: str) -> None:
+        """失效单个缓存键"""
+        cache_key = self._key(endpoint, key)
+        self._local.pop(cache_key, None)
+        if self.redis is not None:
+            try:
+                client = await self.redis.get_client()
+                await client.delete(cache_key)
+            except Exception as e:
+                logger.warning(f"失效Dify缓存失败: {cache_key}, 错误: {e}")
+
+    async def invalidate_endpoint(self, endpoint: str) -> None:
+        """失效某个接口下的全部缓存（如分页的 list_datasets）"""
+        prefix = self._key(endpoint, "")
+        for cache_key in [k for k in self._local if k.startswith(prefix)]:
+            del self._local[cache_key]
+        if self.redis is not None:
+            try:
+                client = await self.redis.get_client()
+                keys = [k async for k in client.scan_iter(match=f"{prefix}*", count=100)]
+                if keys:
+                    await client.delete(*keys)
+            except Exception as e:
+                logger.warning(f"失效Dify缓存失败: {prefix}*, 错误: {e}")
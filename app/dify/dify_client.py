@@ -1,9 +1,17 @@
 # client.py
 import os
 import asyncio
-from typing import Dict, Optional, Any
+from typing import AsyncIterable, Dict, Optional, Any, Union
 import httpx
 from loguru import logger
+from app.core.tracing import span
+from app.dify.single_flight import SingleFlight, make_request_key
+from app.dify.concurrency import AdaptiveConcurrencyLimiter
+from app.dify.hedging import HedgePolicy
+from app.dify.key_pool import ApiKeyUnavailableError, DifyApiKeyPool
+
+# 每次请求都会触发的 DEBUG 日志走采样，并使用惰性格式化（未启用 DEBUG 时不做字符串拼接）
+_request_logger = logger.bind(sampled=True)
 
 
 class DifyHttpClientError(Exception):
@@ -36,33 +44,57 @@ class DifyTimeoutError(DifyHttpClientError):
     pass
 
 
+def _rewind_files(files: Optional[Dict[str, Any]]) -> None:
+    """重发请求前将文件字段的文件对象移回开头"""
+    for value in (files or {}).values():
+        file_obj = value[1] if isinstance(value, tuple) and len(value) > 1 else value
+        if hasattr(file_obj, "seek"):
+            file_obj.seek(0)
+
+
 class DifyHttpClient:
     """Dify HTTP客户端 - 带完善异常处理"""
     
-    def __init__(self, base_url: str, api_key: str, timeout: float = 30.0, max_retries: int = 3):
+    def __init__(self, base_url: str, api_key: Union[str, DifyApiKeyPool], timeout: float = 30.0, max_retries: int = 3,
+                 client: Optional[httpx.AsyncClient] = None,
+                 upload_client: Optional[httpx.AsyncClient] = None,
+                 single_flight: bool = False,
+                 upload_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 hedge_policy: Optional[HedgePolicy] = None):
         """
         初始化Dify HTTP客户端
         
         Args:
             base_url: Dify API基础URL
-            api_key: API密钥
+            api_key: API密钥，或持有多个密钥的 DifyApiKeyPool
             timeout: 请求超时时间（秒）
             max_retries: 最大重试次数
+            client: 共享的 httpx 客户端（为空时自行创建并负责关闭）
+            upload_client: 文件上传专用的共享客户端（为空时与 client 相同）
+            single_flight: 是否合并并发的相同 GET 请求
+            upload_limiter: 文件上传的自适应并发限制器（为空时不限制）
+            hedge_policy: GET 请求的对冲策略（为空时不对冲）
         """
         self.base_url = base_url.rstrip("/")
-        self.api_key = api_key
+        self.key_pool = api_key if isinstance(api_key, DifyApiKeyPool) else DifyApiKeyPool([api_key])
         self.timeout = timeout
         self.max_retries = max_retries
         
+        # Authorization 在每次请求时按所选的 Key 设置
         self.headers = {
-            "Authorization": f"Bearer {api_key}",
             "User-Agent": "DifyClient/1.0.0"
         }
         
-        self.client = httpx.AsyncClient(
+        # 外部传入的共享客户端由其所有者（如 HttpClientRegistry）负责关闭
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(
             timeout=timeout,
             limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
         )
+        self.upload_client = upload_client or self.client
+        self.single_flight = SingleFlight() if single_flight else None
+        self.upload_limiter = upload_limiter
+        self.hedge_policy = hedge_policy
         
         logger.info(f"Dify客户端初始化完成: {self.base_url}")
 
@@ -70,6 +102,8 @@ class DifyHttpClient:
                      json: Optional[Dict[str, Any]] = None,
                      files: Optional[Dict[str, Any]] = None, 
                      params: Optional[Dict[str, Any]] = None,
+                     content: Optional[AsyncIterable[bytes]] = None,
+                     content_type: Optional[str] = None,
                      retry_count: int = 0) -> Dict[str, Any]:
         """
         发送HTTP请求到Dify API
@@ -80,6 +114,8 @@ class DifyHttpClient:
             json: JSON数据
             files: 文件数据
             params: URL参数
+            content: 流式请求体（只能发送一次，按文件上传处理）
+            content_type: 流式请求体的 Content-Type
             retry_count: 当前重试次数
             
         Returns:
@@ -92,15 +128,60 @@ class DifyHttpClient:
             DifyNetworkError: 网络错误
             DifyTimeoutError: 请求超时
         """
+        with span("dify.request", method=method, endpoint=endpoint):
+            is_upload = files is not None or content is not None
+            if not is_upload or self.upload_limiter is None:
+                return await self._send(method, endpoint, json=json, files=files, params=params,
+                                        content=content, content_type=content_type, retry_count=retry_count)
+
+            async with self.upload_limiter.slot() as slot:
+                try:
+                    return await self._send(method, endpoint, json=json, files=files, params=params,
+                                            content=content, content_type=content_type, retry_count=retry_count)
+                except (DifyRateLimitError, DifyServerError, DifyTimeoutError):
+                    slot.mark_overloaded()
+                    raise
+                except DifyHttpClientError:
+                    slot.skip_sample()
+                    raise
+
+    @property
+    def upload_concurrency_limit(self) -> Optional[int]:
+        """当前的上传并发上限（未启用自适应并发时为 None）"""
+        return self.upload_limiter.limit if self.upload_limiter else None
+
+    async def _send(self, method: str, endpoint: str, *,
+                    json: Optional[Dict[str, Any]] = None,
+                    files: Optional[Dict[str, Any]] = None,
+                    params: Optional[Dict[str, Any]] = None,
+                    content: Optional[AsyncIterable[bytes]] = None,
+                    content_type: Optional[str] = None,
+                    retry_count: int = 0) -> Dict[str, Any]:
+        """发送单次HTTP请求并统一转换异常"""
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
         headers = self.headers.copy()
+        try:
+            key_state = await self.key_pool.acquire()
+        except ApiKeyUnavailableError as e:
+            logger.error(f"{e}: {method} {url}")
+            if e.reason == "auth":
+                raise DifyAuthenticationError(f"{e}: {method} {url}") from e
+            raise DifyRateLimitError(f"{e}: {method} {url}") from e
+        headers["Authorization"] = f"Bearer {key_state.key}"
         
         try:
-            logger.debug(f"发送请求: {method} {url}")
+            _request_logger.debug("发送请求: {} {}", method, url)
             
-            if files:
-                # 文件上传请求
-                response = await self.client.request(
+            if content is not None:
+                # 流式上传请求（如下载直通上传），同样走上传专用连接池
+                if content_type:
+                    headers["Content-Type"] = content_type
+                response = await self.upload_client.request(
+                    method, url, content=content, headers=headers, params=params
+                )
+            elif files:
+                # 文件上传请求（走上传专用连接池）
+                response = await self.upload_client.request(
                     method, url, data=json, files=files, headers=headers, params=params
                 )
             else:
@@ -110,6 +191,18 @@ class DifyHttpClient:
                     method, url, json=json, headers=headers, params=params
                 )
             
+            self.key_pool.release(key_state, response.status_code, response.headers.get("Retry-After"))
+            key_state = None
+            
+            # 当前 Key 被限流（已被摘除）而池中还有可用 Key 时，立即换 Key 重试；
+            # 流式请求体只能发送一次，不重试
+            if (response.status_code == 429 and content is None
+                    and retry_count < self.max_retries and self.key_pool.has_available()):
+                logger.warning(f"API Key 被限流，换用其他 Key 重试: {method} {url}")
+                _rewind_files(files)
+                return await self._send(method, endpoint, json=json, files=files, params=params,
+                                        retry_count=retry_count + 1)
+            
             # 检查响应状态码
             await self._handle_response(response, method, url, retry_count)
             
@@ -130,10 +223,19 @@ class DifyHttpClient:
             logger.error(f"{error_msg}: {e}")
             raise DifyNetworkError(error_msg) from e
             
+        except DifyHttpClientError:
+            # _handle_response 已抛出具体的异常类型，直接向上传递
+            raise
+            
         except Exception as e:
             error_msg = f"未知错误: {method} {url}"
             logger.error(f"{error_msg}: {e}")
             raise DifyHttpClientError(error_msg) from e
+            
+        finally:
+            # 未拿到响应（网络异常、取消等）时归还 Key
+            if key_state is not None:
+                self.key_pool.release(key_state)
 
     async def _handle_response(self, response: httpx.Response, method: str, url: str, retry_count: int):
         """
@@ -149,7 +251,7 @@ class DifyHttpClient:
         
         # 成功响应
         if 200 <= status_code < 300:
-            logger.debug(f"请求成功: {method} {url} - {status_code}")
+            _request_logger.debug("请求成功: {} {} - {}", method, url, status_code)
             return
         
         # 客户端错误 (4xx)
@@ -184,7 +286,7 @@ class DifyHttpClient:
             raise DifyAuthenticationError(error_msg)
             
         elif status_code == 429:
-            # 限流错误，可以重试
+            # 所有 Key 均被限流（否则已在 _send 中换 Key 重试）
             if retry_count < self.max_retries:
                 retry_after = response.headers.get("Retry-After", "60")
                 wait_time = int(retry_after)
@@ -237,13 +339,26 @@ class DifyHttpClient:
             return response.text or f"HTTP {response.status_code}"
 
     async def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """GET请求"""
-        return await self.request("GET", endpoint, params=params)
+        """GET请求（启用 single_flight 时合并并发的相同请求，配置 hedge_policy 时对冲慢请求）"""
+        if self.single_flight is None:
+            return await self._get(endpoint, params)
+        return await self.single_flight.do(
+            make_request_key("GET", endpoint, params),
+            lambda: self._get(endpoint, params)
+        )
+
+    async def _get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if self.hedge_policy is None:
+            return await self.request("GET", endpoint, params=params)
+        return await self.hedge_policy.run(lambda: self.request("GET", endpoint, params=params))
 
     async def post(self, endpoint: str, json: Optional[Dict[str, Any]] = None, 
-                  files: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                  files: Optional[Dict[str, Any]] = None,
+                  content: Optional[AsyncIterable[bytes]] = None,
+                  content_type: Optional[str] = None) -> Dict[str, Any]:
         """POST请求"""
-        return await self.request("POST", endpoint, json=json, files=files)
+        return await self.request("POST", endpoint, json=json, files=files,
+                                  content=content, content_type=content_type)
 
     async def put(self, endpoint: str, json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """PUT请求"""
@@ -254,9 +369,10 @@ class DifyHttpClient:
         return await self.request("DELETE", endpoint, params=params)
 
     async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
-        logger.info("Dify客户端已关闭")
+        """关闭HTTP客户端（共享客户端不在此关闭）"""
+        if self._owns_client:
+            await self.client.aclose()
+            logger.info("Dify客户端已关闭")
 
     def __enter__(self):
         """上下文管理器入口"""
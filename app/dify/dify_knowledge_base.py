@@ -1,15 +1,41 @@
 from typing import Optional, List, Dict, Any
 import json
 import os
-from typing import Dict, Any
+import uuid
+from typing import AsyncIterable, AsyncIterator, Dict, Any
 from app.dify.dify_client import DifyHttpClient  # 底层 HTTP 客户端
+from app.dify.dify_cache import DifyResponseCache
 
 
 class DifyKnowledgeBase:
     """中间层封装 Dify 知识库相关接口"""
 
-    def __init__(self, client: DifyHttpClient):
+    def __init__(self, client: DifyHttpClient, cache: Optional[DifyResponseCache] = None):
         self.client = client
+        self.cache = cache
+
+    async def _cached_get(self, cache_endpoint: str, cache_key: str, endpoint: str,
+                          params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """带读缓存的 GET 请求（未配置缓存时直接请求）"""
+        if self.cache is None:
+            return await self.client.get(endpoint, params=params)
+        return await self.cache.get_or_load(
+            cache_endpoint, cache_key, lambda: self.client.get(endpoint, params=params)
+        )
+
+    async def _invalidate(self, cache_endpoint: str, cache_key: Optional[str] = None) -> None:
+        """写操作后失效对应缓存（cache_key 为空时失效整个接口）"""
+        if self.cache is None:
+            return
+        if cache_key is None:
+            await self.cache.invalidate_endpoint(cache_endpoint)
+        else:
+            await self.cache.invalidate(cache_endpoint, cache_key)
+
+    async def _invalidate_dataset(self, dataset_id: str) -> None:
+        """文档增删改后失效知识库详情与列表缓存（其中含文档数、字数等统计）"""
+        await self._invalidate("get_dataset", dataset_id)
+        await self._invalidate("list_datasets")
 
     async def list_datasets(self, page: int = 1, limit: int = 20) -> Dict[str, Any]:
         """
@@ -26,7 +52,7 @@ class DifyKnowledgeBase:
             "page": page,
             "limit": limit
         }
-        return await self.client.get("v1/datasets", params=params)
+        return await self._cached_get("list_datasets", f"{page}:{limit}", "v1/datasets", params=params)
 
     async def create_dataset(self, name: str, permission: str = "only_me",
                     indexing_technique: str = "high_quality",
@@ -48,7 +74,10 @@ class DifyKnowledgeBase:
         "indexing_technique": indexing_technique
         }
 
-        return await self.client.post("/v1/datasets", json=payload)
+        try:
+            return await self.client.post("/v1/datasets", json=payload)
+        finally:
+            await self._invalidate("list_datasets")
 
     async def get_dataset(self, dataset_id: str) -> Dict[str, Any]:
         """
@@ -59,7 +88,7 @@ class DifyKnowledgeBase:
             dict: 知识库信息
         """
 
-        return await self.client.get(f"/v1/datasets/{dataset_id}")
+        return await self._cached_get("get_dataset", dataset_id, f"/v1/datasets/{dataset_id}")
 
 
     async def update_dataset(self, dataset_id: str, data: dict) -> dict:
@@ -74,43 +103,39 @@ class DifyKnowledgeBase:
             更新后的知识库信息
         """
         endpoint = f"/v1/datasets/{dataset_id}"
-        return await self.client.request("PATCH", endpoint, json=data)
+        try:
+            return await self.client.request("PATCH", endpoint, json=data)
+        finally:
+            await self._invalidate("get_dataset", dataset_id)
+            await self._invalidate("list_datasets")
 
 
-    async def create_document_by_file(
-        self,
-        dataset_id: str,
-        file_path: str,
-        indexing_technique: str = "high_quality",
+    @staticmethod
+    def build_process_rule(
         process_mode: str = "automatic",
         pre_processing_rules: Optional[List[Dict[str, Any]]] = None,
         separator: str = "###",
         max_tokens: int = 500,
-    ) -> dict:
+    ) -> Dict[str, Any]:
         """
-        通过文件创建文档至知识库 dataset   （支持自动或自定义处理规则）
+        构建文档清洗与分段规则 process_rule
 
         Args:
-            dataset_id: 知识库 ID
-            file_path: 本地文件路径
-            indexing_technique: 向量构建方式，如 "high_quality"
             process_mode: 分段模式："automatic" | "custom"
             pre_processing_rules: 自定义预处理规则（custom 模式时生效）
             separator: 自定义分段符（custom 模式时生效）
             max_tokens: 最大 token 数（custom 模式时生效）
 
         Returns:
-            创建的文档信息
+            process_rule 字典
         """
-
-        # 构建 process_rule
         if process_mode == "automatic":
-            process_rule = {
+            return {
                 "mode": "automatic",
                 "rules": {}
             }
-        elif process_mode == "custom":
-            process_rule = {
+        if process_mode == "custom":
+            return {
                 "mode": "custom",
                 "rules": {
                     "pre_processing_rules": pre_processing_rules or [
@@ -123,13 +148,67 @@ class DifyKnowledgeBase:
                     }
                 }
             }
-        else:
-            raise ValueError(f"不支持的 process_mode：{process_mode}")
+        raise ValueError(f"不支持的 process_mode：{process_mode}")
 
+    @classmethod
+    def build_document_payload(
+        cls,
+        indexing_technique: str = "high_quality",
+        process_mode: str = "automatic",
+        pre_processing_rules: Optional[List[Dict[str, Any]]] = None,
+        separator: str = "###",
+        max_tokens: int = 500,
+        name: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        构建文档上传时 data 字段的内容（create-by-file / update-by-file 共用）
+
+        Returns:
+            包含 indexing_technique、process_rule（以及可选 name）的字典
+        """
         data = {
             "indexing_technique": indexing_technique,
-            "process_rule": process_rule
+            "process_rule": cls.build_process_rule(
+                process_mode, pre_processing_rules, separator, max_tokens
+            )
         }
+        if name:
+            data["name"] = name
+        return data
+
+    async def create_document_by_file(
+        self,
+        dataset_id: str,
+        file_path: str,
+        indexing_technique: str = "high_quality",
+        process_mode: str = "automatic",
+        pre_processing_rules: Optional[List[Dict[str, Any]]] = None,
+        separator: str = "###",
+        max_tokens: int = 500,
+    ) -> dict:
+        """
+        通过文件创建文档至知识库 dataset   （支持自动或自定义处理规则）
+
+        Args:
+            dataset_id: 知识库 ID
+            file_path: 本地文件路径
+            indexing_technique: 向量构建方式，如 "high_quality"
+            process_mode: 分段模式："automatic" | "custom"
+            pre_processing_rules: 自定义预处理规则（custom 模式时生效）
+            separator: 自定义分段符（custom 模式时生效）
+            max_tokens: 最大 token 数（custom 模式时生效）
+
+        Returns:
+            创建的文档信息
+        """
+
+        data = self.build_document_payload(
+            indexing_technique=indexing_technique,
+            process_mode=process_mode,
+            pre_processing_rules=pre_processing_rules,
+            separator=separator,
+            max_tokens=max_tokens,
+        )
 
         # 构造文件上传字段
         with open(file_path, "rb") as f:
@@ -139,7 +218,112 @@ class DifyKnowledgeBase:
             }
 
             endpoint = f"/v1/datasets/{dataset_id}/document/create-by-file"
-            return await self.client.post(endpoint, files=files)
+            try:
+                return await self.client.post(endpoint, files=files)
+            finally:
+                await self._invalidate_dataset(dataset_id)
+
+    @staticmethod
+    async def _stream_multipart(boundary: str, data: dict, file_name: str,
+                                chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """边读边产出 multipart/form-data 请求体（data 字段 + file 字段）"""
+        quoted_name = file_name.replace("\\", "\\\\").replace('"', '\\"')
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="data"\r\n'
+            f"Content-Type: text/plain\r\n\r\n"
+            f"{json.dumps(data)}\r\n"
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{quoted_name}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        async for chunk in chunks:
+            yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    async def create_document_by_stream(
+        self,
+        dataset_id: str,
+        file_name: str,
+        chunks: AsyncIterable[bytes],
+        indexing_technique: str = "high_quality",
+        process_mode: str = "automatic",
+        pre_processing_rules: Optional[List[Dict[str, Any]]] = None,
+        separator: str = "###",
+        max_tokens: int = 500,
+    ) -> dict:
+        """
+        通过字节流创建文档至知识库 dataset（不落盘，流只能消费一次，失败不重试）
+
+        Args:
+            dataset_id: 知识库 ID
+            file_name: 上传的文件名
+            chunks: 文件内容的异步字节流（如外部下载的响应体）
+            其余参数同 create_document_by_file
+
+        Returns:
+            创建的文档信息
+        """
+        data = self.build_document_payload(
+            indexing_technique=indexing_technique,
+            process_mode=process_mode,
+            pre_processing_rules=pre_processing_rules,
+            separator=separator,
+            max_tokens=max_tokens,
+        )
+        boundary = uuid.uuid4().hex
+        endpoint = f"/v1/datasets/{dataset_id}/document/create-by-file"
+        try:
+            return await self.client.post(
+                endpoint,
+                content=self._stream_multipart(boundary, data, file_name, chunks),
+                content_type=f"multipart/form-data; boundary={boundary}",
+            )
+        finally:
+            await self._invalidate_dataset(dataset_id)
+
+    async def create_document_by_text(
+        self,
+        dataset_id: str,
+        name: str,
+        text: str,
+        indexing_technique: str = "high_quality",
+        process_mode: str = "automatic",
+        pre_processing_rules: Optional[List[Dict[str, Any]]] = None,
+        separator: str = "###",
+        max_tokens: int = 500,
+    ) -> dict:
+        """
+        通过文本创建文档至知识库 dataset
+
+        Args:
+            dataset_id: 知识库 ID
+            name: 文档名称
+            text: 文档内容
+            indexing_technique: 向量构建方式，如 "high_quality"
+            process_mode: 分段模式："automatic" | "custom"
+            pre_processing_rules: 自定义预处理规则（custom 模式时生效）
+            separator: 自定义分段符（custom 模式时生效）
+            max_tokens: 最大 token 数（custom 模式时生效）
+
+        Returns:
+            创建的文档信息
+        """
+        data = self.build_document_payload(
+            indexing_technique=indexing_technique,
+            process_mode=process_mode,
+            pre_processing_rules=pre_processing_rules,
+            separator=separator,
+            max_tokens=max_tokens,
+            name=name,
+        )
+        data["text"] = text
+
+        endpoint = f"/v1/datasets/{dataset_id}/document/create-by-text"
+        try:
+            return await self.client.post(endpoint, json=data)
+        finally:
+            await self._invalidate_dataset(dataset_id)
 
     async def get_indexing_status(
         self, dataset_id: str, batch: str
@@ -194,37 +378,14 @@ class DifyKnowledgeBase:
             更新后的文档信息
         """
 
-        # 构建清洗与分段规则
-        if process_mode == "automatic":
-            process_rule = {
-                "mode": "automatic",
-                "rules": {}
-            }
-        elif process_mode == "custom":
-            process_rule = {
-                "mode": "custom",
-                "rules": {
-                    "pre_processing_rules": pre_processing_rules or [
-                        {"id": "remove_extra_spaces", "enabled": True},
-                        {"id": "remove_urls_emails", "enabled": True}
-                    ],
-                    "segmentation": {
-                        "separator": separator,
-                        "max_tokens": max_tokens
-                    }
-                }
-            }
-        else:
-            raise ValueError(f"不支持的 process_mode：{process_mode}")
-
-        # 构建数据体
-        data = {
-            "indexing_technique": indexing_technique,
-            "process_rule": process_rule
-        }
-
-        if name:
-            data["name"] = name
+        data = self.build_document_payload(
+            indexing_technique=indexing_technique,
+            process_mode=process_mode,
+            pre_processing_rules=pre_processing_rules,
+            separator=separator,
+            max_tokens=max_tokens,
+            name=name,
+        )
 
         # 构建上传文件体
         with open(file_path, "rb") as f:
@@ -234,7 +395,11 @@ class DifyKnowledgeBase:
             }
 
             endpoint = f"/v1/datasets/{dataset_id}/documents/{document_id}/update-by-file"
-            return await self.client.post(endpoint, files=files)
+            try:
+                return await self.client.post(endpoint, files=files)
+            finally:
+                await self._invalidate("get_document_by_id", f"{dataset_id}:{document_id}")
+                await self._invalidate_dataset(dataset_id)
 
     async def list_documents_by_dataset_id(self, dataset_id: str, limit: int = 20) -> dict:
         """
@@ -260,7 +425,18 @@ class DifyKnowledgeBase:
         获取知识库下的指定文档
         """
         endpoint = f"/v1/datasets/{dataset_id}/documents/{document_id}"
-        return await self.client.get(endpoint)
+        return await self._cached_get("get_document_by_id", f"{dataset_id}:{document_id}", endpoint)
+
+    async def delete_document(self, dataset_id: str, document_id: str) -> dict:
+        """
+        删除知识库下的指定文档
+        """
+        endpoint = f"/v1/datasets/{dataset_id}/documents/{document_id}"
+        try:
+            return await self.client.delete(endpoint)
+        finally:
+            await self._invalidate("get_document_by_id", f"{dataset_id}:{document_id}")
+            await self._invalidate_dataset(dataset_id)
 
     async def add_dataset_metadata(self, dataset_id: str, metadata: dict):
         """
@@ -273,14 +449,17 @@ class DifyKnowledgeBase:
         """
 
         endpoint = f"/v1/datasets/{dataset_id}/metadata"
-        return await self.client.post(endpoint, json=metadata)
+        try:
+            return await self.client.post(endpoint, json=metadata)
+        finally:
+            await self._invalidate("list_dataset_metadata", dataset_id)
 
     async def list_dataset_metadata(self, dataset_id: str) -> dict:
         """
         获取知识库元数据
         """
         endpoint = f"/v1/datasets/{dataset_id}/metadata"
-        return await self.client.get(endpoint)
+        return await self._cached_get("list_dataset_metadata", dataset_id, endpoint)
     
     async def add_document_metadata(
         self,
@@ -310,7 +489,12 @@ class DifyKnowledgeBase:
         """
         endpoint = f"/v1/datasets/{dataset_id}/documents/metadata"
         data = {"operation_data": metadata}
-        return await self.client.post(endpoint, json=data)
+        try:
+            return await self.client.post(endpoint, json=data)
+        finally:
+            for item in metadata:
+                if item.get("document_id"):
+                    await self._invalidate("get_document_by_id", f"{dataset_id}:{item['document_id']}")
 
     
 
@@ -0,0 +1,111 @@
+"""
+对冲请求（Hedged Requests）
+
+幂等读请求在超过近期延迟的指定分位数仍未返回时，再发送一份相同请求，
+取先成功返回的结果并取消另一份。对冲预算限制额外请求占总请求的比例，
+在降低尾延迟的同时不会让流量翻倍。
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+
+class HedgePolicy:
+    """对冲策略 - 延迟分位数触发 + 令牌桶预算"""
+
+    def __init__(self, percentile: float = 0.95, budget_ratio: float = 0.05,
+                 window: int = 500, min_samples: int = 50,
+                 min_delay: float = 0.02, max_burst: float = 10.0):
+        """
+        Args:
+            percentile: 触发对冲的延迟分位数
+            budget_ratio: 对冲请求占总请求的比例上限
+            window: 统计延迟的样本窗口大小
+            min_samples: 样本数不足时不对冲
+            min_delay: 对冲等待的最短时间（秒）
+            max_burst: 预算允许的最大突发对冲数
+        """
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_burst = max_burst
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._delay: Optional[float] = None
+        self._samples_since_update = 0
+        self._tokens = 0.0
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+    def record(self, latency: float) -> None:
+        """记录一次完成请求的延迟"""
+        self._latencies.append(latency)
+        self._samples_since_update += 1
+        # 分位数按批次重新计算，避免每个请求都排序
+        if self._delay is None or self._samples_since_update >= 20:
+            self._samples_since_update = 0
+            if len(self._latencies) >= self.min_samples:
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile))
+                self._delay = max(self.min_delay, ordered[index])
+
+    @property
+    def hedge_delay(self) -> Optional[float]:
+        """当前的对冲等待时间（样本不足时为 None）"""
+        return self._delay
+
+    def _acquire_budget(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "hedge_delay": self._delay, "tokens": round(self._tokens, 2)}
+
+    async def _timed(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        result = await fn()
+        self.record(time.monotonic() - started)
+        return result
+
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行请求，必要时对冲
+
+        Args:
+            fn: 发起一次（幂等）请求的协程函数，可能被调用两次
+        """
+        self.stats["requests"] += 1
+        self._tokens = min(self.max_burst, self._tokens + self.budget_ratio)
+
+        primary = asyncio.ensure_future(self._timed(fn))
+        delay = self._delay
+        if delay is None:
+            return await primary
+
+        hedge: Optional[asyncio.Future] = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._acquire_budget():
+                return await primary
+
+            self.stats["hedged"] += 1
+            hedge = asyncio.ensure_future(self._timed(fn))
+            pending = {primary, hedge}
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
@@ -0,0 +1,141 @@
+"""
+Dify API Key 池
+
+持有多个 API Key，各自记录在途请求数与限流状态：
+请求按最少负载分配到可用的 Key，遇到 401/429 时将对应 Key 暂时摘除，
+使整体吞吐随持有的 Key 数量扩展。403 通常是对单个资源无权限，不摘除 Key。
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+
+class ApiKeyUnavailableError(Exception):
+    """没有可用的 API Key（reason: auth 表示全部认证失败，rate_limit 表示限流等待超时）"""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _mask(key: str) -> str:
+    return f"...{key[-4:]}" if len(key) > 4 else "****"
+
+
+@dataclass
+class ApiKeyState:
+    """单个 Key 的状态"""
+    key: str
+    in_flight: int = 0
+    total: int = 0
+    disabled_until: float = 0.0
+    disabled_reason: Optional[str] = None  # auth / rate_limit
+    rate_limited: int = 0
+    auth_failures: int = 0
+
+    @property
+    def available(self) -> bool:
+        return self.disabled_until <= time.monotonic()
+
+
+class DifyApiKeyPool:
+    """API Key 池 - 最少负载分配 + 异常摘除"""
+
+    def __init__(self, keys: List[str], rate_limit_cooldown: float = 60.0,
+                 auth_cooldown: float = 300.0, max_wait: float = 60.0):
+        """
+        Args:
+            keys: API Key 列表（自动去重）
+            rate_limit_cooldown: 429 且无 Retry-After 时的摘除时长（秒）
+            auth_cooldown: 401 时的摘除时长（秒）
+            max_wait: 所有 Key 均被限流时，acquire 等待 Key 恢复的最长时间（秒）
+        """
+        keys = list(dict.fromkeys(k for k in keys if k))
+        if not keys:
+            raise ValueError("API Key 池至少需要一个 Key")
+        self._states = [ApiKeyState(key) for key in keys]
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.auth_cooldown = auth_cooldown
+        self.max_wait = max_wait
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def has_available(self) -> bool:
+        """是否还有未被摘除的 Key"""
+        return any(s.available for s in self._states)
+
+    async def acquire(self) -> ApiKeyState:
+        """
+        选取当前负载最少的可用 Key；全部被限流时在 max_wait 内等待最早恢复的 Key
+
+        Raises:
+            ApiKeyUnavailableError: 所有 Key 均认证失败，或等待限流恢复超过 max_wait
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            candidates = [s for s in self._states if s.available]
+            if candidates:
+                state = min(candidates, key=lambda s: (s.in_flight, s.total))
+                state.in_flight += 1
+                state.total += 1
+                return state
+            rate_limited = [s for s in self._states if s.disabled_reason == "rate_limit"]
+            if not rate_limited:
+                raise ApiKeyUnavailableError("所有 Dify API Key 均认证失败", "auth")
+            recover_at = min(s.disabled_until for s in rate_limited)
+            if recover_at > deadline:
+                raise ApiKeyUnavailableError(
+                    f"所有 Dify API Key 均被限流，{recover_at - time.monotonic():.0f} 秒后恢复", "rate_limit"
+                )
+            wait = recover_at - time.monotonic()
+            logger.warning(f"所有 Dify API Key 均被限流，等待 {wait:.1f} 秒")
+            await asyncio.sleep(max(wait, 0.01))
+
+    def release(self, state: ApiKeyState, status_code: Optional[int] = None,
+                retry_after: Optional[str] = None) -> None:
+        """
+        归还 Key，并根据响应状态更新其可用性
+
+        Args:
+            state: acquire 返回的 Key 状态
+            status_code: 响应状态码（网络异常时为 None）
+            retry_after: 响应头 Retry-After
+        """
+        state.in_flight -= 1
+        if status_code == 429:
+            try:
+                cooldown = float(retry_after) if retry_after else self.rate_limit_cooldown
+            except ValueError:
+                cooldown = self.rate_limit_cooldown
+            state.rate_limited += 1
+            self._disable(state, cooldown, "rate_limit", "限流")
+        elif status_code == 401:
+            state.auth_failures += 1
+            self._disable(state, self.auth_cooldown, "auth", "认证失败")
+
+    def _disable(self, state: ApiKeyState, cooldown: float, reason: str, label: str) -> None:
+        until = time.monotonic() + cooldown
+        if until >= state.disabled_until:
+            state.disabled_until = until
+            state.disabled_reason = reason
+        logger.warning(f"Dify API Key {_mask(state.key)} {label}，摘除 {cooldown:.0f} 秒")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "key": _mask(s.key),
+                "in_flight": s.in_flight,
+                "total": s.total,
+                "available": s.available,
+                "disabled_for": round(max(0.0, s.disabled_until - now), 1),
+                "rate_limited": s.rate_limited,
+                "auth_failures": s.auth_failures,
+            }
+            for s in self._states
+        ]
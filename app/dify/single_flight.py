@@ -0,0 +1,42 @@
+"""
+Single-flight 请求合并
+
+同一时刻相同 key 的请求只发出一次，并发调用者共享该请求的结果（或异常）。
+"""
+
+from __future__ import annotations
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+def make_request_key(method: str, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Hashable:
+    """根据方法、端点与参数生成请求 key"""
+    frozen = tuple(sorted((k, str(v)) for k, v in params.items())) if params else ()
+    return method.upper(), "/" + endpoint.lstrip("/"), frozen
+
+
+class SingleFlight:
+    """请求合并器"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"leaders": 0, "shared": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 fn；若相同 key 的请求已在途，则等待并共享其结果
+
+        请求在独立的 Task 中执行，发起者被取消不会影响其他等待者。
+        每个调用者（包括发起者）拿到的都是结果的深拷贝，避免调用方相互修改。
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["shared"] += 1
+            return copy.deepcopy(await asyncio.shield(task))
+
+        self.stats["leaders"] += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return copy.deepcopy(await asyncio.shield(task))
@@ -1,33 +1,28 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes import router
-from app.core.database import init_db
-from app.core.logger import logger
-from app.config import settings
-
-# 创建FastAPI应用
-app = FastAPI(
-    title="知识库构建服务",
-    description="围绕报告引用资料构建自动化数据抓取和知识库构建管线，为智能对话系统提供高质量的上下文支撑",
-    version="1.0.0"
-)
-
-# 添加CORS中间件
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 生产环境中应该限制具体域名
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# 注册路由
-app.include_router(router, prefix="/api/v1")
+from app.api.deps import get_webhook_outbox, reset_dependencies
+from app.core.database import init_db, dispose_engine
+from app.core.logger import logger, setup_logger
+from app.core.redis import redis_service
+from app.core.http_client import http_clients
+from app.core.tracing import trace_store
+from app.core.loop_monitor import loop_monitor
+from app.config import get_settings
 
 
-@app.on_event("startup")
-async def startup_event():
-    """应用启动事件"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时初始化各子系统，关闭时释放资源"""
+    settings = get_settings()
+    setup_logger()
+    trace_store.configure(
+        max_traces=settings.tracing_max_traces,
+        max_spans_per_trace=settings.tracing_max_spans_per_trace,
+        enabled=settings.tracing_enabled,
+    )
     logger.info("知识库构建服务启动中...")
     
     # 初始化数据库
@@ -38,21 +33,54 @@ async def startup_event():
         logger.error(f"数据库初始化失败: {e}")
     
     # 创建必要的目录
-    import os
-    os.makedirs("downloads/pdfs", exist_ok=True)
+    os.makedirs(settings.download_cache_dir, exist_ok=True)
     os.makedirs("logs", exist_ok=True)
     
+    if settings.webhook_enabled:
+        get_webhook_outbox().start()
+    
+    if settings.loop_monitor_enabled:
+        loop_monitor.configure(settings.loop_monitor_interval, settings.loop_monitor_block_threshold)
+        loop_monitor.start()
+    
     logger.info(f"应用启动完成，运行在 {settings.api_host}:{settings.api_port}")
 
+    yield
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """应用关闭事件"""
     logger.info("知识库构建服务正在关闭...")
+    await loop_monitor.stop()
+    await reset_dependencies()
+    await http_clients.aclose()
+    await redis_service.close()
+    dispose_engine()
+    # 等待后台队列中的日志全部写出
+    await logger.complete()
+
+
+# 创建FastAPI应用
+app = FastAPI(
+    title="知识库构建服务",
+    description="围绕报告引用资料构建自动化数据抓取和知识库构建管线，为智能对话系统提供高质量的上下文支撑",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# 添加CORS中间件
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # 生产环境中应该限制具体域名
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# 注册路由
+app.include_router(router, prefix="/api/v1")
 
 
 if __name__ == "__main__":
     import uvicorn
+    settings = get_settings()
     uvicorn.run(
         "app.main:app",
         host=settings.api_host,
@@ -13,7 +13,7 @@ class KnowledgeItem(Base):
     source_type = Column(String(50), nullable=False, comment="数据源类型")
     source_id = Column(String(100), comment="数据源ID")
     file_path = Column(String(500), comment="文件路径")
-    metadata = Column(Text, comment="元数据JSON")
+    metadata_ = Column("metadata", Text, comment="元数据JSON")
     is_processed = Column(Boolean, default=False, comment="是否已处理")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="更新时间")
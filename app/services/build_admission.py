@@ -0,0 +1,158 @@
+"""
+构建任务准入控制
+
+限制进程内同时运行的构建数，超出的请求按优先级进入有界等待队列；
+队列也满时拒绝请求，并根据近期构建耗时估算 Retry-After，避免并发构建耗尽连接池与内存。
+"""
+
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+# 优先级类别 -> 排序值（越小越先执行）
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class BuildQueueFullError(Exception):
+    """构建队列已满"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"构建任务队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    future: asyncio.Future = field(compare=False)
+
+
+class BuildTicket:
+    """一次构建的准入凭证：async with 进入时等待执行名额，退出时归还"""
+
+    def __init__(self, controller: BuildAdmissionController, waiter: _Waiter):
+        self._controller = controller
+        self._waiter = waiter
+        self._entered = False
+        self._finished = False
+        self._started_at = 0.0
+
+    @property
+    def admitted(self) -> bool:
+        """是否已获得执行名额"""
+        future = self._waiter.future
+        return future.done() and not future.cancelled()
+
+    @property
+    def position(self) -> int:
+        """在等待队列中的位置（0 表示已获得执行名额）"""
+        return 0 if self.admitted else self._controller._position(self._waiter)
+
+    async def __aenter__(self) -> BuildTicket:
+        try:
+            await self._waiter.future
+        except asyncio.CancelledError:
+            # 等待期间被取消（如客户端断开）：撤销排队，已获得的名额归还
+            self.cancel()
+            raise
+        self._entered = True
+        self._started_at = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        if not self._finished:
+            self._finished = True
+            self._controller._release(time.monotonic() - self._started_at)
+
+    def cancel(self) -> None:
+        """放弃该凭证（未执行的构建调用，如幂等检查命中已有任务）"""
+        if self._finished:
+            return
+        self._finished = True
+        if self.admitted:
+            self._controller._release(None)
+        else:
+            self._waiter.future.cancel()
+            self._controller._pending -= 1
+
+
+class BuildAdmissionController:
+    """构建准入控制器（进程内）"""
+
+    def __init__(self, max_concurrent: int = 2, max_pending: int = 10,
+                 default_build_seconds: float = 60.0):
+        """
+        Args:
+            max_concurrent: 同时运行的构建数上限
+            max_pending: 等待队列长度上限，超出时拒绝
+            default_build_seconds: 尚无历史数据时估算 Retry-After 使用的构建耗时
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_pending = max(0, max_pending)
+        self._avg_build_seconds = default_build_seconds
+        self._running = 0
+        self._pending = 0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.rejected = 0
+        self.logger = logger
+
+    def reserve(self, priority: str = "normal") -> BuildTicket:
+        """
+        申请构建名额：有空闲名额时直接获得，否则进入等待队列
+
+        Raises:
+            BuildQueueFullError: 等待队列已满
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(PRIORITIES.get(priority, PRIORITIES["normal"]), next(self._seq), future)
+        if self._running < self.max_concurrent and self._pending == 0:
+            self._running += 1
+            future.set_result(None)
+        elif self._pending < self.max_pending:
+            self._pending += 1
+            heapq.heappush(self._queue, waiter)
+        else:
+            self.rejected += 1
+            retry_after = self.retry_after()
+            self.logger.warning(f"构建任务队列已满（运行 {self._running}，排队 {self._pending}），拒绝请求")
+            raise BuildQueueFullError(retry_after)
+        return BuildTicket(self, waiter)
+
+    def retry_after(self) -> int:
+        """按近期平均构建耗时估算队列腾出位置所需的秒数"""
+        rounds = math.ceil((self._pending + 1) / self.max_concurrent)
+        return int(min(max(1.0, self._avg_build_seconds * rounds), 3600))
+
+    def _position(self, waiter: _Waiter) -> int:
+        return 1 + sum(1 for w in self._queue if w < waiter and not w.future.done())
+
+    def _release(self, duration: Optional[float]) -> None:
+        self._running -= 1
+        if duration is not None:
+            # 指数滑动平均，供 Retry-After 估算
+            self._avg_build_seconds = 0.8 * self._avg_build_seconds + 0.2 * duration
+        while self._queue and self._running < self.max_concurrent:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue
+            self._pending -= 1
+            self._running += 1
+            waiter.future.set_result(None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "pending": self._pending,
+            "max_concurrent": self.max_concurrent,
+            "max_pending": self.max_pending,
+            "avg_build_seconds": round(self._avg_build_seconds, 2),
+            "rejected": self.rejected,
+        }
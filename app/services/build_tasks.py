@@ -0,0 +1,63 @@
+"""
+构建任务登记
+
+通过 Redis 保存幂等键 -> task_id 的映射：相同的构建请求在任务运行期间
+（显式幂等键还包括成功后的一段时间内）重复提交时，直接返回已有的 task_id。
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+from typing import Any, Dict, Optional
+from app.core.redis import RedisService
+
+
+class BuildTaskRegistry:
+    """构建任务幂等登记"""
+
+    def __init__(self, redis: RedisService, completed_ttl: int = 3600,
+                 running_ttl: int = 24 * 3600, prefix: str = "knowledge:build:idempotency:"):
+        """
+        Args:
+            redis: Redis服务
+            completed_ttl: 任务成功后（客户端显式提供的）幂等键的保留时间（秒）
+            running_ttl: 任务运行期间幂等键的过期时间（秒），防止进程崩溃后永久占用
+            prefix: Redis 键前缀
+        """
+        self.redis = redis
+        self.completed_ttl = completed_ttl
+        self.running_ttl = running_ttl
+        self.prefix = prefix
+
+    @staticmethod
+    def fingerprint(fields: Dict[str, Any]) -> str:
+        """未显式提供幂等键时，由请求内容生成"""
+        raw = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def claim(self, idempotency_key: str, task_id: str) -> Optional[str]:
+        """
+        登记新任务
+
+        Returns:
+            已存在相同任务时返回其 task_id，登记成功返回 None
+        """
+        client = await self.redis.get_client()
+        key = f"{self.prefix}{idempotency_key}"
+        if await client.set(key, task_id, nx=True, ex=self.running_ttl):
+            return None
+        existing = await client.get(key)
+        # 键恰好在两次调用之间过期时重新登记
+        if existing is None:
+            return await self.claim(idempotency_key, task_id)
+        return existing
+
+    async def complete(self, idempotency_key: str) -> None:
+        """任务成功：幂等键保留 completed_ttl 秒"""
+        client = await self.redis.get_client()
+        await client.expire(f"{self.prefix}{idempotency_key}", self.completed_ttl)
+
+    async def forget(self, idempotency_key: str) -> None:
+        """任务失败：删除幂等键，允许重新提交"""
+        client = await self.redis.get_client()
+        await client.delete(f"{self.prefix}{idempotency_key}")
@@ -1,8 +1,9 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable, Sequence
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from app.model.database import KnowledgeItem
 from app.core.database import get_db_session
+from app.core.tracing import span
 from loguru import logger
 
 
@@ -14,13 +15,19 @@ class DatabaseService:
     
     def query_data(self, query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """执行自定义SQL查询"""
-        try:
-            with get_db_session() as db:
-                result = db.execute(text(query), params or {})
-                columns = result.keys()
-                return [dict(zip(columns, row)) for row in result.fetchall()]
-        except Exception as e:
-            self.logger.error(f"数据库查询失败: {e}")
-            raise
-    
+        with span("db.query_data", sql=" ".join(query.split())[:200]):
+            try:
+                with get_db_session() as db:
+                    result = db.execute(text(query), params or {})
+                    return self.rows_to_dicts(result.keys(), result.fetchall())
+            except Exception as e:
+                self.logger.error(f"数据库查询失败: {e}")
+                raise
+
+    @staticmethod
+    def rows_to_dicts(columns: Iterable[str], rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+        """将查询结果行转换为字典列表"""
+        columns = tuple(columns)
+        return [dict(zip(columns, row)) for row in rows]
+
     
\ No newline at end of file
@@ -3,26 +3,49 @@ Dify 知识库服务
 
 """
 
+import asyncio
+import contextlib
 import os
+from typing import AsyncIterable, Dict, List, Optional, Tuple
 from loguru import logger
 from app.dify.dify_knowledge_base import DifyKnowledgeBase
-from app.utils.utils import save_doc_id
+from app.services.pdf_extractor import PdfTextExtractor
+from app.services.near_duplicate import NearDuplicateDetector
+from app.services.pdf_splitter import PdfSplitter, PdfPart
+from app.services.indexing_backpressure import IndexingBackpressure
+from app.core.redis import RedisService
+from app.utils.utils import HashTee, claim_content_hash, save_doc_id
 
 class DifyKnowledgeBaseService:
 
-    def __init__(self, dify: DifyKnowledgeBase):
+    def __init__(self, dify: DifyKnowledgeBase, pdf_extractor: Optional[PdfTextExtractor] = None,
+                 dedup: Optional[NearDuplicateDetector] = None,
+                 splitter: Optional[PdfSplitter] = None,
+                 split_upload_concurrency: int = 4,
+                 backpressure: Optional[IndexingBackpressure] = None,
+                 redis: Optional[RedisService] = None):
         self.dify = dify
+        self.pdf_extractor = pdf_extractor
+        self.dedup = dedup
+        self.splitter = splitter
+        self.split_upload_concurrency = split_upload_concurrency
+        self.backpressure = backpressure
+        self.redis = redis
         self.logger = logger
 
     async def get_dataset_id_by_name(self, name: str) -> str:
         """
         根据名称获取知识库 ID
         """
-        datasets = await self.dify.list_datasets()
-        for dataset in datasets:
-            if dataset["name"] == name:
-                return dataset["id"]
-        return None
+        page = 1
+        while True:
+            response = await self.dify.list_datasets(page=page, limit=100)
+            for dataset in response.get("data", []):
+                if dataset["name"] == name:
+                    return dataset["id"]
+            if not response.get("has_more", False):
+                return None
+            page += 1
 
     async def create_dataset_metadata(self, dataset_id: str, metadata: dict):
         """
@@ -43,17 +66,246 @@ class DifyKnowledgeBaseService:
             self.logger.error(f"创建知识库元数据失败: {e}")
             raise
 
-    async def create_document_by_file_save_doc_id(self, dataset_id: str, file_path: str):
+    async def _check_near_duplicate(self, dataset_id: str, file_path: str,
+                                    text: Optional[str] = None) -> Tuple[Optional[dict], Optional[str]]:
         """
-        创建文档并保存文档 ID
+        上传前的近重复检测（未配置检测器、或无法获取文本时不检测）
+
+        Returns:
+            (近重复时的跳过记录否则为 None, 预登记的索引键；未检测时为 None)
         """
+        if self.dedup is None:
+            return None, None
+        if text is None:
+            if self.pdf_extractor is None or not file_path.lower().endswith(".pdf"):
+                return None, None
+            text = await self.pdf_extractor.extract_text(file_path)
+        if not text.strip():
+            return None, None
+        return await self.dedup.check_and_reserve(dataset_id, os.path.basename(file_path), text)
+
+    async def _release_near_duplicate(self, dataset_id: str, dedup_key: Optional[str]):
+        """上传失败时撤销近重复索引中的预登记"""
+        if self.dedup is not None and dedup_key is not None:
+            await self.dedup.release(dataset_id, dedup_key)
+
+    def _admission(self, dataset_id: str):
+        """上传准入（未配置背压控制时直接放行）"""
+        if self.backpressure is None:
+            return contextlib.nullcontext()
+        return self.backpressure.admit(dataset_id)
+
+    def _track_indexing(self, dataset_id: str, res: dict):
+        if self.backpressure is not None:
+            self.backpressure.track(dataset_id, res.get("batch"))
+
+    async def _upload_file_save_doc_id(self, dataset_id: str, file_path: str):
         file_name = os.path.basename(file_path)
-        res = await self.dify.create_document_by_file(dataset_id, file_path)
+        async with self._admission(dataset_id):
+            res = await self.dify.create_document_by_file(dataset_id, file_path)
+            self._track_indexing(dataset_id, res)
         save_doc_id(file_name, res.get("document", {}).get("id"))
         return res
 
-    
-             
-        
-        
-        
\ No newline at end of file
+    async def create_document_by_file_save_doc_id(self, dataset_id: str, file_path: str):
+        """
+        创建文档并保存文档 ID
+
+        配置了近重复检测器时，与知识库中已有文档高度相似的文件会被跳过，
+        返回 {"skipped": True, "duplicate_of": ..., "similarity": ...}
+        """
+        duplicate, dedup_key = await self._check_near_duplicate(dataset_id, file_path)
+        if duplicate is not None:
+            return {"skipped": True, **duplicate}
+        try:
+            return await self._upload_file_save_doc_id(dataset_id, file_path)
+        except Exception:
+            await self._release_near_duplicate(dataset_id, dedup_key)
+            raise
+
+    async def create_document_by_pdf_text_save_doc_id(self, dataset_id: str, file_path: str):
+        """
+        本地提取 PDF 文本后通过 create-by-text 创建文档并保存文档 ID
+
+        未配置提取器或 PDF 没有文本层（如扫描件）时回退到文件上传（超限时拆分），由 Dify 解析
+        """
+        if self.pdf_extractor is None:
+            return await self.create_large_document_by_file(dataset_id, file_path)
+
+        text = await self.pdf_extractor.extract_text(file_path)
+        duplicate, dedup_key = await self._check_near_duplicate(dataset_id, file_path, text)
+        if duplicate is not None:
+            return {"skipped": True, **duplicate}
+
+        try:
+            if not text.strip():
+                # 空文本不会在近重复索引中预登记，可直接走大文件上传
+                self.logger.warning(f"PDF未提取到文本，回退到文件上传: {file_path}")
+                return await self.create_large_document_by_file(dataset_id, file_path)
+
+            file_name = os.path.basename(file_path)
+            async with self._admission(dataset_id):
+                res = await self.dify.create_document_by_text(dataset_id, name=file_name, text=text)
+                self._track_indexing(dataset_id, res)
+            save_doc_id(file_name, res.get("document", {}).get("id"))
+            return res
+        except Exception:
+            await self._release_near_duplicate(dataset_id, dedup_key)
+            raise
+
+    async def create_document_by_text_save_doc_id(self, dataset_id: str, name: str, text: str) -> dict:
+        """
+        通过 create-by-text 创建文档并保存文档 ID（经过近重复检测与索引背压）
+        """
+        duplicate, dedup_key = await self._check_near_duplicate(dataset_id, name, text)
+        if duplicate is not None:
+            return {"skipped": True, **duplicate}
+        try:
+            async with self._admission(dataset_id):
+                res = await self.dify.create_document_by_text(dataset_id, name=name, text=text)
+                self._track_indexing(dataset_id, res)
+        except Exception:
+            await self._release_near_duplicate(dataset_id, dedup_key)
+            raise
+        save_doc_id(name, res.get("document", {}).get("id"))
+        return res
+
+    async def _claim_content_hash(self, dataset_id: str, digest: str, doc_id: str) -> str:
+        """
+        原子登记内容摘要 -> 文档 ID（Redis HSETNX，多个进程间一致；Redis 不可用时退化为本地文件）
+
+        Returns:
+            已有相同内容的文档时返回其 ID，否则返回 doc_id
+        """
+        if self.redis is not None:
+            try:
+                client = await self.redis.get_client()
+                key = f"knowledge:content_hash:{dataset_id}"
+                if await client.hsetnx(key, digest, doc_id):
+                    return doc_id
+                return await client.hget(key, digest) or doc_id
+            except Exception as e:
+                self.logger.warning(f"内容摘要登记失败，改用本地文件: {e}")
+        return await asyncio.to_thread(claim_content_hash, dataset_id, digest, doc_id)
+
+    async def create_document_by_stream_save_doc_id(self, dataset_id: str, file_name: str,
+                                                    chunks: AsyncIterable[bytes],
+                                                    hash_tee: bool = True) -> dict:
+        """
+        直接以字节流创建文档并保存文档 ID（下载直通上传，不经过本地磁盘）
+
+        直通模式拿不到完整文件，无法做文本近重复检测和大文件拆分；
+        开启 hash_tee 时在上传过程中计算内容 sha256，上传完成后若知识库中已有
+        内容完全相同的文档，则删除刚创建的文档并返回 {"skipped": True, "duplicate_of": ...}
+        """
+        tee = HashTee(chunks) if hash_tee else None
+        async with self._admission(dataset_id):
+            res = await self.dify.create_document_by_stream(dataset_id, file_name, tee or chunks)
+            self._track_indexing(dataset_id, res)
+        doc_id = res.get("document", {}).get("id")
+
+        if tee is not None and doc_id:
+            digest = tee.hexdigest()
+            existing = await self._claim_content_hash(dataset_id, digest, doc_id)
+            if existing != doc_id:
+                self.logger.info(f"直通上传内容与已有文档相同，删除重复文档: {file_name} -> {existing}")
+                try:
+                    await self.dify.delete_document(dataset_id, doc_id)
+                except Exception as e:
+                    self.logger.warning(f"删除重复文档失败: {doc_id}: {e}")
+                return {"skipped": True, "duplicate_of": existing, "similarity": 1.0}
+            res = {**res, "sha256": digest, "size": tee.size}
+
+        save_doc_id(file_name, doc_id)
+        return res
+
+    async def ensure_dataset_metadata_fields(self, dataset_id: str, fields: Dict[str, str]) -> Dict[str, str]:
+        """
+        确保知识库存在指定的元数据字段
+
+        Args:
+            dataset_id: 知识库 ID
+            fields: 字段名 -> 字段类型（string / number / time）
+
+        Returns:
+            字段名 -> 字段 ID
+        """
+        existing = await self.dify.list_dataset_metadata(dataset_id)
+        field_ids = {item["name"]: item["id"] for item in existing.get("doc_metadata", [])}
+        for name, field_type in fields.items():
+            if name not in field_ids:
+                res = await self.dify.add_dataset_metadata(dataset_id, {"type": field_type, "name": name})
+                field_ids[name] = res["id"]
+        return {name: field_ids[name] for name in fields}
+
+    async def create_large_document_by_file(self, dataset_id: str, file_path: str) -> dict:
+        """
+        上传可能超限的大文件：超过阈值的 PDF 按页段拆分后并发上传，
+        各部分文档打上相同的 parent_document 元数据
+
+        未配置拆分器、非 PDF 或未超过阈值时等同于 create_document_by_file_save_doc_id；
+        拆分前同样对整个文件做近重复检测
+
+        Returns:
+            {"parent_document", "parts": [...], "failed": [...]}（拆分时）
+        """
+        if self.splitter is None or not file_path.lower().endswith(".pdf"):
+            return await self.create_document_by_file_save_doc_id(dataset_id, file_path)
+
+        parts = await self.splitter.split(file_path)
+        if not parts:
+            return await self.create_document_by_file_save_doc_id(dataset_id, file_path)
+
+        try:
+            duplicate, dedup_key = await self._check_near_duplicate(dataset_id, file_path)
+        except Exception:
+            PdfSplitter.cleanup(parts)
+            raise
+        if duplicate is not None:
+            PdfSplitter.cleanup(parts)
+            return {"skipped": True, **duplicate}
+
+        parent = os.path.basename(file_path)
+        semaphore = asyncio.Semaphore(self.split_upload_concurrency)
+
+        async def upload(part: PdfPart):
+            async with semaphore:
+                return await self._upload_file_save_doc_id(dataset_id, part.path)
+
+        try:
+            results = await asyncio.gather(*(upload(part) for part in parts), return_exceptions=True)
+        finally:
+            PdfSplitter.cleanup(parts)
+
+        uploaded: List[dict] = []
+        failed: List[dict] = []
+        for part, res in zip(parts, results):
+            info = {"part": part.index, "total": part.total, "pages": f"{part.start_page}-{part.end_page}"}
+            if isinstance(res, Exception):
+                self.logger.error(f"分片上传失败: {parent} 第{part.index}部分: {res}")
+                failed.append({**info, "error": str(res)})
+            else:
+                uploaded.append({**info, "document_id": res.get("document", {}).get("id"), "batch": res.get("batch")})
+        if not uploaded:
+            await self._release_near_duplicate(dataset_id, dedup_key)
+
+        if uploaded:
+            try:
+                field_ids = await self.ensure_dataset_metadata_fields(
+                    dataset_id, {"parent_document": "string", "part_index": "number", "part_pages": "string"}
+                )
+                await self.dify.add_document_metadata(dataset_id, [
+                    {
+                        "document_id": item["document_id"],
+                        "metadata_list": [
+                            {"id": field_ids["parent_document"], "name": "parent_document", "value": parent},
+                            {"id": field_ids["part_index"], "name": "part_index", "value": item["part"]},
+                            {"id": field_ids["part_pages"], "name": "part_pages", "value": item["pages"]},
+                        ]
+                    }
+                    for item in uploaded
+                ])
+            except Exception as e:
+                self.logger.error(f"分片文档元数据标记失败: {parent}: {e}")
+
+        return {"parent_document": parent, "parts": uploaded, "failed": failed}
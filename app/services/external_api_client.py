@@ -1,86 +1,323 @@
+import asyncio
+import contextlib
+import hashlib
+import json
 import httpx
 import os
-from typing import Dict, Any, Optional
+from typing import AsyncIterator, Dict, Any, List, Optional
 from loguru import logger
+from app.core.redis import RedisService
+from app.core.tracing import span
+from app.services.http_cache import HttpResponseCache
+
+# HEAD 被拒绝时改用 Range GET 探测的状态码
+_HEAD_UNSUPPORTED = {403, 405, 501}
+
+# 明确表示资源不存在的状态码，按完整的负缓存时间缓存；其余失败（超时、5xx、429 等）视为暂时性
+_DEFINITIVE_MISSING = {404, 410}
+
+# PDF 规范允许 %PDF 标记出现在文件前 1024 字节内
+_PDF_MAGIC = b"%PDF"
+_PDF_MAGIC_WINDOW = 1024
+
+
+class DownloadRejectedError(Exception):
+    """下载内容未通过校验（非 PDF、超出大小上限等）"""
+    pass
 
 
 class ExternalAPIClient:
     """外部API客户端"""
     
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None,
+                 cache: Optional[HttpResponseCache] = None,
+                 redis: Optional[RedisService] = None,
+                 preflight_timeout: float = 10.0,
+                 preflight_connect_timeout: float = 3.0,
+                 preflight_ttl: int = 3600,
+                 preflight_negative_ttl: int = 1800,
+                 preflight_transient_ttl: int = 60,
+                 preflight_concurrency: int = 20,
+                 max_download_bytes: int = 100 * 1024 * 1024):
+        """
+        Args:
+            client: 共享的 httpx 客户端（为空时自行创建并负责关闭）
+            cache: query_api_data / post_api_data 的响应缓存
+            redis: URL 预检结果缓存使用的 Redis（为空时不缓存）
+            preflight_timeout: 预检请求的总超时（秒）
+            preflight_connect_timeout: 预检请求的连接超时（秒）
+            preflight_ttl: 可访问 URL 的预检结果缓存时间（秒）
+            preflight_negative_ttl: 不存在（404/410）的 URL 的负缓存时间（秒）
+            preflight_transient_ttl: 暂时性失败（超时、5xx、429 等）的缓存时间（秒），0 表示不缓存
+            preflight_concurrency: 批量预检的并发数
+            max_download_bytes: PDF 下载的大小上限（字节）
+        """
         self.logger = logger
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.cache = cache
+        self.redis = redis
+        self.preflight_timeout = httpx.Timeout(preflight_timeout, connect=preflight_connect_timeout)
+        self.preflight_ttl = preflight_ttl
+        self.preflight_negative_ttl = preflight_negative_ttl
+        self.preflight_transient_ttl = preflight_transient_ttl
+        self.preflight_concurrency = preflight_concurrency
+        self.max_download_bytes = max_download_bytes
+        # 外部传入的共享客户端由其所有者负责关闭
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(timeout=30.0)
     
     async def query_api_data(self, url: str, params: Optional[Dict[str, Any]] = None,
                            headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
-        """查询外部API数据"""
-        try:
-            response = await self.client.get(url, params=params, headers=headers)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            self.logger.error(f"外部API查询失败: {e}")
-            raise
+        """查询外部API数据（配置了缓存时遵循 HTTP 缓存语义）"""
+        with span("external.query", url=url):
+            try:
+                if self.cache is not None:
+                    return await self.cache.fetch(self.client, "GET", url, params=params, headers=headers)
+                response = await self.client.get(url, params=params, headers=headers)
+                response.raise_for_status()
+                return response.json()
+            except Exception as e:
+                self.logger.error(f"外部API查询失败: {e}")
+                raise
     
     async def post_api_data(self, url: str, data: Optional[Dict[str, Any]] = None,
-                          headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
-        """POST请求外部API"""
+                          headers: Optional[Dict[str, str]] = None,
+                          idempotent: bool = False) -> Dict[str, Any]:
+        """
+        POST请求外部API
+
+        Args:
+            idempotent: 调用方声明该 POST 为幂等查询时，允许使用响应缓存
+        """
+        with span("external.post", url=url):
+            try:
+                if idempotent and self.cache is not None:
+                    return await self.cache.fetch(self.client, "POST", url, json_body=data, headers=headers)
+                response = await self.client.post(url, json=data, headers=headers)
+                response.raise_for_status()
+                return response.json()
+            except Exception as e:
+                self.logger.error(f"外部API POST请求失败: {e}")
+                raise
+    
+    async def _write_stream(self, chunks: AsyncIterator[bytes], save_path: str) -> None:
+        """流式写入临时文件，完成后原子替换，失败时清理残留"""
+        os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+        tmp_path = f"{save_path}.part"
         try:
-            response = await self.client.post(url, json=data, headers=headers)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            self.logger.error(f"外部API POST请求失败: {e}")
+            with open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, save_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             raise
-    
+
     async def download_file(self, url: str, save_path: str, 
                           headers: Optional[Dict[str, str]] = None) -> bool:
         """下载文件"""
-        try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            
-            response = await self.client.get(url, headers=headers)
-            response.raise_for_status()
-            
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
+        with span("external.download", url=url):
+            try:
+                async with self.client.stream("GET", url, headers=headers, follow_redirects=True) as response:
+                    response.raise_for_status()
+                    await self._write_stream(response.aiter_bytes(), save_path)
             
-            self.logger.info(f"文件下载成功: {save_path}")
-            return True
-        except Exception as e:
-            self.logger.error(f"文件下载失败: {e}")
-            return False
-    
+                self.logger.info(f"文件下载成功: {save_path}")
+                return True
+            except Exception as e:
+                self.logger.error(f"文件下载失败: {e}")
+                return False
+
+    @staticmethod
+    def _check_pdf_headers(response: httpx.Response, max_bytes: int) -> None:
+        """根据响应头提前拒绝明显不是 PDF 或超出大小上限的下载"""
+        content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type.startswith("text/") or content_type.endswith(("html", "json", "xml")):
+            raise DownloadRejectedError(f"Content-Type 不是 PDF: {content_type}")
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise DownloadRejectedError(f"文件大小 {content_length} 超过上限 {max_bytes}")
+
+    async def iter_pdf_bytes(self, response: httpx.Response,
+                             max_bytes: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        校验并逐块产出 PDF 响应体
+
+        先检查 Content-Type / Content-Length，再检查开头的 %PDF 标记，
+        读取过程中超过大小上限立即中止
+
+        Raises:
+            DownloadRejectedError: 内容未通过校验
+        """
+        max_bytes = max_bytes or self.max_download_bytes
+        self._check_pdf_headers(response, max_bytes)
+        head = b""
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > max_bytes:
+                raise DownloadRejectedError(f"下载超过大小上限 {max_bytes}")
+            if head is not None:
+                # 凑够判断窗口后再校验标记，之前的数据先暂存
+                head += chunk
+                if len(head) < _PDF_MAGIC_WINDOW:
+                    continue
+                if _PDF_MAGIC not in head[:_PDF_MAGIC_WINDOW]:
+                    raise DownloadRejectedError("内容缺少 %PDF 标记")
+                chunk, head = head, None
+            yield chunk
+        if head is not None:
+            if _PDF_MAGIC not in head:
+                raise DownloadRejectedError("内容缺少 %PDF 标记")
+            yield head
+
+    @contextlib.asynccontextmanager
+    async def open_pdf_stream(self, url: str, headers: Optional[Dict[str, str]] = None,
+                              max_bytes: Optional[int] = None):
+        """
+        打开 PDF 下载流（不落盘），产出经过校验的字节流，供直通上传使用
+
+        用法:
+            async with client.open_pdf_stream(url) as chunks:
+                await dify.create_document_by_stream(dataset_id, name, chunks)
+        """
+        with span("external.pdf_stream", url=url):
+            async with self.client.stream("GET", url, headers=headers, follow_redirects=True) as response:
+                response.raise_for_status()
+                yield self.iter_pdf_bytes(response, max_bytes)
+
     async def download_pdf(self, url: str, save_path: str, 
-                          headers: Optional[Dict[str, str]] = None) -> bool:
-        """下载PDF文件"""
-        return await self.download_file(url, save_path, headers)
+                          headers: Optional[Dict[str, str]] = None,
+                          max_bytes: Optional[int] = None) -> bool:
+        """
+        下载PDF文件（流式校验，非 PDF 或超出大小上限时立即中止）
+
+        Args:
+            max_bytes: 大小上限（默认使用 max_download_bytes）
+        """
+        with span("external.download_pdf", url=url):
+            try:
+                async with self.client.stream("GET", url, headers=headers, follow_redirects=True) as response:
+                    response.raise_for_status()
+                    await self._write_stream(self.iter_pdf_bytes(response, max_bytes), save_path)
+            
+                self.logger.info(f"文件下载成功: {save_path}")
+                return True
+            except DownloadRejectedError as e:
+                self.logger.warning(f"PDF下载已中止: {url}: {e}")
+                return False
+            except Exception as e:
+                self.logger.error(f"文件下载失败: {e}")
+                return False
     
     async def get_file_info(self, url: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
-        """获取文件信息（HEAD请求）"""
-        try:
-            response = await self.client.head(url, headers=headers)
-            response.raise_for_status()
-            
-            return {
-                "content_type": response.headers.get("content-type"),
-                "content_length": response.headers.get("content-length"),
-                "last_modified": response.headers.get("last-modified"),
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            self.logger.error(f"获取文件信息失败: {e}")
-            raise
+        """获取文件信息（复用预检探测及其缓存）"""
+        info = await self._preflight_one(url, headers)
+        if not info["accessible"]:
+            error_msg = f"获取文件信息失败: {url}: {info['status_code'] or info['error']}"
+            self.logger.error(error_msg)
+            raise RuntimeError(error_msg)
+        return {
+            "content_type": info["content_type"],
+            "content_length": info["content_length"],
+            "last_modified": info["last_modified"],
+            "status_code": info["status_code"]
+        }
     
     async def check_url_accessible(self, url: str, headers: Optional[Dict[str, str]] = None) -> bool:
-        """检查URL是否可访问"""
+        """检查URL是否可访问（复用预检结果缓存）"""
+        info = await self._preflight_one(url, headers)
+        return info["accessible"]
+
+    @staticmethod
+    def is_definitively_missing(info: Dict[str, Any]) -> bool:
+        """预检结果是否表明资源确定不存在（404/410）；超时、5xx、HEAD 被拒等不算"""
+        return not info["accessible"] and info["status_code"] in _DEFINITIVE_MISSING
+
+    @staticmethod
+    def _preflight_key(url: str) -> str:
+        return f"url:preflight:{hashlib.sha1(url.encode('utf-8')).hexdigest()}"
+
+    async def _probe(self, url: str, headers: Optional[Dict[str, str]]) -> Dict[str, Any]:
+        """HEAD 探测；HEAD 被拒绝时改用只取首字节的 Range GET"""
+        info: Dict[str, Any] = {"url": url, "accessible": False, "status_code": None,
+                                "content_type": None, "content_length": None,
+                                "last_modified": None, "error": None}
         try:
-            response = await self.client.head(url, headers=headers)
-            return response.status_code == 200
+            response = await self.client.head(url, headers=headers, timeout=self.preflight_timeout,
+                                              follow_redirects=True)
+            if response.status_code in _HEAD_UNSUPPORTED:
+                range_headers = {**(headers or {}), "Range": "bytes=0-0"}
+                async with self.client.stream("GET", url, headers=range_headers, timeout=self.preflight_timeout,
+                                              follow_redirects=True) as response:
+                    pass  # 只需要响应头，不读取响应体
+            content_length = response.headers.get("content-length")
+            content_range = response.headers.get("content-range", "")
+            if response.status_code == 206 and "/" in content_range:
+                content_length = content_range.rsplit("/", 1)[1]
+            info.update({
+                "accessible": response.status_code in (200, 206),
+                "status_code": response.status_code,
+                "content_type": response.headers.get("content-type"),
+                "content_length": content_length if content_length != "*" else None,
+                "last_modified": response.headers.get("last-modified"),
+            })
         except Exception as e:
-            self.logger.warning(f"URL不可访问: {url}, 错误: {e}")
-            return False
+            info["error"] = f"{type(e).__name__}: {e}"
+        return info
+
+    async def _preflight_one(self, url: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        key = self._preflight_key(url)
+        if self.redis is not None:
+            try:
+                redis_client = await self.redis.get_client()
+                cached = await redis_client.get(key)
+                if cached:
+                    return json.loads(cached)
+            except Exception as e:
+                self.logger.warning(f"读取URL预检缓存失败: {e}")
+
+        info = await self._probe(url, headers)
+        if not info["accessible"]:
+            self.logger.warning(f"URL不可访问: {url}, 状态码: {info['status_code']}, 错误: {info['error']}")
+
+        if info["accessible"]:
+            ttl = self.preflight_ttl
+        elif self.is_definitively_missing(info):
+            ttl = self.preflight_negative_ttl
+        else:
+            ttl = self.preflight_transient_ttl
+        if self.redis is not None and ttl > 0:
+            try:
+                redis_client = await self.redis.get_client()
+                await redis_client.set(key, json.dumps(info, ensure_ascii=False), ex=ttl)
+            except Exception as e:
+                self.logger.warning(f"写入URL预检缓存失败: {e}")
+        return info
+
+    async def preflight_urls(self, urls: List[str], headers: Optional[Dict[str, str]] = None,
+                             concurrency: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        批量并发预检URL（短连接超时，结果含负缓存）
+
+        Args:
+            urls: URL 列表
+            headers: 请求头
+            concurrency: 并发数（默认使用 preflight_concurrency）
+
+        Returns:
+            URL -> 预检信息（accessible、status_code、content_type、content_length 等）
+        """
+        with span("external.preflight", urls=len(urls)):
+            semaphore = asyncio.Semaphore(concurrency or self.preflight_concurrency)
+
+            async def run(url: str) -> Dict[str, Any]:
+                async with semaphore:
+                    return await self._preflight_one(url, headers)
+
+            unique_urls = list(dict.fromkeys(urls))
+            results = await asyncio.gather(*(run(url) for url in unique_urls))
+            return dict(zip(unique_urls, results))
     
     async def batch_download_files(self, urls: list, save_dir: str, 
                                  headers: Optional[Dict[str, str]] = None) -> Dict[str, bool]:
@@ -108,5 +345,6 @@ class ExternalAPIClient:
         return results
     
     async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
+        """关闭HTTP客户端（共享客户端不在此关闭）"""
+        if self._owns_client:
+            await self.client.aclose()
@@ -0,0 +1,242 @@
+"""
+本地文件缓存（下载的 PDF）
+
+按字节配额与最长保留时间管理 downloads/pdfs：文件按 key 的哈希前缀分片存放到子目录，
+目录下的 index.json 记录每个文件的大小与最近访问时间，超出配额时按 LRU 淘汰，
+正在使用中的文件不会被淘汰。热点文件命中缓存时跳过重新下载。
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+from loguru import logger
+
+_INDEX_FILE = "index.json"
+
+
+class LocalFileCache:
+    """容量受限的本地文件缓存"""
+
+    def __init__(self, directory: str, max_bytes: int = 5 * 1024 * 1024 * 1024,
+                 max_age: float = 0, low_water_ratio: float = 0.9,
+                 index_flush_interval: float = 30.0):
+        """
+        Args:
+            directory: 缓存根目录
+            max_bytes: 总容量上限（字节），0 表示不限制
+            max_age: 文件自最近访问起的最长保留时间（秒），0 表示不按时间淘汰
+            low_water_ratio: 淘汰时回落到 max_bytes 的比例，避免每次写入都触发淘汰
+            index_flush_interval: 仅访问时间变化时，索引落盘的最短间隔（秒）
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.low_water_ratio = low_water_ratio
+        self.index_flush_interval = index_flush_interval
+        # key -> {"size", "atime"}，按访问时间从旧到新排列
+        self._entries: Optional["OrderedDict[str, Dict[str, float]]"] = None
+        self._size = 0
+        self._pins: Dict[str, int] = {}
+        self._key_locks: Dict[str, asyncio.Lock] = {}
+        self._lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._dirty = False
+        self._last_flush = 0.0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.logger = logger
+
+    def path_for(self, key: str) -> str:
+        """key 对应的文件路径（按哈希前缀分片）"""
+        shard = hashlib.sha1(key.encode("utf-8")).hexdigest()[:2]
+        return str(self.directory / shard / os.path.basename(key))
+
+    # ---- 索引 ----
+
+    def _load_index(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_path = self.directory / _INDEX_FILE
+        entries: Dict[str, Dict[str, float]] = {}
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = self._rebuild_index()
+            self._dirty = True
+        except ValueError:
+            self.logger.warning(f"文件缓存索引损坏，重新扫描: {index_path}")
+            entries = self._rebuild_index()
+            self._dirty = True
+        # 丢弃索引中已不存在的文件
+        entries = {k: v for k, v in entries.items() if os.path.exists(self.path_for(k))}
+        self._entries = OrderedDict(sorted(entries.items(), key=lambda kv: kv[1]["atime"]))
+        self._size = sum(e["size"] for e in self._entries.values())
+
+    def _rebuild_index(self) -> Dict[str, Dict[str, float]]:
+        """扫描分片目录重建索引，并把旧版平铺在根目录下的文件迁入分片"""
+        entries: Dict[str, Dict[str, float]] = {}
+        for path in list(self.directory.iterdir()):
+            if path.is_file() and path.name != _INDEX_FILE and not path.name.endswith((".part", ".tmp")):
+                target = Path(self.path_for(path.name))
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target)
+        for shard in self.directory.iterdir():
+            if not shard.is_dir():
+                continue
+            for path in shard.iterdir():
+                if path.is_file() and not path.name.endswith(".part"):
+                    stat = path.stat()
+                    entries[path.name] = {"size": stat.st_size, "atime": stat.st_mtime}
+        return entries
+
+    def _write_index(self, raw: str) -> None:
+        """在线程中写入索引快照（唯一临时文件 + 原子替换）"""
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.directory,
+                                         suffix=".tmp", delete=False) as f:
+            f.write(raw)
+            tmp_path = f.name
+        try:
+            os.replace(tmp_path, self.directory / _INDEX_FILE)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+
+    async def _ensure_loaded(self) -> None:
+        if self._entries is None:
+            async with self._lock:
+                if self._entries is None:
+                    await asyncio.to_thread(self._load_index)
+
+    async def _maybe_flush(self, force: bool = False) -> None:
+        """索引落盘：在事件循环上取快照，写入串行执行；写入失败只记录日志，不影响调用方"""
+        if not self._dirty or not (force or time.time() - self._last_flush >= self.index_flush_interval):
+            return
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            raw = json.dumps(dict(self._entries), ensure_ascii=False)
+            self._dirty = False
+            self._last_flush = time.time()
+            try:
+                await asyncio.to_thread(self._write_index, raw)
+            except OSError as e:
+                self._dirty = True
+                self.logger.warning(f"文件缓存索引写入失败: {e}")
+
+    # ---- 读写 ----
+
+    def _is_expired(self, entry: Dict[str, float], now: float) -> bool:
+        return bool(self.max_age) and now - entry["atime"] > self.max_age
+
+    async def contains(self, key: str) -> bool:
+        """缓存中是否有未过期的 key（不更新访问时间）"""
+        await self._ensure_loaded()
+        entry = self._entries.get(key)
+        return entry is not None and not self._is_expired(entry, time.time())
+
+    async def lookup(self, key: str) -> Optional[str]:
+        """命中时返回文件路径并更新访问时间，未命中或已过期返回 None"""
+        await self._ensure_loaded()
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is None or self._is_expired(entry, now) or not os.path.exists(self.path_for(key)):
+            self.stats["misses"] += 1
+            return None
+        entry["atime"] = now
+        self._entries.move_to_end(key)
+        self._dirty = True
+        self.stats["hits"] += 1
+        await self._maybe_flush()
+        return self.path_for(key)
+
+    async def commit(self, key: str) -> None:
+        """登记已写入 path_for(key) 的文件，超出配额时淘汰"""
+        await self._ensure_loaded()
+        path = self.path_for(key)
+        size = (await asyncio.to_thread(os.stat, path)).st_size
+        async with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old["size"]
+            self._entries[key] = {"size": size, "atime": time.time()}
+            self._size += size
+            self._dirty = True
+            await self._evict()
+        await self._maybe_flush(force=True)
+
+    async def _evict(self) -> None:
+        """淘汰过期文件；超出配额时再按最近访问时间从旧到新淘汰（跳过使用中的文件）"""
+        now = time.time()
+        target = self.max_bytes * self.low_water_ratio
+        over_quota = bool(self.max_bytes) and self._size > self.max_bytes
+        size = self._size
+        victims = []
+        # 条目按访问时间从旧到新排列，遇到既未过期又无需腾空间的条目即可停止
+        for key, entry in self._entries.items():
+            if not self._is_expired(entry, now) and not (over_quota and size > target):
+                break
+            if self._pins.get(key):
+                continue
+            victims.append(key)
+            size -= entry["size"]
+        for key in victims:
+            entry = self._entries.pop(key)
+            self._size -= entry["size"]
+            with contextlib.suppress(FileNotFoundError):
+                await asyncio.to_thread(os.remove, self.path_for(key))
+            self.stats["evictions"] += 1
+        if victims:
+            self._dirty = True
+            self.logger.info(f"文件缓存淘汰 {len(victims)} 个文件，当前占用 {self._size} 字节")
+
+    @contextlib.asynccontextmanager
+    async def use(self, key: str, loader: Callable[[str], Awaitable[bool]]):
+        """
+        获取 key 对应的本地文件，未命中时调用 loader(path) 写入（返回 False 表示失败）
+
+        使用期间文件不会被淘汰；同一 key 的并发请求只加载一次。产出文件路径，加载失败时产出 None
+
+        用法:
+            async with cache.use("123.pdf", lambda p: client.download_pdf(url, p)) as path:
+                ...
+        """
+        self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            lock = self._key_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                path = await self.lookup(key)
+                if path is None:
+                    path = self.path_for(key)
+                    if await loader(path):
+                        await self.commit(key)
+                    else:
+                        path = None
+            # 等待同一 key 的协程都持有引用计数，只剩自己时才回收锁
+            if self._pins.get(key) == 1:
+                self._key_locks.pop(key, None)
+            yield path
+        finally:
+            self._pins[key] -= 1
+            if not self._pins[key]:
+                del self._pins[key]
+
+    async def flush(self) -> None:
+        """将索引写回磁盘（应用关闭时调用）"""
+        if self._entries is not None:
+            await self._maybe_flush(force=True)
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            **self.stats,
+            "entries": len(self._entries or {}),
+            "size": self._size,
+            "max_bytes": self.max_bytes,
+        }
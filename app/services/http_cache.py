@@ -0,0 +1,236 @@
+"""
+外部API响应缓存
+
+遵循 Cache-Control / ETag / Last-Modified 的 HTTP 缓存：
+新鲜期内直接返回缓存，过期后携带 If-None-Match / If-Modified-Since 条件请求，
+304 时复用缓存内容。存储后端可选容量受限的磁盘目录或 Redis。
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+import httpx
+from loguru import logger
+from app.core.redis import RedisService
+
+
+class DiskCacheBackend:
+    """磁盘缓存后端 - 总容量超过上限时按最近访问时间淘汰"""
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+        # 读写在线程池中执行：容量统计与替换、淘汰操作需要加锁
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _total_size(self) -> int:
+        if self._size is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._size = sum(p.stat().st_size for p in self.directory.glob("*.json"))
+        return self._size
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # 记录访问时间，供 LRU 淘汰使用
+            return entry
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, key: str, entry: Dict[str, Any]) -> None:
+        raw = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        if len(raw) > self.max_bytes:
+            return
+        path = self._path(key)
+        with self._lock:
+            self._total_size()  # 确保目录存在并完成初始统计
+        # 每次写入使用唯一的临时文件，同一 key 的并发写入互不干扰
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            f.write(raw)
+            tmp_path = f.name
+        try:
+            with self._lock:
+                try:
+                    old_size = path.stat().st_size
+                except FileNotFoundError:
+                    old_size = 0
+                os.replace(tmp_path, path)
+                self._size += len(raw) - old_size
+                if self._size > self.max_bytes:
+                    self._evict()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self) -> None:
+        """淘汰最久未访问的条目直到低于 90% 容量（调用方需持有 _lock）"""
+        files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self._size -= size
+            except FileNotFoundError:
+                continue
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key: str, entry: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._write, key, entry)
+
+
+class RedisCacheBackend:
+    """Redis缓存后端 - 通过条目大小上限与过期时间限制占用"""
+
+    def __init__(self, redis: RedisService, prefix: str = "http:cache:",
+                 max_entry_bytes: int = 1024 * 1024, retention: int = 7 * 24 * 3600):
+        self.redis = redis
+        self.prefix = prefix
+        self.max_entry_bytes = max_entry_bytes
+        self.retention = retention  # 过期条目保留用于条件请求重新验证的时长（秒）
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        client = await self.redis.get_client()
+        raw = await client.get(f"{self.prefix}{key}")
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, entry: Dict[str, Any]) -> None:
+        raw = json.dumps(entry, ensure_ascii=False)
+        if len(raw) > self.max_entry_bytes:
+            return
+        client = await self.redis.get_client()
+        await client.set(f"{self.prefix}{key}", raw, ex=self.retention)
+
+
+def _parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, arg = part.partition("=")
+        directives[name.strip().lower()] = arg.strip().strip('"') or None
+    return directives
+
+
+class HttpResponseCache:
+    """HTTP响应缓存"""
+
+    def __init__(self, backend, default_ttl: int = 0):
+        """
+        Args:
+            backend: 存储后端（DiskCacheBackend / RedisCacheBackend）
+            default_ttl: 响应未声明 max-age 时的新鲜期（秒）
+        """
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "stored": 0, "errors": 0}
+
+    @property
+    def hit_rate(self) -> float:
+        """命中率（含 304 重新验证）"""
+        served = self.stats["hits"] + self.stats["revalidated"]
+        total = served + self.stats["misses"]
+        return served / total if total else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "hit_rate": round(self.hit_rate, 4)}
+
+    @staticmethod
+    def make_key(method: str, url: str, params: Optional[Dict[str, Any]] = None,
+                 body: Optional[Dict[str, Any]] = None,
+                 headers: Optional[Dict[str, str]] = None) -> str:
+        raw = json.dumps(
+            [method.upper(), url, params or {}, body, sorted((headers or {}).items())],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def _get_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"读取HTTP缓存失败: {e}")
+            return None
+
+    async def _store(self, key: str, entry: Dict[str, Any], response: httpx.Response) -> None:
+        directives = _parse_cache_control(response.headers.get("cache-control"))
+        if "no-store" in directives:
+            return
+        etag = response.headers.get("etag") or entry.get("etag")
+        last_modified = response.headers.get("last-modified") or entry.get("last_modified")
+        if "no-cache" in directives:
+            ttl = 0
+        elif directives.get("max-age"):
+            try:
+                ttl = int(directives["max-age"])
+            except ValueError:
+                ttl = self.default_ttl
+        else:
+            ttl = self.default_ttl
+        if ttl <= 0 and not (etag or last_modified):
+            return  # 既不新鲜也无法重新验证，没有缓存价值
+        entry.update({
+            "etag": etag,
+            "last_modified": last_modified,
+            "expires_at": time.time() + max(ttl, 0),
+        })
+        try:
+            await self.backend.set(key, entry)
+            self.stats["stored"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"写入HTTP缓存失败: {e}")
+
+    async def fetch(self, client: httpx.AsyncClient, method: str, url: str, *,
+                    params: Optional[Dict[str, Any]] = None,
+                    json_body: Optional[Dict[str, Any]] = None,
+                    headers: Optional[Dict[str, str]] = None) -> Any:
+        """
+        通过缓存发送请求并返回 JSON 数据
+
+        Raises:
+            httpx.HTTPStatusError: 非 2xx/304 响应
+        """
+        key = self.make_key(method, url, params, json_body, headers)
+        entry = await self._get_entry(key)
+        if entry is not None and entry.get("expires_at", 0) > time.time():
+            self.stats["hits"] += 1
+            return entry["body"]
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry.get("etag"):
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = await client.request(method, url, params=params, json=json_body, headers=request_headers)
+        if response.status_code == 304 and entry is not None:
+            self.stats["revalidated"] += 1
+            await self._store(key, entry, response)
+            return entry["body"]
+
+        response.raise_for_status()
+        self.stats["misses"] += 1
+        body = response.json()
+        await self._store(key, {"body": body}, response)
+        return body
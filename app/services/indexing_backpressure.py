@@ -0,0 +1,170 @@
+"""
+Dify 索引队列背压
+
+按知识库统计仍处于 waiting/indexing 等状态的文档数，超过高水位时暂停新的上传，
+直到回落到低水位以下，避免上传速度超过 Dify 的索引能力而拖慢整个实例。
+"""
+
+from __future__ import annotations
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Optional
+from loguru import logger
+from app.core.tracing import span
+from app.dify.dify_knowledge_base import DifyKnowledgeBase
+
+# 索引已结束（不再占用 Dify 索引队列）的状态
+FINISHED_STATUSES = {"completed", "error", "paused", "stopped"}
+
+
+@dataclass
+class _DatasetState:
+    batches: Dict[str, int] = field(default_factory=dict)  # batch -> 未完成文档数
+    batch_errors: Dict[str, int] = field(default_factory=dict)
+    reserved: int = 0  # 已放行但尚未拿到 batch 的上传
+    waiting: int = 0  # 已进入准入、尚未放行的上传
+    paused: bool = False
+    condition: asyncio.Condition = field(default_factory=asyncio.Condition)
+    poller: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        return self.reserved + sum(self.batches.values())
+
+
+class IndexingBackpressure:
+    """上传准入控制器 - 基于索引队列深度的高/低水位背压"""
+
+    def __init__(self, dify: DifyKnowledgeBase, high_water: int = 200, low_water: int = 100,
+                 poll_interval: float = 5.0, max_poll_errors: int = 5,
+                 poll_concurrency: int = 8):
+        """
+        Args:
+            dify: Dify 知识库接口
+            high_water: 队列深度达到该值时暂停上传
+            low_water: 暂停后队列深度低于该值才恢复上传
+            poll_interval: 查询索引状态的间隔（秒）
+            max_poll_errors: 单个批次连续查询失败次数上限，超过后不再跟踪
+            poll_concurrency: 每轮并发查询的批次数上限
+        """
+        if low_water > high_water:
+            raise ValueError("low_water 不能大于 high_water")
+        self.dify = dify
+        self.high_water = high_water
+        self.low_water = low_water
+        self.poll_interval = poll_interval
+        self.max_poll_errors = max_poll_errors
+        self.poll_concurrency = max(1, poll_concurrency)
+        self._states: Dict[str, _DatasetState] = {}
+        self.logger = logger
+
+    def _state(self, dataset_id: str) -> _DatasetState:
+        state = self._states.get(dataset_id)
+        if state is None:
+            state = self._states[dataset_id] = _DatasetState()
+        return state
+
+    def _prune(self, dataset_id: str, state: _DatasetState) -> None:
+        """知识库没有在途上传、未完成批次与轮询任务时移除其状态"""
+        if state.batches or state.reserved or state.waiting:
+            return
+        if state.poller is not None and not state.poller.done() and state.poller is not asyncio.current_task():
+            return
+        if self._states.get(dataset_id) is state:
+            del self._states[dataset_id]
+
+    def depth(self, dataset_id: str) -> int:
+        """知识库当前的索引队列深度（含已放行的上传）"""
+        state = self._states.get(dataset_id)
+        return state.depth if state else 0
+
+    def _has_capacity(self, state: _DatasetState) -> bool:
+        if state.paused:
+            if state.depth < self.low_water:
+                state.paused = False
+        elif state.depth >= self.high_water:
+            state.paused = True
+        return not state.paused
+
+    @asynccontextmanager
+    async def admit(self, dataset_id: str) -> AsyncIterator[None]:
+        """
+        上传准入：队列深度过高时等待；上传完成后调用方应通过 track 登记 batch
+        """
+        state = self._state(dataset_id)
+        # 进入时即登记，等待锁与放行期间状态不会被移除
+        state.waiting += 1
+        try:
+            async with state.condition:
+                if not self._has_capacity(state):
+                    self.logger.warning(f"知识库 {dataset_id} 索引队列深度 {state.depth}，暂停上传")
+                    with span("indexing.backpressure_wait", dataset_id=dataset_id, depth=state.depth):
+                        await state.condition.wait_for(lambda: self._has_capacity(state))
+                    self.logger.info(f"知识库 {dataset_id} 索引队列回落至 {state.depth}，恢复上传")
+                state.reserved += 1
+        except BaseException:
+            state.waiting -= 1
+            self._prune(dataset_id, state)
+            raise
+        state.waiting -= 1
+        try:
+            yield
+        finally:
+            async with state.condition:
+                state.reserved -= 1
+                state.condition.notify_all()
+                self._prune(dataset_id, state)
+
+    def track(self, dataset_id: str, batch: Optional[str], documents: int = 1) -> None:
+        """登记上传返回的批次，后台轮询其索引状态"""
+        if not batch:
+            return
+        state = self._state(dataset_id)
+        state.batches[batch] = documents
+        if state.poller is None or state.poller.done():
+            # 轮询任务比触发它的构建活得更久，使用空上下文，避免 span 记入该构建的 trace
+            state.poller = asyncio.create_task(self._poll(dataset_id, state), context=contextvars.Context())
+
+    async def _poll_batch(self, dataset_id: str, state: _DatasetState, batch: str,
+                          semaphore: asyncio.Semaphore) -> None:
+        try:
+            async with semaphore:
+                res = await self.dify.get_indexing_status(dataset_id, batch)
+        except Exception as e:
+            errors = state.batch_errors.get(batch, 0) + 1
+            state.batch_errors[batch] = errors
+            self.logger.warning(f"查询索引状态失败: {dataset_id}/{batch} ({errors}次): {e}")
+            if errors < self.max_poll_errors:
+                return
+            unfinished = 0
+        else:
+            unfinished = sum(
+                1 for doc in res.get("data", [])
+                if doc.get("indexing_status") not in FINISHED_STATUSES
+            )
+        if unfinished:
+            state.batches[batch] = unfinished
+        else:
+            state.batches.pop(batch, None)
+            state.batch_errors.pop(batch, None)
+
+    async def _poll(self, dataset_id: str, state: _DatasetState) -> None:
+        semaphore = asyncio.Semaphore(self.poll_concurrency)
+        while state.batches:
+            await asyncio.sleep(self.poll_interval)
+            # 各批次并发查询（有上限），批次较多时每轮耗时不随批次数线性增长
+            await asyncio.gather(*(
+                self._poll_batch(dataset_id, state, batch, semaphore) for batch in list(state.batches)
+            ))
+            async with state.condition:
+                state.condition.notify_all()
+        # 与上面的循环条件之间没有 await，track 不会在此期间登记新批次
+        self._prune(dataset_id, state)
+
+    async def close(self) -> None:
+        """停止所有后台轮询"""
+        for state in self._states.values():
+            if state.poller is not None and not state.poller.done():
+                state.poller.cancel()
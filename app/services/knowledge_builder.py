@@ -1,20 +1,63 @@
 import asyncio
+import contextlib
 import os
 import json
-from typing import Dict, Any, Optional, List
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, Optional, List
 from app.services.database_service import DatabaseService
 from app.dify.dify_knowledge_base import DifyKnowledgeBase
-from app.services.external_api_client import ExternalAPIClient
+from app.services.external_api_client import ExternalAPIClient, DownloadRejectedError
+from app.dify.dify_client import DifyHttpClientError
+from app.services.dify_kb_service import DifyKnowledgeBaseService
+from app.services.file_cache import LocalFileCache
+from app.model.database import KnowledgeItem
+from app.core.redis import RedisService, RedisLock
+from app.core.tracing import span, trace_store
 from loguru import logger
 
+# 允许作为查询条件的字段（避免将任意键拼接进 SQL）
+QUERYABLE_COLUMNS = {column.name for column in KnowledgeItem.__table__.columns}
+
 
 class KnowledgeBuilder:
     """知识库构建器 - 核心业务逻辑"""
     
-    def __init__(self, dify: DifyKnowledgeBase, external_api_client: ExternalAPIClient, database_service: DatabaseService):
+    def __init__(self, dify: DifyKnowledgeBase, external_api_client: ExternalAPIClient, database_service: DatabaseService,
+                 kb_service: Optional[DifyKnowledgeBaseService] = None,
+                 redis: Optional[RedisService] = None,
+                 lock_ttl: float = 60.0,
+                 lock_wait_timeout: Optional[float] = 600.0,
+                 download_dir: str = "downloads/pdfs",
+                 passthrough: bool = False,
+                 file_cache: Optional[LocalFileCache] = None,
+                 pdf_local_extract: bool = False):
+        """
+        Args:
+            dify: Dify 知识库接口
+            external_api_client: 外部API客户端（下载引用资料）
+            database_service: 数据库服务
+            kb_service: Dify 知识库业务服务（为空时基于 dify 创建）
+            redis: Redis服务，配置后同一知识库的构建通过分布式锁串行执行
+            lock_ttl: 分布式锁过期时间（秒），持有期间自动续期
+            lock_wait_timeout: 等待分布式锁的最长时间（秒）
+            download_dir: PDF 下载目录（未传入 file_cache 时作为缓存目录）
+            passthrough: 远程 PDF 是否直通上传（下载流直接写入 Dify 上传请求，不落盘）
+            file_cache: 下载 PDF 的本地文件缓存（容量受限，按 LRU 淘汰）
+            pdf_local_extract: 本地 PDF 是否先提取文本再通过 create-by-text 上传
+        """
         self.dify = dify
         self.external_api_client = external_api_client
         self.database_service = database_service
+        self.kb_service = kb_service or DifyKnowledgeBaseService(dify)
+        self.redis = redis
+        self.lock_ttl = lock_ttl
+        self.lock_wait_timeout = lock_wait_timeout
+        self.download_dir = download_dir
+        self.passthrough = passthrough
+        self.file_cache = file_cache or LocalFileCache(download_dir)
+        self.pdf_local_extract = pdf_local_extract
+        # Redis 不可用时退化使用的进程内锁：dataset_name -> [锁, 使用者数]
+        self._local_locks: Dict[str, List[Any]] = {}
+        self.logger = logger
 
 
     def get_survey_report_by_collection_name(keyword_items_list: List[str]):
@@ -23,10 +66,283 @@ class KnowledgeBuilder:
         """
         pass
 
-    
+    def _query_items(self, report_id: Optional[str], query_conditions: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """查询待入库的引用资料"""
+        clauses = []
+        params: Dict[str, Any] = {}
+        if report_id:
+            clauses.append("source_id = :report_id")
+            params["report_id"] = report_id
+        for column, value in (query_conditions or {}).items():
+            if column not in QUERYABLE_COLUMNS:
+                raise ValueError(f"不支持的查询条件字段: {column}")
+            clauses.append(f"{column} = :cond_{column}")
+            params[f"cond_{column}"] = value
+        sql = f"SELECT id, title, content, source_type, source_id, file_path, metadata FROM {KnowledgeItem.__tablename__}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return self.database_service.query_data(sql, params)
 
+    async def _get_or_create_dataset(self, dataset_name: str, description: Optional[str]) -> str:
+        dataset_id = await self.kb_service.get_dataset_id_by_name(dataset_name)
+        if dataset_id:
+            return dataset_id
+        dataset = await self.dify.create_dataset(dataset_name)
+        if description:
+            await self.dify.update_dataset(dataset["id"], {"description": description})
+        self.logger.info(f"已创建知识库: {dataset_name} ({dataset['id']})")
+        return dataset["id"]
 
+    @staticmethod
+    def _is_remote(file_path: Optional[str]) -> bool:
+        return bool(file_path) and file_path.startswith(("http://", "https://"))
 
-    
-    
+    @contextlib.asynccontextmanager
+    async def _resolve_file(self, item: Dict[str, Any], include_pdfs: bool):
+        """获取引用资料的本地文件（远程 PDF 经文件缓存下载，使用期间不会被淘汰）"""
+        file_path = item.get("file_path")
+        if not file_path or not include_pdfs:
+            yield None
+        elif self._is_remote(file_path):
+            loader = lambda save_path: self.external_api_client.download_pdf(file_path, save_path)
+            async with self.file_cache.use(f"{item['id']}.pdf", loader) as cached_path:
+                if cached_path is None:
+                    raise RuntimeError(f"下载失败: {file_path}")
+                yield cached_path
+        else:
+            yield file_path if os.path.exists(file_path) else None
+
+    async def _use_passthrough(self, item: Dict[str, Any], include_pdfs: bool) -> bool:
+        """远程 PDF 在开启直通且本地没有已下载副本时直通上传"""
+        file_path = item.get("file_path")
+        return (self.passthrough and include_pdfs and self._is_remote(file_path)
+                and not await self.file_cache.contains(f"{item['id']}.pdf"))
+
+    async def _upload_passthrough(self, dataset_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.external_api_client.open_pdf_stream(item["file_path"]) as chunks:
+            try:
+                return await self.kb_service.create_document_by_stream_save_doc_id(
+                    dataset_id, f"{item['id']}.pdf", chunks
+                )
+            except DifyHttpClientError as e:
+                # 下载内容校验失败时，上传请求被中止，还原为真实原因
+                if isinstance(e.__cause__, DownloadRejectedError):
+                    raise e.__cause__
+                raise
+
+    async def _process_item(self, dataset_id: str, item: Dict[str, Any], include_pdfs: bool,
+                            preflight: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """处理单条引用资料，返回处理记录"""
+        with span("build.item", item_id=str(item.get("id"))) as item_span:
+            record = await self._process_item_inner(dataset_id, item, include_pdfs, preflight)
+            if item_span is not None:
+                item_span.attributes["status"] = record["status"]
+                item_span.error = record.get("error")
+            return record
+
+    async def _process_item_inner(self, dataset_id: str, item: Dict[str, Any], include_pdfs: bool,
+                                  preflight: Optional[Dict[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"item_id": item.get("id"), "title": item.get("title")}
+        url_info = (preflight or {}).get(item.get("file_path") or "")
+        # 只有确定不存在的链接直接记为失败；临时性失败仍尝试下载（下载自带重试）
+        if include_pdfs and url_info is not None and ExternalAPIClient.is_definitively_missing(url_info):
+            return {**record, "status": "failed", "error": f"链接不可访问: {url_info['status_code']}"}
+        try:
+            if await self._use_passthrough(item, include_pdfs):
+                res = await self._upload_passthrough(dataset_id, item)
+            else:
+                async with self._resolve_file(item, include_pdfs) as file_path:
+                    if file_path and self.pdf_local_extract and file_path.lower().endswith(".pdf"):
+                        res = await self.kb_service.create_document_by_pdf_text_save_doc_id(dataset_id, file_path)
+                    elif file_path:
+                        res = await self.kb_service.create_large_document_by_file(dataset_id, file_path)
+                    elif item.get("content"):
+                        res = await self.kb_service.create_document_by_text_save_doc_id(
+                            dataset_id, item["title"], item["content"]
+                        )
+                    else:
+                        return {**record, "status": "skipped", "reason": "无可入库的内容"}
+
+            if res.get("skipped"):
+                return {**record, "status": "skipped", "reason": "近重复", "duplicate_of": res.get("duplicate_of")}
+            if res.get("failed"):
+                return {**record, "status": "failed", "error": f"{len(res['failed'])} 个分片上传失败"}
+            doc_id = res.get("document", {}).get("id") or [p["document_id"] for p in res.get("parts", [])]
+            return {**record, "status": "uploaded", "doc_id": doc_id}
+        except Exception as e:
+            self.logger.error(f"引用资料入库失败: {item.get('id')}: {e}")
+            return {**record, "status": "failed", "error": str(e)}
+
+    async def _iter_build(self, report_id: Optional[str], query_conditions: Optional[Dict[str, Any]],
+                          dataset_name: str, description: Optional[str],
+                          include_pdfs: bool, batch_size: int,
+                          lock: Optional[RedisLock] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        先产出开始记录（含总数），再逐条产出处理记录（批内按完成顺序），最后产出汇总；不保留记录列表
+
+        每批开始前及每条记录产出前检查构建锁，锁已丢失时抛出 RuntimeError（批内未完成的条目随之取消）
+        """
+        with span("build.query_items"):
+            items = await asyncio.to_thread(self._query_items, report_id, query_conditions)
+        with span("build.get_or_create_dataset", dataset_name=dataset_name):
+            dataset_id = await self._get_or_create_dataset(dataset_name, description)
+
+        # 并发预检远程链接，确定失效（404/410）的链接直接记为失败，不再等待下载超时
+        urls = [item["file_path"] for item in items if include_pdfs and self._is_remote(item.get("file_path"))]
+        preflight = await self.external_api_client.preflight_urls(urls) if urls else {}
+
+        yield {"type": "start", "dataset_id": dataset_id, "total_items": len(items)}
+
+        def check_lock():
+            if lock is not None and lock.lost:
+                raise RuntimeError(f"知识库 {dataset_name} 的构建锁已丢失，中止构建")
 
+        processed = failed = 0
+        for start in range(0, len(items), max(1, batch_size)):
+            check_lock()
+            batch = items[start:start + batch_size]
+            with span("build.batch", start=start, size=len(batch)):
+                tasks = [asyncio.ensure_future(self._process_item(dataset_id, item, include_pdfs, preflight)) for item in batch]
+                try:
+                    for next_done in asyncio.as_completed(tasks):
+                        record = await next_done
+                        check_lock()
+                        if record["status"] == "failed":
+                            failed += 1
+                        else:
+                            processed += 1
+                        yield {"type": "item", **record}
+                finally:
+                    # 调用方提前停止迭代（如客户端断开）时取消批内未完成的条目
+                    for task in tasks:
+                        task.cancel()
+
+        yield {
+            "type": "summary",
+            "success": failed == 0,
+            "dataset_id": dataset_id,
+            "message": "知识库构建完成" if failed == 0 else f"知识库构建完成，{failed} 条失败",
+            "total_items": len(items),
+            "processed_items": processed,
+            "failed_items": failed,
+        }
+
+    @contextlib.asynccontextmanager
+    async def _local_build_lock(self, dataset_name: str):
+        """进程内的同名知识库构建锁（无人使用时回收）"""
+        entry = self._local_locks.setdefault(dataset_name, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._local_locks.pop(dataset_name, None)
+
+    @contextlib.asynccontextmanager
+    async def _build_lock(self, dataset_name: str):
+        """
+        同一知识库的构建串行执行：配置了 Redis 时使用分布式锁（产出持有的锁），
+        未配置或 Redis 不可用时退化为进程内锁（产出 None），与幂等检查的降级方式一致
+        """
+        if self.redis is None:
+            async with self._local_build_lock(dataset_name):
+                yield None
+            return
+        lock = RedisLock(f"knowledge:build:lock:{dataset_name}", ttl=self.lock_ttl, redis=self.redis)
+        with span("build.lock_wait", dataset_name=dataset_name):
+            try:
+                acquired = await lock.acquire(timeout=self.lock_wait_timeout)
+            except Exception as e:
+                self.logger.warning(f"分布式锁不可用，同一知识库的构建退化为进程内串行: {dataset_name}: {e}")
+                acquired = None
+        if acquired is None:
+            async with self._local_build_lock(dataset_name):
+                yield None
+            return
+        if not acquired:
+            raise RuntimeError(f"知识库 {dataset_name} 正在由其他任务构建，等待超时")
+        try:
+            yield lock
+        finally:
+            await lock.release()
+
+    async def iter_build_records(self, report_id: Optional[str] = None,
+                                 query_conditions: Optional[Dict[str, Any]] = None,
+                                 dataset_name: str = "",
+                                 description: Optional[str] = "",
+                                 include_pdfs: bool = True,
+                                 batch_size: int = 50,
+                                 task_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式构建知识库：先产出 {"type": "start", "dataset_id", "total_items"}，
+        每处理完一条引用资料产出一条记录
+        （{"type": "item", "item_id", "status", "doc_id" | "error" | "reason", ...}），
+        最后产出 {"type": "summary", ...}
+
+        同一知识库的构建通过分布式锁串行执行，锁丢失（续期失败）时中止构建并抛出 RuntimeError，
+        避免与新的持有者同时写入；传入 task_id 时记录链路追踪。
+        提前停止迭代会释放锁并取消未完成的条目
+        """
+        trace = trace_store.start_trace(task_id, dataset_name=dataset_name) if task_id else contextlib.nullcontext()
+        with trace:
+            async with self._build_lock(dataset_name) as lock:
+                records = self._iter_build(report_id, query_conditions, dataset_name, description,
+                                           include_pdfs, batch_size, lock)
+                async with contextlib.aclosing(records):
+                    async for record in records:
+                        yield record
+
+    async def build_knowledge_base_sync(self, report_id: Optional[str] = None,
+                                        query_conditions: Optional[Dict[str, Any]] = None,
+                                        dataset_name: str = "",
+                                        description: Optional[str] = "",
+                                        include_pdfs: bool = True,
+                                        batch_size: int = 50,
+                                        task_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        构建知识库并返回结果统计
+
+        配置了 Redis 时，同一知识库的构建通过分布式锁串行执行，避免重复上传；
+        传入 task_id 时记录该任务的链路追踪（见 /status/{task_id}/trace）
+        """
+        summary: Dict[str, Any] = {}
+        async for record in self.iter_build_records(report_id, query_conditions, dataset_name, description,
+                                                    include_pdfs, batch_size, task_id):
+            if record["type"] == "summary":
+                summary = record
+        summary.pop("type", None)
+        return summary
+
+    async def build_knowledge_base_async(self, report_id: Optional[str], query_conditions: Optional[Dict[str, Any]],
+                                         dataset_name: str, description: Optional[str],
+                                         include_pdfs: bool, batch_size: int,
+                                         task_id: str,
+                                         on_progress: Optional[Callable[[int, int], Awaitable[None]]] = None
+                                         ) -> Optional[Dict[str, Any]]:
+        """
+        后台任务入口：执行构建并记录日志，不向外抛出异常
+
+        Args:
+            on_progress: 每处理完一条引用资料后调用 on_progress(已处理数, 总数)
+        """
+        self.logger.info(f"知识库构建任务开始: {task_id} ({dataset_name})")
+        try:
+            result: Dict[str, Any] = {}
+            done = total = 0
+            async for record in self.iter_build_records(report_id, query_conditions, dataset_name, description,
+                                                        include_pdfs, batch_size, task_id):
+                if record["type"] == "start":
+                    total = record["total_items"]
+                elif record["type"] == "item":
+                    done += 1
+                    if on_progress is not None:
+                        await on_progress(done, total)
+                elif record["type"] == "summary":
+                    result = {k: v for k, v in record.items() if k != "type"}
+            self.logger.info(f"知识库构建任务结束: {task_id}, 结果: {result}")
+            return result
+        except Exception as e:
+            self.logger.error(f"知识库构建任务失败: {task_id}: {e}")
+            return None
@@ -0,0 +1,239 @@
+"""
+近重复文档检测（MinHash + LSH）
+
+对文档文本计算 MinHash 签名，按知识库维护 LSH 分桶索引，
+上传前判断是否与已入库文档高度相似（重印版、轻微修订版等），相似则跳过上传。
+索引条目以规范化文本的 sha256 为键（标题/文件名可能重名），
+以 JSONL 追加方式持久化到 data/minhash/{dataset_id}.jsonl。
+"""
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import heapq
+import json
+import random
+import re
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from loguru import logger
+from app.utils.utils import DATA_DIR
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class MinHasher:
+    """MinHash 签名计算"""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1,
+                 max_shingles: int = 2048):
+        """
+        Args:
+            max_shingles: 参与签名的 shingle 上限；超过时取哈希值最小的 max_shingles 个
+                （bottom-k 一致采样，相同内容总是选中相同的 shingle），签名耗时与文档长度无关
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.max_shingles = max_shingles
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randint(1, _MERSENNE_PRIME - 1), rng.randint(0, _MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+
+    def shingles(self, text: str) -> Set[int]:
+        """字符级 k-shingle（去除空白、统一小写，中英文通用）"""
+        normalized = self.normalize(text)
+        k = self.shingle_size
+        if len(normalized) <= k:
+            return {zlib.crc32(normalized.encode("utf-8"))} if normalized else set()
+        return {zlib.crc32(normalized[i:i + k].encode("utf-8")) for i in range(len(normalized) - k + 1)}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return _WHITESPACE_RE.sub("", text).lower()
+
+    def signature(self, text: str) -> List[int]:
+        """计算 MinHash 签名"""
+        hashes = self.shingles(text)
+        if not hashes:
+            return [_MAX_HASH] * self.num_perm
+        if len(hashes) > self.max_shingles:
+            hashes = heapq.nsmallest(self.max_shingles, hashes)
+        return [
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        ]
+
+    @staticmethod
+    def similarity(sig1: List[int], sig2: List[int]) -> float:
+        """由签名估计 Jaccard 相似度"""
+        if not sig1 or len(sig1) != len(sig2):
+            return 0.0
+        return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+
+class NearDuplicateIndex:
+    """单个知识库的 LSH 索引"""
+
+    def __init__(self, path: Path, num_perm: int = 128, bands: int = 32):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) 必须能被 bands ({bands}) 整除")
+        self.path = path
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.signatures: Dict[str, List[int]] = {}
+        self.names: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[int, int], Set[str]] = defaultdict(set)
+
+    def _band_keys(self, signature: List[int]) -> List[Tuple[int, int]]:
+        return [
+            (band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+
+    def _index(self, key: str, signature: List[int], name: str) -> None:
+        self.signatures[key] = signature
+        self.names[key] = name
+        for band_key in self._band_keys(signature):
+            self._buckets[band_key].add(key)
+
+    def _unindex(self, key: str) -> None:
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        self.names.pop(key, None)
+        for band_key in self._band_keys(signature):
+            self._buckets[band_key].discard(key)
+
+    def load(self) -> None:
+        """从 JSONL 文件重放索引"""
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("removed"):
+                    self._unindex(record["key"])
+                else:
+                    self._index(record["key"], record["signature"], record.get("name", record["key"]))
+
+    def _append(self, record: Dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def query(self, signature: List[int], threshold: float) -> Optional[Tuple[str, float]]:
+        """返回相似度不低于阈值的最相似文档 (key, similarity)"""
+        candidates: Set[str] = set()
+        for band_key in self._band_keys(signature):
+            candidates |= self._buckets.get(band_key, set())
+        best: Optional[Tuple[str, float]] = None
+        for key in candidates:
+            score = MinHasher.similarity(signature, self.signatures[key])
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+    def add(self, key: str, signature: List[int], name: str) -> None:
+        self._index(key, signature, name)
+        self._append({"key": key, "name": name, "signature": signature})
+
+    def remove(self, key: str) -> None:
+        if key in self.signatures:
+            self._unindex(key)
+            self._append({"key": key, "removed": True})
+
+
+class NearDuplicateDetector:
+    """近重复检测器 - 按知识库管理索引并记录跳过明细"""
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, bands: int = 32,
+                 store_dir: Optional[str] = None,
+                 executor: Optional[Executor] = None,
+                 max_skipped: int = 1000,
+                 max_shingles: int = 2048):
+        """
+        Args:
+            threshold: 判定为近重复的相似度阈值 (0~1)
+            num_perm: MinHash 排列数
+            bands: LSH 分段数（num_perm 需能被整除）
+            store_dir: 索引持久化目录
+            executor: 计算签名的进程池（签名计算是纯 Python 的 CPU 密集循环，
+                在线程中执行仍会持有 GIL 拖慢事件循环；为空时使用默认线程池）
+            max_skipped: 保留的最近跳过明细条数
+            max_shingles: 参与签名的 shingle 上限（见 MinHasher）
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.store_dir = Path(store_dir) if store_dir else DATA_DIR / "minhash"
+        self.hasher = MinHasher(num_perm=num_perm, max_shingles=max_shingles)
+        self.executor = executor
+        self._indexes: Dict[str, NearDuplicateIndex] = {}
+        self._lock = asyncio.Lock()
+        self.skipped: Deque[Dict] = deque(maxlen=max_skipped)
+        self.logger = logger
+
+    async def _get_index(self, dataset_id: str) -> NearDuplicateIndex:
+        index = self._indexes.get(dataset_id)
+        if index is None:
+            index = NearDuplicateIndex(self.store_dir / f"{dataset_id}.jsonl", self.num_perm, self.bands)
+            await asyncio.to_thread(index.load)
+            self._indexes[dataset_id] = index
+        return index
+
+    @staticmethod
+    def content_key(text: str) -> str:
+        """索引条目键：规范化文本的 sha256"""
+        return hashlib.sha256(MinHasher.normalize(text).encode("utf-8")).hexdigest()
+
+    async def check_and_reserve(self, dataset_id: str, name: str, text: str) -> Tuple[Optional[Dict], str]:
+        """
+        检查文档是否为近重复；不是则立即登记到索引（避免并发上传的相似文档同时通过）
+
+        Args:
+            name: 文档名（仅用于跳过明细）
+
+        Returns:
+            (近重复时的 {"file", "duplicate_of", "similarity"} 否则为 None, 条目键)；
+            登记成功后上传失败需以条目键调用 release
+        """
+        key = self.content_key(text)
+        loop = asyncio.get_running_loop()
+        signature = await loop.run_in_executor(self.executor, self.hasher.signature, text)
+        async with self._lock:
+            index = await self._get_index(dataset_id)
+            match = index.query(signature, self.threshold)
+            if match is not None:
+                duplicate_of = index.names.get(match[0], match[0])
+                record = {
+                    "dataset_id": dataset_id,
+                    "file": name,
+                    "duplicate_of": duplicate_of,
+                    "similarity": round(match[1], 4),
+                }
+                self.skipped.append(record)
+                self.logger.info(f"跳过近重复文档: {name} ~ {duplicate_of} (相似度 {match[1]:.2f})")
+                return record, key
+            await asyncio.to_thread(index.add, key, signature, name)
+        return None, key
+
+    async def release(self, dataset_id: str, key: str) -> None:
+        """上传失败时撤销登记（key 为 check_and_reserve 返回的条目键）"""
+        async with self._lock:
+            index = await self._get_index(dataset_id)
+            await asyncio.to_thread(index.remove, key)
+
+    def report(self, dataset_id: Optional[str] = None) -> List[Dict]:
+        """最近的跳过明细（可按知识库过滤）"""
+        if dataset_id is None:
+            return list(self.skipped)
+        return [r for r in self.skipped if r["dataset_id"] == dataset_id]
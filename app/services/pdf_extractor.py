@@ -0,0 +1,125 @@
+"""
+PDF 本地文本提取
+
+在进程池中按页段并行提取 PDF 文本，结果按文件 sha256 缓存到本地，
+配合 DifyKnowledgeBase.create_document_by_text 上传纯文本，减少上传体积并绕过 Dify 的文件解析。
+"""
+
+from __future__ import annotations
+import asyncio
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+from loguru import logger
+from app.core.tracing import span
+from app.utils.utils import DATA_DIR, file_sha256
+
+
+def _require_pypdf():
+    try:
+        from pypdf import PdfReader
+    except ImportError as e:
+        raise RuntimeError("PDF 文本提取需要安装 pypdf：pip install pypdf") from e
+    return PdfReader
+
+
+def _count_pages(file_path: str) -> int:
+    """子进程中执行：获取 PDF 页数"""
+    return len(_require_pypdf()(file_path).pages)
+
+
+def _extract_pages(file_path: str, start: int, end: int) -> List[str]:
+    """子进程中执行：提取 [start, end) 页的文本"""
+    reader = _require_pypdf()(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+class PdfTextExtractor:
+    """PDF 文本提取器 - 进程池 + 页级并行 + 结果缓存"""
+
+    def __init__(self, max_workers: Optional[int] = None, pages_per_task: int = 16,
+                 cache_dir: Optional[str] = None):
+        """
+        Args:
+            max_workers: 进程池大小（为空时使用 CPU 核数）
+            pages_per_task: 每个子任务处理的页数
+            cache_dir: 提取结果缓存目录
+        """
+        _require_pypdf()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = max(1, pages_per_task)
+        self.cache_dir = Path(cache_dir) if cache_dir else DATA_DIR / "extract_cache"
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.logger = logger
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """共享的进程池（子进程在首次提交任务时才启动），也用于其他 CPU 密集计算"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _cache_path(self, file_hash: str) -> Path:
+        return self.cache_dir / file_hash[:2] / f"{file_hash}.txt"
+
+    def _read_cache(self, file_hash: str) -> Optional[str]:
+        path = self._cache_path(file_hash)
+        if not path.exists():
+            return None
+        return path.read_text(encoding="utf-8")
+
+    def _write_cache(self, file_hash: str, text: str) -> None:
+        path = self._cache_path(file_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 同一文件可能被并发提取，每次写入使用唯一的临时文件
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent,
+                                         suffix=".tmp", delete=False) as f:
+            f.write(text)
+            tmp_path = f.name
+        try:
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def extract_text(self, file_path: str) -> str:
+        """
+        提取 PDF 全文（页间以空行分隔）
+
+        Args:
+            file_path: 本地 PDF 路径
+
+        Returns:
+            提取出的文本，扫描件等无文本层的 PDF 可能返回空字符串
+        """
+        with span("pdf.extract_text", file=os.path.basename(file_path)):
+            file_hash = await asyncio.to_thread(file_sha256, file_path)
+            cached = await asyncio.to_thread(self._read_cache, file_hash)
+            if cached is not None:
+                self.logger.debug(f"PDF提取命中缓存: {file_path}")
+                return cached
+
+            loop = asyncio.get_running_loop()
+            executor = self.get_executor()
+            page_count = await loop.run_in_executor(executor, _count_pages, file_path)
+            ranges = [
+                (start, min(start + self.pages_per_task, page_count))
+                for start in range(0, page_count, self.pages_per_task)
+            ]
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(executor, _extract_pages, file_path, start, end)
+                for start, end in ranges
+            ))
+            text = "\n\n".join(page for part in parts for page in part)
+
+            await asyncio.to_thread(self._write_cache, file_hash, text)
+            self.logger.info(f"PDF文本提取完成: {file_path}, 页数: {page_count}, 字符数: {len(text)}")
+            return text
+
+    def shutdown(self) -> None:
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
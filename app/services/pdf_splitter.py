@@ -0,0 +1,118 @@
+"""
+大 PDF 拆分
+
+超过大小或页数阈值的 PDF 按页段拆分为多个部分，便于并发上传、并行索引，
+失败时也只需重试较小的部分。按页数均分后仍超过大小上限的部分（如图片较多的页段）会继续对半拆分。
+"""
+
+from __future__ import annotations
+import asyncio
+import math
+import os
+from dataclasses import dataclass
+from typing import List, Tuple
+from loguru import logger
+from app.core.tracing import span
+
+
+def _require_pypdf():
+    try:
+        import pypdf
+    except ImportError as e:
+        raise RuntimeError("PDF 拆分需要安装 pypdf：pip install pypdf") from e
+    return pypdf
+
+
+@dataclass
+class PdfPart:
+    """拆分出的 PDF 部分"""
+    path: str
+    index: int  # 从 1 开始
+    total: int
+    start_page: int  # 从 1 开始，含
+    end_page: int  # 含
+
+
+class PdfSplitter:
+    """PDF 拆分器"""
+
+    def __init__(self, max_bytes: int = 15 * 1024 * 1024, max_pages: int = 300,
+                 output_dir: str = "downloads/pdf_parts"):
+        """
+        Args:
+            max_bytes: 单个文件的大小上限，超过则拆分
+            max_pages: 单个文件的页数上限，超过则拆分
+            output_dir: 拆分结果输出目录
+        """
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.output_dir = output_dir
+        self.logger = logger
+
+    def _plan(self, file_size: int, page_count: int) -> int:
+        """计算需要拆分的份数（1 表示无需拆分）"""
+        by_size = math.ceil(file_size / self.max_bytes) if self.max_bytes else 1
+        by_pages = math.ceil(page_count / self.max_pages) if self.max_pages else 1
+        return max(1, min(page_count, max(by_size, by_pages)))
+
+    def _write_range(self, pypdf, reader, stem: str, start: int, end: int) -> List[Tuple[int, int, str]]:
+        """写出 [start, end) 页；超过大小上限且多于一页时对半继续拆分"""
+        writer = pypdf.PdfWriter()
+        for page_no in range(start, end):
+            writer.add_page(reader.pages[page_no])
+        part_path = os.path.join(self.output_dir, f"{stem}.p{start + 1}-{end}.pdf")
+        with open(part_path, "wb") as f:
+            writer.write(f)
+        if self.max_bytes and os.path.getsize(part_path) > self.max_bytes:
+            if end - start > 1:
+                os.remove(part_path)
+                middle = (start + end) // 2
+                return (self._write_range(pypdf, reader, stem, start, middle)
+                        + self._write_range(pypdf, reader, stem, middle, end))
+            self.logger.warning(f"单页超过大小上限，无法继续拆分: {part_path}")
+        return [(start, end, part_path)]
+
+    def _split(self, file_path: str) -> List[PdfPart]:
+        pypdf = _require_pypdf()
+        reader = pypdf.PdfReader(file_path)
+        page_count = len(reader.pages)
+        total = self._plan(os.path.getsize(file_path), page_count)
+        if total <= 1:
+            return []
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        pages_per_part = math.ceil(page_count / total)
+        ranges = []
+        for start in range(0, page_count, pages_per_part):
+            ranges.extend(self._write_range(pypdf, reader, stem, start, min(start + pages_per_part, page_count)))
+
+        # 拆分完成后才确定份数，按顺序重命名为带序号的文件名
+        parts = []
+        for index, (start, end, path) in enumerate(ranges, start=1):
+            part_path = os.path.join(self.output_dir, f"{stem}.part{index:03d}-p{start + 1}-{end}.pdf")
+            os.replace(path, part_path)
+            parts.append(PdfPart(part_path, index, len(ranges), start + 1, end))
+        return parts
+
+    async def split(self, file_path: str) -> List[PdfPart]:
+        """
+        按需拆分 PDF（在线程中执行）
+
+        Returns:
+            拆分出的部分列表；文件未超过阈值时返回空列表
+        """
+        with span("pdf.split", file=os.path.basename(file_path)):
+            parts = await asyncio.to_thread(self._split, file_path)
+        if parts:
+            self.logger.info(f"PDF已拆分: {file_path} -> {len(parts)} 个部分")
+        return parts
+
+    @staticmethod
+    def cleanup(parts: List[PdfPart]) -> None:
+        """删除拆分产生的临时文件"""
+        for part in parts:
+            try:
+                os.remove(part.path)
+            except FileNotFoundError:
+                pass
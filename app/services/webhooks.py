@@ -0,0 +1,258 @@
+"""
+构建任务回调（Webhook）
+
+回调请求先写入 Redis 发件箱（有序集合按下次投递时间排序，投递内容存于哈希），
+由后台分发器异步投递：失败按指数退避重试，超过次数上限后转入死信列表。
+分发器通过 Lua 脚本租用到期的投递，多实例部署时同一投递不会被重复发送；
+进程崩溃时租约到期后自动重新投递（至少一次语义）。
+"""
+
+from __future__ import annotations
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import ipaddress
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+import httpx
+from loguru import logger
+from app.core.redis import RedisService
+
+# 租用到期的投递：把分数改为租约到期时间，返回被租用的投递 ID
+_CLAIM_SCRIPT = """
+local ids = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+for _, id in ipairs(ids) do
+    redis.call("zadd", KEYS[1], ARGV[3], id)
+end
+return ids
+"""
+
+
+def is_private_host(host: str) -> bool:
+    """主机名是否为 localhost 或内网/回环/链路本地等非公网 IP 字面量（不做 DNS 解析）"""
+    host = host.strip("[]").lower()
+    if host == "localhost" or host.endswith(".localhost"):
+        return True
+    try:
+        return not ipaddress.ip_address(host).is_global
+    except ValueError:
+        return False
+
+
+class WebhookOutbox:
+    """基于 Redis 的回调发件箱与分发器"""
+
+    def __init__(self, redis: RedisService, client: httpx.AsyncClient,
+                 secret: Optional[str] = None,
+                 max_attempts: int = 8,
+                 retry_base: float = 5.0,
+                 retry_max: float = 600.0,
+                 poll_interval: float = 1.0,
+                 lease: float = 60.0,
+                 batch_size: int = 20,
+                 allow_private_hosts: bool = False,
+                 prefix: str = "knowledge:webhook:"):
+        """
+        Args:
+            redis: Redis服务
+            client: 发送回调使用的 HTTP 客户端
+            secret: 签名密钥，配置后请求头携带 X-Webhook-Signature: sha256=<HMAC>
+            max_attempts: 最大投递次数，超过后转入死信列表
+            retry_base: 重试退避的基数（秒），第 n 次失败后等待 retry_base * 2^(n-1)
+            retry_max: 重试退避上限（秒）
+            poll_interval: 发件箱轮询间隔（秒）
+            lease: 投递租约时长（秒），应大于单次请求超时
+            batch_size: 每次轮询最多租用的投递数
+            allow_private_hosts: 是否允许回调解析到内网/回环地址（默认拒绝，防止 SSRF）
+            prefix: Redis 键前缀
+        """
+        self.redis = redis
+        self.client = client
+        self.secret = secret
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.batch_size = batch_size
+        self.allow_private_hosts = allow_private_hosts
+        self.queue_key = f"{prefix}outbox"
+        self.deliveries_key = f"{prefix}deliveries"
+        self.dead_key = f"{prefix}dead"
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._redis_down = False
+        self._fallback_tasks: Set[asyncio.Task] = set()
+        self.stats = {"enqueued": 0, "delivered": 0, "retried": 0, "dead": 0}
+        self.logger = logger
+
+    async def enqueue(self, url: str, event: str, payload: Dict[str, Any]) -> str:
+        """
+        写入一条回调（Redis 不可用时退化为进程内尽力投递一次）
+
+        Returns:
+            投递 ID
+        """
+        delivery = {
+            "id": uuid.uuid4().hex,
+            "url": url,
+            "event": event,
+            "payload": payload,
+            "attempts": 0,
+            "created_at": time.time(),
+        }
+        try:
+            client = await self.redis.get_client()
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.hset(self.deliveries_key, delivery["id"], json.dumps(delivery, ensure_ascii=False, default=str))
+                pipe.zadd(self.queue_key, {delivery["id"]: time.time()})
+                await pipe.execute()
+            self.stats["enqueued"] += 1
+        except Exception as e:
+            self.logger.warning(f"回调发件箱不可用，直接投递一次: {event} -> {url}: {e}")
+            task = asyncio.create_task(self._deliver(delivery), context=contextvars.Context())
+            # 保留引用，避免投递中的任务被垃圾回收
+            self._fallback_tasks.add(task)
+            task.add_done_callback(self._fallback_tasks.discard)
+        return delivery["id"]
+
+    def _sign(self, body: bytes) -> Optional[str]:
+        if not self.secret:
+            return None
+        return "sha256=" + hmac.new(self.secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+    async def _check_target(self, url: str) -> Optional[str]:
+        """回调地址指向或解析到非公网地址时返回拒绝原因"""
+        if self.allow_private_hosts:
+            return None
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        if is_private_host(host):
+            return f"回调地址指向内网: {host}"
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or 443)
+        except OSError:
+            # 解析失败按普通投递失败处理（发送时同样会失败并重试）
+            return None
+        for info in infos:
+            if is_private_host(info[4][0]):
+                return f"回调地址解析到内网地址: {host} -> {info[4][0]}"
+        return None
+
+    async def _deliver(self, delivery: Dict[str, Any]) -> bool:
+        """发送一次回调，2xx 视为成功；目标地址被拒绝时记录 rejected，不再重试"""
+        rejected = await self._check_target(delivery["url"])
+        if rejected:
+            self.logger.error(f"回调被拒绝: {delivery['event']} -> {delivery['url']}: {rejected}")
+            delivery["rejected"] = rejected
+            return False
+        body = json.dumps(
+            {"event": delivery["event"], "delivery_id": delivery["id"], **delivery["payload"]},
+            ensure_ascii=False, default=str
+        ).encode("utf-8")
+        headers = {
+            "Content-Type": "application/json",
+            "X-Webhook-Event": delivery["event"],
+            "X-Webhook-Delivery": delivery["id"],
+        }
+        signature = self._sign(body)
+        if signature:
+            headers["X-Webhook-Signature"] = signature
+        try:
+            response = await self.client.post(delivery["url"], content=body, headers=headers)
+        except httpx.HTTPError as e:
+            self.logger.warning(f"回调投递失败: {delivery['event']} -> {delivery['url']}: {e}")
+            return False
+        if 200 <= response.status_code < 300:
+            return True
+        self.logger.warning(f"回调投递失败: {delivery['event']} -> {delivery['url']}: HTTP {response.status_code}")
+        return False
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+
+    async def _process(self, delivery_id: str) -> None:
+        client = await self.redis.get_client()
+        raw = await client.hget(self.deliveries_key, delivery_id)
+        if raw is None:
+            await client.zrem(self.queue_key, delivery_id)
+            return
+        delivery = json.loads(raw)
+        delivered = await self._deliver(delivery)
+        delivery["attempts"] += 1
+
+        if delivered:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.zrem(self.queue_key, delivery_id)
+                pipe.hdel(self.deliveries_key, delivery_id)
+                await pipe.execute()
+            self.stats["delivered"] += 1
+        elif delivery.get("rejected") or delivery["attempts"] >= self.max_attempts:
+            if not delivery.get("rejected"):
+                self.logger.error(f"回调重试次数已达上限，转入死信: {delivery['event']} -> {delivery['url']}")
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.zrem(self.queue_key, delivery_id)
+                pipe.hdel(self.deliveries_key, delivery_id)
+                pipe.lpush(self.dead_key, json.dumps(delivery, ensure_ascii=False, default=str))
+                pipe.ltrim(self.dead_key, 0, 999)
+                await pipe.execute()
+            self.stats["dead"] += 1
+        else:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.hset(self.deliveries_key, delivery_id, json.dumps(delivery, ensure_ascii=False, default=str))
+                pipe.zadd(self.queue_key, {delivery_id: time.time() + self._backoff(delivery["attempts"])})
+                await pipe.execute()
+            self.stats["retried"] += 1
+
+    async def dispatch_once(self) -> int:
+        """租用并投递一批到期的回调，返回处理数量"""
+        client = await self.redis.get_client()
+        now = time.time()
+        ids: List[str] = await client.eval(
+            _CLAIM_SCRIPT, 1, self.queue_key, now, self.batch_size, now + self.lease
+        )
+        if ids:
+            await asyncio.gather(*(self._process(delivery_id) for delivery_id in ids), return_exceptions=True)
+        return len(ids)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                handled = await self.dispatch_once()
+                if self._redis_down:
+                    self.logger.info("回调发件箱已恢复")
+                    self._redis_down = False
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                handled = 0
+                if not self._redis_down:
+                    self.logger.warning(f"回调发件箱轮询失败: {e}")
+                    self._redis_down = True
+            # 本批处理满时立即继续，否则等待下次轮询
+            if handled < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        """启动后台分发器（在 lifespan 中调用）"""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._run())
+            self.logger.info("回调分发器已启动")
+
+    async def stop(self) -> None:
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        self._dispatcher = None
+
+    async def pending(self) -> int:
+        """发件箱中待投递（含重试中）的数量"""
+        client = await self.redis.get_client()
+        return await client.zcard(self.queue_key)
@@ -1,11 +1,12 @@
 import os
 import json
+import hashlib
+import tempfile
+import threading
 from pathlib import Path
 
 # 项目根目录
 ROOT_DIR = Path(__file__).resolve().parent.parent.parent
-
-print(ROOT_DIR) 
 DATA_DIR = ROOT_DIR / "data"
 DOC_ID_STORE_FILE = DATA_DIR / "doc_id_store.json"
 
@@ -35,3 +36,70 @@ def save_doc_id(file_name: str, doc_id: str):
 def get_doc_id(file_name: str) -> str | None:
     data = load_doc_ids()
     return data.get(file_name)
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件的 sha256 摘要"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+CONTENT_HASH_STORE_FILE = DATA_DIR / "content_hash_store.json"
+
+
+def load_content_hashes() -> dict:
+    if not CONTENT_HASH_STORE_FILE.exists():
+        return {}
+    with open(CONTENT_HASH_STORE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+_content_hash_lock = threading.Lock()
+
+
+def claim_content_hash(dataset_id: str, digest: str, doc_id: str) -> str:
+    """
+    登记知识库中内容 sha256 对应的文档 ID（本地文件存储，仅进程内互斥，阻塞调用）
+
+    Returns:
+        已有登记时返回已有的文档 ID，否则登记并返回 doc_id
+    """
+    with _content_hash_lock:
+        data = load_content_hashes()
+        existing = data.get(dataset_id, {}).get(digest)
+        if existing:
+            return existing
+        data.setdefault(dataset_id, {})[digest] = doc_id
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=DATA_DIR,
+                                         suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            try:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            except BaseException:
+                f.close()
+                os.unlink(tmp_path)
+                raise
+        os.replace(tmp_path, CONTENT_HASH_STORE_FILE)
+        return doc_id
+
+
+class HashTee:
+    """透传异步字节流的同时计算 sha256 与总字节数"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    async def __aiter__(self):
+        async for chunk in self._chunks:
+            self._digest.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
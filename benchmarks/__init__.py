@@ -0,0 +1,4 @@
+"""
+Micro-benchmarks
+纯 Python 热点路径的性能基准测试
+"""
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.routes import KnowledgeBuildRequest, _reserve_build
+from app.services.build_admission import BuildAdmissionController, BuildQueueFullError
+
+
+def test_queued_builds_start_in_priority_order():
+    order = []
+
+    async def run(ticket, name):
+        async with ticket:
+            order.append(name)
+
+    async def main():
+        controller = BuildAdmissionController(max_concurrent=1, max_pending=10)
+        running = controller.reserve("normal")
+        assert running.admitted
+        tasks = [
+            asyncio.create_task(run(controller.reserve(priority), f"{priority}-{i}"))
+            for i, priority in enumerate(["low", "normal", "high", "low", "high"])
+        ]
+        await asyncio.sleep(0)
+        assert order == []
+        async with running:
+            pass
+        await asyncio.gather(*tasks)
+        return controller
+
+    controller = asyncio.run(main())
+    assert order == ["high-2", "high-4", "normal-1", "low-0", "low-3"]
+    assert controller.snapshot()["running"] == 0 and controller.snapshot()["pending"] == 0
+
+
+def test_queue_overflow_returns_429_with_retry_after():
+    async def main():
+        controller = BuildAdmissionController(max_concurrent=1, max_pending=1, default_build_seconds=30)
+        controller.reserve()
+        controller.reserve()
+        with pytest.raises(BuildQueueFullError) as excinfo:
+            controller.reserve()
+        assert excinfo.value.retry_after == 60
+        with pytest.raises(HTTPException) as excinfo:
+            _reserve_build(controller, KnowledgeBuildRequest(dataset_name="d"))
+        return controller, excinfo.value
+
+    controller, error = asyncio.run(main())
+    assert error.status_code == 429
+    assert error.headers == {"Retry-After": "60"}
+    assert controller.rejected == 2
+
+
+def test_cancelled_waiter_and_running_build_release_their_slots():
+    async def hold(ticket, started, release):
+        async with ticket:
+            started.set()
+            await release.wait()
+
+    async def main():
+        controller = BuildAdmissionController(max_concurrent=1, max_pending=2)
+        started, release = asyncio.Event(), asyncio.Event()
+        running = asyncio.create_task(hold(controller.reserve(), started, release))
+        await started.wait()
+
+        # 排队中被取消：撤销排队
+        queued = asyncio.create_task(hold(controller.reserve(), asyncio.Event(), release))
+        await asyncio.sleep(0)
+        assert controller.snapshot()["pending"] == 1
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert controller.snapshot()["pending"] == 0
+
+        # 运行中被取消：名额交给下一个排队的构建
+        next_started = asyncio.Event()
+        waiting = asyncio.create_task(hold(controller.reserve(), next_started, release))
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        await next_started.wait()
+        release.set()
+        await waiting
+        return controller.snapshot()
+
+    snapshot = asyncio.run(main())
+    assert snapshot["running"] == 0 and snapshot["pending"] == 0
+
+
+def test_failed_build_releases_slot():
+    async def main():
+        controller = BuildAdmissionController(max_concurrent=1, max_pending=0)
+        with pytest.raises(RuntimeError):
+            async with controller.reserve():
+                raise RuntimeError("boom")
+        # 名额已归还，可以立即获得
+        assert controller.reserve().admitted
+
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+import asyncio
+
+from app.api.routes import KnowledgeBuildRequest, _run_build_task
+from app.services.build_admission import BuildAdmissionController
+
+
+class FakeRegistry:
+    def __init__(self):
+        self.completed = []
+        self.forgotten = []
+
+    async def complete(self, key):
+        self.completed.append(key)
+
+    async def forget(self, key):
+        self.forgotten.append(key)
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.enqueued = []
+
+    async def enqueue(self, url, event, payload):
+        self.enqueued.append((url, event, payload))
+
+
+class FakeBuilder:
+    def __init__(self, result=None, error=None, started=None, release=None):
+        self.result = result if result is not None else {"success": True}
+        self.error = error
+        self.started = started
+        self.release = release
+
+    async def build_knowledge_base_async(self, *args, **kwargs):
+        if self.started is not None:
+            self.started.set()
+        if self.release is not None:
+            await self.release.wait()
+        if self.error is not None:
+            return None
+        return self.result
+
+
+def _run(builder, request, idempotency_key="key", admission=None):
+    registry, outbox = FakeRegistry(), FakeOutbox()
+
+    async def main():
+        controller = admission or BuildAdmissionController()
+        ticket = controller.reserve(request.priority)
+        await _run_build_task(builder, registry, outbox, ticket, idempotency_key, request, "task-1")
+        return controller
+
+    controller = asyncio.run(main())
+    return registry, outbox, controller
+
+
+def test_fingerprint_key_is_dropped_after_success():
+    registry, _, _ = _run(FakeBuilder(), KnowledgeBuildRequest(dataset_name="d"), idempotency_key="fp")
+    assert registry.completed == [] and registry.forgotten == ["fp"]
+
+
+def test_explicit_key_is_kept_after_success():
+    request = KnowledgeBuildRequest(dataset_name="d", idempotency_key="client-key")
+    registry, _, _ = _run(FakeBuilder(), request, idempotency_key="client-key")
+    assert registry.completed == ["client-key"] and registry.forgotten == []
+
+
+class RaisingBuilder:
+    async def build_knowledge_base_async(self, *args, **kwargs):
+        raise RuntimeError("boom")
+
+
+def test_build_task_failure_releases_slot_and_forgets_key():
+    registry, outbox = FakeRegistry(), FakeOutbox()
+    request = KnowledgeBuildRequest(dataset_name="d")
+
+    async def main():
+        controller = BuildAdmissionController(max_concurrent=1, max_pending=0)
+        ticket = controller.reserve(request.priority)
+        await _run_build_task(RaisingBuilder(), registry, outbox, ticket, "fp", request, "task-1")
+        return controller.snapshot()
+
+    snapshot = asyncio.run(main())
+    assert snapshot["running"] == 0
+    assert registry.forgotten == ["fp"]
@@ -0,0 +1,120 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.dify.concurrency import AdaptiveConcurrencyLimiter
+from app.dify.dify_client import DifyHttpClient, DifyHttpClientError, DifyTimeoutError
+
+
+async def _request(limiter, delay=0.0, overloaded=False, skip=False):
+    async with limiter.slot() as slot:
+        await asyncio.sleep(delay)
+        if overloaded:
+            slot.mark_overloaded()
+        if skip:
+            slot.skip_sample()
+
+
+def test_limit_grows_additively_only_when_saturated():
+    async def main():
+        limiter = AdaptiveConcurrencyLimiter(initial=1, max_limit=3, latency_tolerance=10)
+        await _request(limiter, 0.01)
+        assert limiter.limit == 2
+        # 名额未用满时不增长
+        await _request(limiter, 0.01)
+        assert limiter.limit == 2
+        # 用满时每个请求增长 1/limit，约一轮（limit 个请求）后加一
+        for _ in range(3):
+            await asyncio.gather(_request(limiter, 0.01), _request(limiter, 0.01))
+        assert limiter.limit == 3
+        for _ in range(5):
+            await asyncio.gather(*(_request(limiter, 0.01) for _ in range(3)))
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.limit == 3  # 不超过 max_limit
+    assert limiter.in_flight == 0
+
+
+def test_overload_halves_limit_once_per_burst():
+    async def main():
+        limiter = AdaptiveConcurrencyLimiter(initial=16, min_limit=2)
+        await asyncio.gather(*(_request(limiter, overloaded=True) for _ in range(8)))
+        assert limiter.limit == 8
+        limiter._last_decrease = 0.0
+        for _ in range(3):
+            await _request(limiter, overloaded=True)
+            limiter._last_decrease = 0.0
+        return limiter
+
+    assert asyncio.run(main()).limit == 2  # 不低于 min_limit
+
+
+def test_latency_spike_decreases_and_unrelated_errors_are_ignored():
+    async def main():
+        limiter = AdaptiveConcurrencyLimiter(initial=8, latency_tolerance=2.0)
+        await _request(limiter, 0.01)
+        await _request(limiter, 0.2, skip=True)
+        assert limiter.limit == 8
+        await _request(limiter, 0.2)
+        return limiter
+
+    assert asyncio.run(main()).limit == 4
+
+
+def test_requests_wait_for_a_free_slot_and_cancellation_releases_it():
+    async def main():
+        limiter = AdaptiveConcurrencyLimiter(initial=1, max_limit=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(_request(limiter))
+        await asyncio.sleep(0.01)
+        assert not waiter.done() and limiter.in_flight == 1
+        holder.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await holder
+        await asyncio.wait_for(waiter, 1)
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.in_flight == 0 and limiter.limit == 1
+
+
+def _upload(handler, limiter):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = DifyHttpClient("http://dify.test/v1", "k1", client=http, max_retries=0,
+                                    upload_limiter=limiter)
+            with pytest.raises(Exception) as excinfo:
+                await client.post("/datasets/ds-1/document/create-by-file", content=b"data",
+                                  content_type="application/octet-stream")
+            return excinfo.value
+
+    return asyncio.run(main())
+
+
+def test_client_upload_timeout_and_rate_limit_shrink_limit():
+    def timeout(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    limiter = AdaptiveConcurrencyLimiter(initial=8)
+    assert isinstance(_upload(timeout, limiter), DifyTimeoutError)
+    assert limiter.limit == 4
+
+    limiter = AdaptiveConcurrencyLimiter(initial=8)
+    _upload(lambda request: httpx.Response(429, json={"message": "slow down"}), limiter)
+    assert limiter.limit == 4
+
+
+def test_client_upload_validation_error_keeps_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial=8)
+    error = _upload(lambda request: httpx.Response(400, json={"message": "bad"}), limiter)
+    assert type(error) is DifyHttpClientError
+    assert limiter.limit == 8
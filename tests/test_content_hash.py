@@ -0,0 +1,56 @@
+import asyncio
+
+from app.services.dify_kb_service import DifyKnowledgeBaseService
+from app.utils import utils
+
+
+class FakeRedisClient:
+    def __init__(self):
+        self.hashes = {}
+
+    async def hsetnx(self, key, field, value):
+        bucket = self.hashes.setdefault(key, {})
+        if field in bucket:
+            return False
+        bucket[field] = value
+        return True
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.client = FakeRedisClient()
+
+    async def get_client(self):
+        return self.client
+
+
+class UnavailableRedis:
+    async def get_client(self):
+        raise ConnectionError("redis down")
+
+
+def _claim_all(service, doc_ids):
+    async def main():
+        return await asyncio.gather(*(
+            service._claim_content_hash("ds-1", "digest", doc_id) for doc_id in doc_ids
+        ))
+    return asyncio.run(main())
+
+
+def test_content_hash_claimed_once_in_redis():
+    service = DifyKnowledgeBaseService(dify=None, redis=FakeRedis())
+    results = _claim_all(service, ["doc-a", "doc-b", "doc-c"])
+    assert results == ["doc-a", "doc-a", "doc-a"]
+
+
+def test_content_hash_falls_back_to_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(utils, "CONTENT_HASH_STORE_FILE", tmp_path / "content_hash_store.json")
+    service = DifyKnowledgeBaseService(dify=None, redis=UnavailableRedis())
+    results = _claim_all(service, [f"doc-{i}" for i in range(20)])
+    assert len(set(results)) == 1
+    assert utils.load_content_hashes() == {"ds-1": {"digest": results[0]}}
+    assert list(tmp_path.glob("*.tmp")) == []
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import httpx
+
+from app.dify.dify_client import DifyAuthenticationError, DifyHttpClient
+from app.dify.key_pool import DifyApiKeyPool
+
+
+def test_rate_limited_key_fails_over_to_idle_key():
+    seen_keys = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        key = request.headers["Authorization"].removeprefix("Bearer ")
+        seen_keys.append(key)
+        if key == "k1":
+            return httpx.Response(429, headers={"Retry-After": "60"}, json={"message": "rate limited"})
+        return httpx.Response(200, json={"data": []})
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = DifyHttpClient("http://dify.test/v1", DifyApiKeyPool(["k1", "k2"]), client=http)
+            started = time.monotonic()
+            result = await client.get("/datasets")
+            return result, time.monotonic() - started, client.key_pool.snapshot()
+
+    result, elapsed, snapshot = asyncio.run(main())
+    assert result == {"data": []}
+    assert seen_keys == ["k1", "k2"]
+    assert elapsed < 5
+    assert [s["available"] for s in snapshot] == [False, True]
+
+
+def _run_client(handler, keys):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = DifyHttpClient("http://dify.test/v1", DifyApiKeyPool(keys), client=http)
+            results = []
+            for _ in range(2):
+                try:
+                    results.append(await client.get("/datasets"))
+                except Exception as e:
+                    results.append(e)
+            return results, client.key_pool.snapshot()
+
+    return asyncio.run(main())
+
+
+def test_forbidden_does_not_disable_key():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(403, json={"message": "no permission"})
+
+    results, snapshot = _run_client(handler, ["k1"])
+    assert all(isinstance(r, DifyAuthenticationError) for r in results)
+    assert len(calls) == 2
+    assert snapshot[0]["available"] is True
+
+
+def test_all_keys_unauthorized_fails_fast():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(401, json={"message": "invalid key"})
+
+    started = time.monotonic()
+    results, snapshot = _run_client(handler, ["k1"])
+    assert all(isinstance(r, DifyAuthenticationError) for r in results)
+    assert len(calls) == 1  # 第二次请求在 acquire 阶段直接失败
+    assert time.monotonic() - started < 5
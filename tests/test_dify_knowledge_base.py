@@ -0,0 +1,41 @@
+import asyncio
+
+from app.dify.dify_cache import DifyResponseCache
+from app.dify.dify_knowledge_base import DifyKnowledgeBase
+
+
+class FakeClient:
+    def __init__(self):
+        self.document_count = 0
+
+    async def get(self, endpoint, params=None):
+        if endpoint == "v1/datasets":
+            return {"data": [{"id": "ds-1", "document_count": self.document_count}], "has_more": False}
+        return {"id": "ds-1", "document_count": self.document_count}
+
+    async def post(self, endpoint, **kwargs):
+        self.document_count += 1
+        return {"document": {"id": f"doc-{self.document_count}"}}
+
+    async def delete(self, endpoint):
+        self.document_count -= 1
+        return {"result": "success"}
+
+
+def test_document_writes_invalidate_dataset_caches():
+    client = FakeClient()
+    kb = DifyKnowledgeBase(client, cache=DifyResponseCache())
+
+    async def counts():
+        dataset = await kb.get_dataset("ds-1")
+        listing = await kb.list_datasets()
+        return dataset["document_count"], listing["data"][0]["document_count"]
+
+    async def main():
+        assert await counts() == (0, 0)
+        await kb.create_document_by_text("ds-1", name="a", text="hello")
+        assert await counts() == (1, 1)
+        await kb.delete_document("ds-1", "doc-1")
+        assert await counts() == (0, 0)
+
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.external_api_client import DownloadRejectedError, ExternalAPIClient
+from app.services.file_cache import LocalFileCache
+
+PDF = b"%PDF-1.4\n" + b"0" * 4096
+URL = "https://files.example.com/report.pdf"
+
+
+async def _chunks(data, size=512):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def _responses():
+    """各类应被拒绝的响应"""
+    return {
+        "no_magic": lambda: httpx.Response(200, content=b"\x00" * 4096,
+                                           headers={"Content-Type": "application/octet-stream"}),
+        "magic_after_window": lambda: httpx.Response(200, content=b" " * 2048 + PDF),
+        "html": lambda: httpx.Response(200, content=PDF, headers={"Content-Type": "text/html; charset=utf-8"}),
+        "json": lambda: httpx.Response(200, content=PDF, headers={"Content-Type": "application/json"}),
+        "content_length_too_large": lambda: httpx.Response(200, content=PDF + b"0" * 8192),
+        "stream_too_large": lambda: httpx.Response(200, content=_chunks(PDF + b"0" * 8192)),
+    }
+
+
+def _client(response_factory, **kwargs):
+    transport = httpx.MockTransport(lambda request: response_factory())
+    return ExternalAPIClient(client=httpx.AsyncClient(transport=transport), **kwargs)
+
+
+@pytest.mark.parametrize("case", list(_responses()))
+def test_rejected_download_leaves_no_partial_file(tmp_path, case):
+    client = _client(_responses()[case], max_download_bytes=8192)
+    cache = LocalFileCache(str(tmp_path / "cache"))
+
+    async def main():
+        async with cache.use("1.pdf", lambda path: client.download_pdf(URL, path)) as path:
+            assert path is None
+        return await cache.lookup("1.pdf")
+
+    assert asyncio.run(main()) is None
+    assert [p for p in (tmp_path / "cache").rglob("*") if p.is_file() and p.name != "index.json"] == []
+
+
+@pytest.mark.parametrize("case", list(_responses()))
+def test_rejected_stream_raises(case):
+    client = _client(_responses()[case], max_download_bytes=8192)
+
+    async def main():
+        async with client.open_pdf_stream(URL) as chunks:
+            async for _ in chunks:
+                pass
+
+    with pytest.raises(DownloadRejectedError):
+        asyncio.run(main())
+
+
+def test_valid_pdf_is_downloaded(tmp_path):
+    client = _client(lambda: httpx.Response(200, content=_chunks(PDF, 100),
+                                            headers={"Content-Type": "application/pdf"}))
+    cache = LocalFileCache(str(tmp_path / "cache"))
+
+    async def main():
+        async with cache.use("1.pdf", lambda path: client.download_pdf(URL, path)) as path:
+            with open(path, "rb") as f:
+                return f.read()
+
+    assert asyncio.run(main()) == PDF
+    assert list((tmp_path / "cache").rglob("*.part")) == []
@@ -0,0 +1,29 @@
+import asyncio
+import json
+import os
+
+from app.services.file_cache import LocalFileCache
+
+
+def test_concurrent_downloads_commit_and_flush_index(tmp_path):
+    cache = LocalFileCache(str(tmp_path), max_bytes=0)
+
+    async def loader(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        await asyncio.sleep(0)
+        with open(path, "wb") as f:
+            f.write(b"%PDF-1.4\n")
+        return True
+
+    async def fetch(i):
+        async with cache.use(f"{i}.pdf", loader) as path:
+            return path
+
+    async def main():
+        return await asyncio.gather(*(fetch(i) for i in range(50)))
+
+    paths = asyncio.run(main())
+    assert all(paths)
+    index = json.loads((tmp_path / "index.json").read_text(encoding="utf-8"))
+    assert set(index) == {f"{i}.pdf" for i in range(50)}
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from app.dify.hedging import HedgePolicy
+
+
+def _primed(**kwargs):
+    """已积累足够延迟样本的策略（对冲等待时间为 min_delay）"""
+    policy = HedgePolicy(min_samples=10, min_delay=0.02, **kwargs)
+    for _ in range(10):
+        policy.record(0.001)
+    assert policy.hedge_delay == 0.02
+    return policy
+
+
+class SlowThenFast:
+    """第一次调用（主请求）阻塞直到被取消，之后的调用（对冲请求）立即返回"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        if call % 2 == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        return call
+
+
+def test_no_hedge_without_enough_samples():
+    policy = HedgePolicy(min_samples=10)
+    fn = SlowThenFast()
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(policy.run(fn), 0.1)
+
+    asyncio.run(main())
+    assert fn.calls == 1 and policy.stats["hedged"] == 0
+
+
+def test_hedge_wins_and_cancels_losing_request():
+    policy = _primed(budget_ratio=1.0)
+    fn = SlowThenFast()
+
+    async def main():
+        result = await asyncio.wait_for(policy.run(fn), 1)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 2
+    assert fn.calls == 2 and fn.cancelled == 1
+    assert policy.stats == {"requests": 1, "hedged": 1, "hedge_wins": 1}
+
+
+def test_hedges_are_limited_by_budget():
+    policy = _primed(budget_ratio=0.25)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def main():
+        for _ in range(8):
+            assert await policy.run(slow) == "ok"
+
+    asyncio.run(main())
+    # 每个请求积累 0.25 个令牌，8 个请求最多对冲 2 次
+    assert policy.stats["requests"] == 8
+    assert policy.stats["hedged"] == 2
+
+
+def test_fast_primary_is_not_hedged():
+    policy = _primed(budget_ratio=1.0)
+    calls = []
+
+    async def fast():
+        calls.append(1)
+        return "ok"
+
+    async def main():
+        for _ in range(5):
+            await policy.run(fast)
+
+    asyncio.run(main())
+    assert len(calls) == 5 and policy.stats["hedged"] == 0
+
+
+def test_caller_cancellation_cancels_both_requests():
+    policy = _primed(budget_ratio=1.0)
+    cancelled = []
+
+    async def hang():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        task = asyncio.create_task(policy.run(hang))
+        await asyncio.sleep(0.05)
+        assert policy.stats["hedged"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert len(cancelled) == 2
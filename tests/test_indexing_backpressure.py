@@ -0,0 +1,70 @@
+import asyncio
+
+from app.services.indexing_backpressure import IndexingBackpressure
+
+
+class FakeDify:
+    def __init__(self):
+        self.statuses = {}
+
+    async def get_indexing_status(self, dataset_id, batch):
+        return {"data": [{"indexing_status": self.statuses[batch]}]}
+
+
+def test_uploads_pause_at_high_water_and_resume_below_low_water():
+    dify = FakeDify()
+    backpressure = IndexingBackpressure(dify, high_water=3, low_water=2, poll_interval=0.01)
+
+    async def upload(batch):
+        async with backpressure.admit("ds-1"):
+            dify.statuses[batch] = "indexing"
+            backpressure.track("ds-1", batch)
+
+    async def main():
+        for i in range(3):
+            await upload(f"b{i}")
+        assert backpressure.depth("ds-1") == 3
+
+        blocked = asyncio.create_task(upload("b3"))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+
+        # 回落到 2 仍未低于低水位，继续暂停
+        dify.statuses["b0"] = "completed"
+        await asyncio.sleep(0.05)
+        assert backpressure.depth("ds-1") == 2 and not blocked.done()
+
+        dify.statuses["b1"] = "error"
+        await asyncio.wait_for(blocked, 1)
+        assert backpressure.depth("ds-1") == 2
+
+        for batch in ("b2", "b3"):
+            dify.statuses[batch] = "completed"
+        for _ in range(100):
+            if "ds-1" not in backpressure._states:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    # 全部批次结束、没有在途上传后状态被移除
+    assert backpressure._states == {}
+    assert backpressure.depth("ds-1") == 0
+
+
+def test_state_is_dropped_after_untracked_upload_and_cancelled_wait():
+    backpressure = IndexingBackpressure(FakeDify(), high_water=1, low_water=0, poll_interval=0.01)
+
+    async def main():
+        async with backpressure.admit("ds-1"):
+            pass
+        assert backpressure._states == {}
+
+        async with backpressure.admit("ds-2"):
+            waiter = asyncio.create_task(backpressure.admit("ds-2").__aenter__())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert backpressure._states["ds-2"].waiting == 0
+
+    asyncio.run(main())
+    assert backpressure._states == {}
@@ -0,0 +1,161 @@
+import asyncio
+import contextlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.file_cache import LocalFileCache
+from app.services.knowledge_builder import KnowledgeBuilder
+
+
+class FakeDatabase:
+    def __init__(self, items):
+        self.items = items
+
+    def query_data(self, sql, params=None):
+        return self.items
+
+
+class FakeKbService:
+    def __init__(self):
+        self.calls = []
+
+    async def get_dataset_id_by_name(self, name):
+        return "ds-1"
+
+    async def create_document_by_pdf_text_save_doc_id(self, dataset_id, file_path):
+        self.calls.append(("pdf_text", file_path))
+        return {"document": {"id": "doc-text"}}
+
+    async def create_large_document_by_file(self, dataset_id, file_path):
+        self.calls.append(("file", file_path))
+        return {"document": {"id": "doc-file"}}
+
+    async def create_document_by_text_save_doc_id(self, dataset_id, name, text):
+        self.calls.append(("text", name))
+        return {"document": {"id": f"doc-{name}"}}
+
+
+def _build(tmp_path, pdf_local_extract):
+    pdf_path = tmp_path / "report.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4\n")
+    kb_service = FakeKbService()
+    builder = KnowledgeBuilder(
+        dify=None,
+        external_api_client=None,
+        database_service=FakeDatabase([{"id": 1, "title": "report", "file_path": str(pdf_path)}]),
+        kb_service=kb_service,
+        file_cache=LocalFileCache(str(tmp_path / "cache")),
+        pdf_local_extract=pdf_local_extract,
+    )
+    result = asyncio.run(builder.build_knowledge_base_sync(dataset_name="test"))
+    return result, kb_service.calls, str(pdf_path)
+
+
+def test_local_pdf_uploaded_as_extracted_text(tmp_path):
+    result, calls, pdf_path = _build(tmp_path, pdf_local_extract=True)
+    assert calls == [("pdf_text", pdf_path)]
+    assert result["processed_items"] == 1 and result["failed_items"] == 0
+
+
+def test_local_pdf_uploaded_as_file_when_extract_disabled(tmp_path):
+    result, calls, pdf_path = _build(tmp_path, pdf_local_extract=False)
+    assert calls == [("file", pdf_path)]
+    assert result["processed_items"] == 1
+
+
+def test_build_aborts_when_lock_is_lost(tmp_path):
+    kb_service = FakeKbService()
+    lock = SimpleNamespace(lost=False)
+    items = [{"id": i, "title": f"t{i}", "content": "text"} for i in range(3)]
+    builder = KnowledgeBuilder(
+        dify=None,
+        external_api_client=None,
+        database_service=FakeDatabase(items),
+        kb_service=kb_service,
+        file_cache=LocalFileCache(str(tmp_path / "cache")),
+    )
+
+    @contextlib.asynccontextmanager
+    async def fake_lock(dataset_name):
+        yield lock
+
+    builder._build_lock = fake_lock
+
+    async def main():
+        async for record in builder.iter_build_records(dataset_name="test", batch_size=1):
+            if record["type"] == "item":
+                lock.lost = True
+
+    with pytest.raises(RuntimeError, match="构建锁已丢失"):
+        asyncio.run(main())
+    assert kb_service.calls == [("text", "t0")]
+
+
+class UnavailableRedis:
+    async def get_client(self):
+        raise ConnectionError("redis down")
+
+
+def test_build_falls_back_to_local_lock_when_redis_is_down(tmp_path):
+    kb_service = FakeKbService()
+    builder = KnowledgeBuilder(
+        dify=None,
+        external_api_client=None,
+        database_service=FakeDatabase([{"id": 1, "title": "t1", "content": "text"}]),
+        kb_service=kb_service,
+        redis=UnavailableRedis(),
+        file_cache=LocalFileCache(str(tmp_path / "cache")),
+    )
+    result = asyncio.run(builder.build_knowledge_base_sync(dataset_name="test"))
+    assert result["processed_items"] == 1
+    assert kb_service.calls == [("text", "t1")]
+    assert builder._local_locks == {}
+
+
+class FakeExternalClient:
+    def __init__(self, preflight):
+        self.preflight = preflight
+        self.downloads = []
+
+    async def preflight_urls(self, urls):
+        return {url: self.preflight[url] for url in urls}
+
+    async def download_pdf(self, url, save_path):
+        self.downloads.append(url)
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        with open(save_path, "wb") as f:
+            f.write(b"%PDF-1.4\n")
+        return True
+
+
+def _preflight_info(url, status_code, error=None):
+    return {"url": url, "accessible": False, "status_code": status_code, "error": error}
+
+
+def test_only_missing_links_short_circuit_preflight(tmp_path):
+    urls = {
+        "missing": "https://example.com/missing.pdf",
+        "gone": "https://example.com/gone.pdf",
+        "flaky": "https://example.com/flaky.pdf",
+        "timeout": "https://example.com/timeout.pdf",
+    }
+    external = FakeExternalClient({
+        urls["missing"]: _preflight_info(urls["missing"], 404),
+        urls["gone"]: _preflight_info(urls["gone"], 410),
+        urls["flaky"]: _preflight_info(urls["flaky"], 503),
+        urls["timeout"]: _preflight_info(urls["timeout"], None, "ReadTimeout"),
+    })
+    kb_service = FakeKbService()
+    items = [{"id": name, "title": name, "file_path": url} for name, url in urls.items()]
+    builder = KnowledgeBuilder(
+        dify=None,
+        external_api_client=external,
+        database_service=FakeDatabase(items),
+        kb_service=kb_service,
+        file_cache=LocalFileCache(str(tmp_path / "cache")),
+    )
+    result = asyncio.run(builder.build_knowledge_base_sync(dataset_name="test", include_pdfs=True))
+    assert sorted(external.downloads) == sorted([urls["flaky"], urls["timeout"]])
+    assert result["processed_items"] == 2 and result["failed_items"] == 2
@@ -0,0 +1,48 @@
+import asyncio
+import random
+import time
+
+from app.services.near_duplicate import MinHasher, NearDuplicateDetector
+
+
+def _text(seed, length=20000):
+    rng = random.Random(seed)
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(length))
+
+
+def test_same_title_different_content_is_not_a_duplicate(tmp_path):
+    detector = NearDuplicateDetector(store_dir=str(tmp_path))
+
+    async def main():
+        first, first_key = await detector.check_and_reserve("ds-1", "report.pdf", _text(1))
+        second, second_key = await detector.check_and_reserve("ds-1", "report.pdf", _text(2))
+        assert first is None and second is None
+        assert first_key != second_key
+        # 撤销其中一条不影响另一条
+        await detector.release("ds-1", second_key)
+        duplicate, _ = await detector.check_and_reserve("ds-1", "copy.pdf", _text(1))
+        return duplicate
+
+    duplicate = asyncio.run(main())
+    assert duplicate["file"] == "copy.pdf"
+    assert duplicate["duplicate_of"] == "report.pdf"
+
+
+def test_index_survives_reload(tmp_path):
+    async def reserve(name, text):
+        detector = NearDuplicateDetector(store_dir=str(tmp_path))
+        return await detector.check_and_reserve("ds-1", name, text)
+
+    assert asyncio.run(reserve("a.pdf", _text(1)))[0] is None
+    duplicate, _ = asyncio.run(reserve("b.pdf", _text(1) + "tail"))
+    assert duplicate["duplicate_of"] == "a.pdf"
+
+
+def test_signature_cost_is_bounded_by_max_shingles():
+    hasher = MinHasher(max_shingles=512)
+    long_text = _text(3, length=200000)
+    start = time.perf_counter()
+    signature = hasher.signature(long_text)
+    assert time.perf_counter() - start < 2.0
+    assert len(signature) == hasher.num_perm
+    assert MinHasher.similarity(signature, hasher.signature(long_text)) == 1.0
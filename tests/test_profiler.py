@@ -0,0 +1,21 @@
+import sys
+
+from app.core.profiler import _collapse
+
+
+def _leaf():
+    return sys._getframe()
+
+
+def _caller(first):
+    # 同一函数内两个不同行的调用
+    if first:
+        return _leaf()
+    return _leaf()
+
+
+def test_stack_labels_are_module_and_function_without_line_numbers():
+    first = _collapse(_caller(True))
+    second = _collapse(_caller(False))
+    assert first == second
+    assert first[-2:] == [f"{__name__}:_caller", f"{__name__}:_leaf"]
@@ -0,0 +1,35 @@
+import asyncio
+
+from app.dify.single_flight import SingleFlight
+
+
+def test_leader_mutation_not_visible_to_followers():
+    async def main():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"data": [{"name": "original"}]}
+
+        async def leader():
+            result = await flight.do("key", fetch)
+            result["data"][0]["name"] = "mutated"
+            return result
+
+        async def follower():
+            await asyncio.sleep(0)
+            result = await flight.do("key", fetch)
+            await asyncio.sleep(0.01)
+            return result
+
+        results = await asyncio.gather(leader(), follower(), follower())
+        return calls, flight.stats, results
+
+    calls, stats, (leader_result, *follower_results) = asyncio.run(main())
+    assert calls == 1
+    assert stats == {"leaders": 1, "shared": 2}
+    assert leader_result["data"][0]["name"] == "mutated"
+    assert [r["data"][0]["name"] for r in follower_results] == ["original", "original"]
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import socket
+import time
+
+import httpx
+import pytest
+from pydantic import ValidationError
+
+from app.api.routes import KnowledgeBuildRequest
+from app.services.webhooks import WebhookOutbox, is_private_host
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    async def execute(self):
+        return [await getattr(self.client, name)(*args) for name, args in self.calls]
+
+
+class FakeRedisClient:
+    """WebhookOutbox 用到的 Redis 命令子集"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.zsets = {}
+        self.lists = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field, None)
+
+    async def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    async def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    async def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    async def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    async def ltrim(self, key, start, end):
+        self.lists[key] = self.lists.get(key, [])[start:end + 1]
+
+    async def eval(self, script, numkeys, key, now, limit, lease_until):
+        # 与 _CLAIM_SCRIPT 相同：租用到期的投递并把分数改为租约到期时间
+        zset = self.zsets.get(key, {})
+        ids = sorted((m for m, score in zset.items() if score <= now), key=zset.get)[:limit]
+        for member in ids:
+            zset[member] = lease_until
+        return ids
+
+
+class FakeRedis:
+    def __init__(self):
+        self.client = FakeRedisClient()
+
+    async def get_client(self):
+        return self.client
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    """把域名解析固定为给定地址（默认公网地址），测试不依赖真实 DNS"""
+    addresses = {}
+
+    def fake_getaddrinfo(host, port, *args, **kwargs):
+        address = addresses.get(host, "93.184.216.34")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo)
+    return addresses
+
+
+def _outbox(handler, redis=None, **kwargs):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return WebhookOutbox(redis or FakeRedis(), client, **kwargs)
+
+
+def test_leased_delivery_is_sent_once_and_redelivered_after_lease_expires(resolver):
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(200)
+
+    redis = FakeRedis()
+
+    async def main():
+        first = _outbox(handler, redis, lease=0.05)
+        second = _outbox(handler, redis, lease=0.05)
+        await first.enqueue("https://hooks.example.com/a", "completed", {"task_id": "t1"})
+        handled = await asyncio.gather(first.dispatch_once(), second.dispatch_once())
+        assert sorted(handled) == [0, 1]
+        assert len(sent) == 1
+
+        # 模拟分发器租用后崩溃：租约到期前不会被再次租用，到期后重新投递
+        await first.enqueue("https://hooks.example.com/b", "completed", {"task_id": "t2"})
+        now = time.time()
+        await redis.client.eval("", 1, first.queue_key, now, 10, now + first.lease)
+        assert await second.dispatch_once() == 0
+        await asyncio.sleep(0.1)
+        assert await second.dispatch_once() == 1
+        assert await second.pending() == 0
+
+    asyncio.run(main())
+    assert [r.url.path for r in sent] == ["/a", "/b"]
+
+
+def test_failed_delivery_is_rescheduled_with_backoff(resolver):
+    redis = FakeRedis()
+
+    async def main():
+        outbox = _outbox(lambda request: httpx.Response(500), redis, retry_base=5.0, retry_max=600.0)
+        delivery_id = await outbox.enqueue("https://hooks.example.com/a", "failed", {})
+        before = time.time()
+        assert await outbox.dispatch_once() == 1
+        return outbox, delivery_id, before
+
+    outbox, delivery_id, before = asyncio.run(main())
+    delivery = json.loads(redis.client.hashes[outbox.deliveries_key][delivery_id])
+    assert delivery["attempts"] == 1
+    assert redis.client.zsets[outbox.queue_key][delivery_id] >= before + 5.0
+    assert outbox.stats["retried"] == 1
+    assert [outbox._backoff(n) for n in (1, 2, 3, 10)] == [5.0, 10.0, 20.0, 600.0]
+
+
+def test_delivery_is_dead_lettered_after_max_attempts(resolver):
+    redis = FakeRedis()
+
+    async def main():
+        outbox = _outbox(lambda request: httpx.Response(503), redis, max_attempts=3, retry_base=0.0)
+        await outbox.enqueue("https://hooks.example.com/a", "failed", {})
+        for _ in range(3):
+            assert await outbox.dispatch_once() == 1
+        assert await outbox.dispatch_once() == 0
+        return outbox
+
+    outbox = asyncio.run(main())
+    assert outbox.stats == {"enqueued": 1, "delivered": 0, "retried": 2, "dead": 1}
+    assert redis.client.hashes[outbox.deliveries_key] == {}
+    [dead] = redis.client.lists[outbox.dead_key]
+    assert json.loads(dead)["attempts"] == 3
+
+
+def test_signature_header_is_hmac_of_body(resolver):
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(204)
+
+    async def main():
+        outbox = _outbox(handler, secret="s3cret")
+        await outbox.enqueue("https://hooks.example.com/a", "completed", {"task_id": "t1"})
+        await outbox.dispatch_once()
+
+    asyncio.run(main())
+    [request] = sent
+    expected = hmac.new(b"s3cret", request.content, hashlib.sha256).hexdigest()
+    assert request.headers["X-Webhook-Signature"] == f"sha256={expected}"
+    assert json.loads(request.content)["task_id"] == "t1"
+
+
+@pytest.mark.parametrize("host", ["localhost", "127.0.0.1", "::1", "[::1]", "10.1.2.3",
+                                  "192.168.0.10", "169.254.169.254", "0.0.0.0"])
+def test_private_hosts_are_detected(host):
+    assert is_private_host(host)
+
+
+@pytest.mark.parametrize("host", ["example.com", "93.184.216.34", "2606:4700::1111"])
+def test_public_hosts_are_allowed(host):
+    assert not is_private_host(host)
+
+
+def test_callback_url_to_private_address_is_rejected_by_request_model():
+    with pytest.raises(ValidationError):
+        KnowledgeBuildRequest(dataset_name="d", callback_url="http://127.0.0.1:8080/hook")
+    with pytest.raises(ValidationError):
+        KnowledgeBuildRequest(dataset_name="d", callback_url="http://169.254.169.254/latest/meta-data")
+    assert KnowledgeBuildRequest(dataset_name="d", callback_url="https://hooks.example.com/a").callback_url
+
+
+def test_delivery_resolving_to_private_address_is_dead_lettered_without_request(resolver):
+    resolver["internal.example.com"] = "10.0.0.5"
+    sent = []
+    redis = FakeRedis()
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(200)
+
+    async def main():
+        outbox = _outbox(handler, redis)
+        await outbox.enqueue("https://internal.example.com/hook", "completed", {})
+        await outbox.enqueue("http://127.0.0.1/hook", "completed", {})
+        await outbox.dispatch_once()
+        return outbox
+
+    outbox = asyncio.run(main())
+    assert sent == []
+    dead = [json.loads(raw) for raw in redis.client.lists[outbox.dead_key]]
+    assert len(dead) == 2 and all(d["rejected"] and d["attempts"] == 1 for d in dead)